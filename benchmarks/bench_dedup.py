@@ -0,0 +1,71 @@
+"""Стоимость проверки update_id в UpdateDeduplicator
+
+Поток из возрастающих id (с небольшим перемешиванием, как при параллельных
+запросах вебхука) и ~5% повторных доставок недавних обновлений.
+Для сравнения — полная цена проверки вместе с сохранением отметки в ShardStore.
+
+Запуск: python benchmarks/bench_dedup.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+from dedup import UpdateDeduplicator  # noqa: E402
+
+UPDATES = 500000
+REDELIVERY_RATE = 0.05
+WINDOWS = (1000, 10000, 100000)
+
+
+def update_stream(count, seed=1):
+    rng = random.Random(seed)
+    ids = list(range(1, count + 1))
+    # Соседние обновления могут прийти в обратном порядке
+    for i in range(0, count - 1, 7):
+        ids[i], ids[i + 1] = ids[i + 1], ids[i]
+    stream = []
+    for i, update_id in enumerate(ids):
+        stream.append(update_id)
+        if i > 100 and rng.random() < REDELIVERY_RATE:
+            stream.append(ids[i - rng.randrange(1, 100)])
+    return stream
+
+
+def bench_lookup(window, stream):
+    dedup = UpdateDeduplicator(window=window)
+    check = dedup.is_duplicate
+    now = time.time()
+    started = time.perf_counter()
+    for update_id in stream:
+        check(update_id, now)
+    elapsed = time.perf_counter() - started
+    return elapsed / len(stream), dedup.duplicates
+
+
+def bench_with_store(stream):
+    store = storage.ShardStore(storage.MemoryBackend(), shard_types=('shard_blue',))
+    dedup = UpdateDeduplicator()
+    started = time.perf_counter()
+    for update_id in stream:
+        if not dedup.is_duplicate(update_id):
+            store.set_meta('update_high_water', dedup.dump())
+    return (time.perf_counter() - started) / len(stream)
+
+
+def main():
+    stream = update_stream(UPDATES)
+    redelivered = len(stream) - UPDATES
+    print(f"{len(stream)} проверок, из них {redelivered} повторных доставок")
+    for window in WINDOWS:
+        per_lookup, duplicates = bench_lookup(window, stream)
+        status = 'ok' if duplicates == redelivered else f'пропущено {redelivered - duplicates}'
+        print(f"window={window:>6d}: {per_lookup * 1e9:7.0f} ns/проверка, дубликатов {duplicates} ({status})")
+    print(f"проверка + store.set_meta: {bench_with_store(stream) * 1e9:7.0f} ns/обновление")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Стоимость выбора обработчика: process_new_updates с цепочкой фильтров против Router
+
+Запуск: python benchmarks/bench_dispatch.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telebot import types  # noqa: E402
+from telebot.async_telebot import AsyncTeleBot  # noqa: E402
+
+from dispatcher import Router  # noqa: E402
+from updates import callback_update, message_update  # noqa: E402
+
+SHARD_TYPES = ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']
+BUTTONS = ["📊 Статистика", "📥 Ввести кол-во осколков", "🎉 ВЫПАЛО!", "ℹ️ Информация", "❓ Помощь"]
+ITERATIONS = 20000
+
+
+async def noop(update):
+    pass
+
+
+def legacy_bot():
+    """Те же фильтры и порядок регистрации, что были в bot.py до маршрутизатора"""
+    legacy = AsyncTeleBot('123456:TEST')
+    for command in ('start', 'help', 'stats', 'info_shard'):
+        legacy.message_handler(commands=[command])(noop)
+    legacy.callback_query_handler(func=lambda call: call.data == 'show_stats')(noop)
+    legacy.callback_query_handler(func=lambda call: call.data in SHARD_TYPES)(noop)
+    legacy.callback_query_handler(func=lambda call: call.data.startswith("show_reset_menu_"))(noop)
+    legacy.callback_query_handler(func=lambda call: call.data.startswith("reset_choice_"))(noop)
+    legacy.callback_query_handler(func=lambda call: call.data.startswith("reset_"))(noop)
+    legacy.callback_query_handler(func=lambda call: call.data == "cancel_reset")(noop)
+    for button in BUTTONS:
+        legacy.message_handler(func=lambda message, button=button: message.text == button)(noop)
+    legacy.message_handler(func=lambda message: True)(noop)
+    return legacy
+
+
+def router():
+    routes = Router()
+    routes.command('start', 'help', 'stats', 'info_shard')(noop)
+    routes.callback('show_stats', *SHARD_TYPES, 'cancel_reset')(noop)
+    for prefix in ("show_reset_menu_", "reset_choice_", "reset_"):
+        routes.callback_prefix(prefix)(noop)
+    routes.text(*BUTTONS)(noop)
+    routes.fallback(noop)
+    return routes
+
+
+def sample_updates():
+    raw = [
+        message_update(1, 1, '/start'),
+        message_update(2, 1, '7'),
+        message_update(3, 1, "ℹ️ Информация"),
+        callback_update(4, 1, 'shard_sacred'),
+        callback_update(5, 1, 'reset_shard_void_legendary'),
+        callback_update(6, 1, 'cancel_reset'),
+    ]
+    return [types.Update.de_json(update) for update in raw]
+
+
+async def time_per_update(process, updates):
+    timings = {}
+    for update in updates:
+        key = update.message.text if update.message else update.callback_query.data
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            await process(update)
+        timings[key] = (time.perf_counter() - started) / ITERATIONS
+    return timings
+
+
+async def main():
+    logging.disable(logging.INFO)
+    updates = sample_updates()
+    legacy_instance = legacy_bot()
+    routes = router()
+    legacy = await time_per_update(lambda update: legacy_instance.process_new_updates([update]), updates)
+    routed = await time_per_update(routes.dispatch_update, updates)
+
+    print(f"{'update':32s} {'filter chain':>14s} {'router':>10s}")
+    for key in legacy:
+        print(f"{key:32s} {legacy[key] * 1e6:>11.2f} us {routed[key] * 1e6:>7.2f} us")
+    print(f"{'mean':32s} {sum(legacy.values()) / len(legacy) * 1e6:>11.2f} us "
+          f"{sum(routed.values()) / len(routed) * 1e6:>7.2f} us")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""Выгрузка и загрузка счётчиков на миллионе пользователей: ndjson против binary
+
+Для каждого бэкенда (memory, sqlite) заполняет хранилище и журнал, затем:
+- выгружает в файл обоими форматами — пользователей/с, МБ/с, размер, пик памяти Python;
+- загружает выгрузку в пустое хранилище — пользователей/с;
+- выгружает ещё раз, пока другой поток меняет счётчики (как обработчики живого бота),
+  и сравнивает задержку store.add с задержкой без выгрузки.
+
+Запуск: python benchmarks/bench_export.py --users 1000000 --history 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+import transfer  # noqa: E402
+from history import ADD, RECORD, HistoryLog  # noqa: E402
+
+SHARD_TYPES = transfer.DEFAULT_SHARD_TYPES
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def populate(backend, users, seed=1, batch=50000):
+    rng = random.Random(seed)
+    for start in range(1, users + 1, batch):
+        backend.write_batch({
+            user_id: {shard_type: rng.randint(0, 300) for shard_type in SHARD_TYPES[:rng.randint(1, 4)]}
+            for user_id in range(start, min(users + 1, start + batch))
+        }, {})
+
+
+def write_history(path, users, records, seed=2):
+    rng = random.Random(seed)
+    now = int(time.time())
+    with open(path, 'wb') as log:
+        for start in range(0, records, 100000):
+            log.write(b''.join(
+                RECORD.pack(now, rng.randint(1, users), ADD, rng.randrange(len(SHARD_TYPES)), 0, rng.randint(1, 50))
+                for _ in range(min(100000, records - start))
+            ))
+
+
+def export_to(path, store, history, export_format, trace=False):
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with open(path, 'wb') as target:
+        for chunk in transfer.export_stream(store, history, export_format):
+            target.write(chunk)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def add_latencies(store, users, stop, seed=3):
+    """Как обработчики бота: store.add по случайным пользователям, пока не выставлен stop"""
+    rng = random.Random(seed)
+    latencies = []
+    while not stop.is_set():
+        user_id = rng.randint(1, users)
+        started = time.perf_counter()
+        store.add(user_id, 'shard_blue', 1)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.0005)
+    return latencies
+
+
+def measure_live(store, history, path, users):
+    stop = threading.Event()
+    results = {}
+
+    def run(name):
+        results[name] = add_latencies(store, users, stop)
+
+    worker = threading.Thread(target=run, args=('idle',))
+    worker.start()
+    time.sleep(2)
+    stop.set()
+    worker.join()
+    stop.clear()
+    worker = threading.Thread(target=run, args=('export',))
+    worker.start()
+    elapsed, _ = export_to(path, store, history, 'binary')
+    stop.set()
+    worker.join()
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--history', type=int, default=1000000, help='записей в журнале')
+    parser.add_argument('--backends', default='memory,sqlite')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    history_path = os.path.join(tmpdir, 'history.log')
+    write_history(history_path, args.users, args.history)
+    history = HistoryLog(history_path, SHARD_TYPES)
+    print(f"users: {args.users}, history records: {args.history}")
+
+    for name in args.backends.split(','):
+        if name == 'memory':
+            backend = storage.MemoryBackend()
+            make_target = storage.MemoryBackend
+        else:
+            backend = storage.SQLiteBackend(os.path.join(tmpdir, 'source.db'))
+            make_target = lambda: storage.SQLiteBackend(os.path.join(tmpdir, f"target-{time.time_ns()}.db"))  # noqa: E731
+        started = time.perf_counter()
+        populate(backend, args.users)
+        print(f"\n[{name}] populated in {time.perf_counter() - started:.1f} s")
+        store = storage.ShardStore(backend, SHARD_TYPES)
+
+        for export_format in transfer.FORMATS:
+            path = os.path.join(tmpdir, f"export-{name}.{export_format}")
+            elapsed, _ = export_to(path, store, history, export_format)
+            _, peak = export_to(path, store, history, export_format, trace=True)
+            size = os.path.getsize(path) / 2 ** 20
+            print(f"  export {export_format:6s}: {elapsed:6.2f} s, {args.users / elapsed:9.0f} users/s, "
+                  f"{size / elapsed:6.1f} MB/s, {size:7.1f} MB, python peak {peak / 2 ** 20:.1f} MB")
+
+            target = storage.ShardStore(make_target(), SHARD_TYPES)
+            target_history = HistoryLog(os.path.join(tmpdir, f"import-{name}-{export_format}.log"), SHARD_TYPES)
+            started = time.perf_counter()
+            with open(path, 'rb') as source:
+                result = transfer.import_stream(source, target, target_history)
+            elapsed = time.perf_counter() - started
+            target.close()
+            target_history.close()
+            print(f"  import {export_format:6s}: {elapsed:6.2f} s, {result['users'] / elapsed:9.0f} users/s "
+                  f"+ {result['history']} history records")
+
+        elapsed, latencies = measure_live(store, history, os.path.join(tmpdir, f"live-{name}.binary"), args.users)
+        for label in ('idle', 'export'):
+            ms = [value * 1000 for value in latencies[label]]
+            print(f"  store.add {label:6s}: p50={percentile(ms, 50):.3f} ms p99={percentile(ms, 99):.3f} ms "
+                  f"max={max(ms):.2f} ms ({len(ms)} calls)")
+        print(f"  live binary export took {elapsed:.2f} s")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
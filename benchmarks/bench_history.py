@@ -0,0 +1,104 @@
+"""Журнал осколков: запись событий, ответ /history из агрегатов против прохода по журналу, сжатие
+
+Запуск: python benchmarks/bench_history.py --users 10000 --events 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+from history import ADD, RARITIES, RECORD, HistoryLog  # noqa: E402
+
+SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+
+
+def write_events(log, users, events, seed=1):
+    rng = random.Random(seed)
+    counts = {}
+    started = time.perf_counter()
+    for _ in range(events):
+        user_id = 10 ** 9 + rng.randrange(users)
+        shard_type = rng.choice(SHARD_TYPES)
+        key = (user_id, shard_type)
+        if rng.random() < 0.05:
+            log.record_reset(user_id, shard_type, rng.choice(RARITIES), counts.pop(key, 0))
+        else:
+            count = rng.randint(1, 10)
+            counts[key] = counts.get(key, 0) + count
+            log.record_add(user_id, shard_type, count)
+    log.flush()
+    return time.perf_counter() - started
+
+
+def summary_by_scan(path, user_id):
+    """Как было бы без агрегатов: проход по всему журналу на каждый /history"""
+    opened = {}
+    with open(path, 'rb') as file:
+        for _, record_user, kind, shard, _, amount in RECORD.iter_unpack(file.read()):
+            if record_user == user_id and kind == ADD:
+                opened[shard] = opened.get(shard, 0) + amount
+    return opened
+
+
+def log_sums(path):
+    """Суммы по (пользователь, осколок, вид, редкость) — сжатие не должно их менять"""
+    sums = {}
+    with open(path, 'rb') as file:
+        for _, user_id, kind, shard, rarity, amount in RECORD.iter_unpack(file.read()):
+            key = (user_id, shard, kind, rarity)
+            sums[key] = sums.get(key, 0) + amount
+    return sums
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.log')
+        backend = storage.SQLiteBackend(os.path.join(directory, 'aggregates.db'), namespace='history')
+        log = HistoryLog(path, SHARD_TYPES, backend=backend)
+        elapsed = write_events(log, args.users, args.events)
+        size = os.path.getsize(path)
+        print(f"запись:     {args.events / elapsed:9.0f} событий/с, {size / args.events:.0f} байт/событие, "
+              f"{size / 2 ** 20:.1f} МиБ")
+
+        user_ids = [10 ** 9 + i % args.users for i in range(args.lookups)]
+        started = time.perf_counter()
+        for user_id in user_ids:
+            log.user_summary(user_id)
+        per_lookup = (time.perf_counter() - started) / len(user_ids)
+        started = time.perf_counter()
+        summary_by_scan(path, user_ids[0])
+        per_scan = time.perf_counter() - started
+        print(f"/history:   {per_lookup * 1e6:9.2f} мкс из агрегатов, {per_scan * 1e3:.1f} мс проходом по журналу")
+
+        sums = log_sums(path)
+        started = time.perf_counter()
+        before, after = log.compact()
+        print(f"сжатие:     {before} → {after} записей за {(time.perf_counter() - started) * 1e3:.0f} мс, "
+              f"суммы совпадают: {log_sums(path) == sums}")
+        expected = {user_id: log.user_summary(user_id) for user_id in set(user_ids)}
+        expected_totals = log.totals()
+        log.close()
+
+        # Агрегаты пользователей в бэкенде, старт восстанавливает только итоги частей
+        reloaded = HistoryLog(path, SHARD_TYPES, backend=storage.SQLiteBackend(backend.path, namespace='history'))
+        started = time.perf_counter()
+        reloaded.acquire(range(reloaded.shards))
+        print(f"загрузка:   {(time.perf_counter() - started) * 1e3:9.0f} мс после сжатия")
+        consistent = all(reloaded.user_summary(user_id) == summary for user_id, summary in expected.items())
+        print(f"агрегаты после сжатия и перезагрузки совпадают: {consistent and reloaded.totals() == expected_totals}")
+        reloaded.close()
+
+
+if __name__ == '__main__':
+    main()
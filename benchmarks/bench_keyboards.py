@@ -0,0 +1,58 @@
+"""Микробенчмарк: сборка клавиатур на каждое сообщение против готового JSON
+
+Запуск: python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('STORAGE_URL', 'memory://')
+
+import bot  # noqa: E402
+from telebot.asyncio_helper import _convert_markup  # noqa: E402
+
+NUMBER = 20000
+
+
+def convert(markup):
+    # _convert_markup — то, что telebot делает с reply_markup перед каждым запросом
+    coro = _convert_markup(markup)
+    try:
+        coro.send(None)
+    except StopIteration as result:
+        return result.value
+
+
+CASES = {
+    'reply keyboard': (
+        lambda: convert(bot.create_reply_keyboard()),
+        lambda: convert(bot.REPLY_KEYBOARD),
+    ),
+    'shards keyboard': (
+        lambda: convert(bot.create_shards_keyboard()),
+        lambda: convert(bot.SHARDS_KEYBOARD),
+    ),
+    'reset rarity keyboard': (
+        lambda: convert(bot.create_reset_rarity_keyboard('shard_blue')),
+        lambda: convert(bot.RESET_RARITY_KEYBOARDS['shard_blue']),
+    ),
+    'reset menu button': (
+        lambda: convert(bot.create_reset_menu_keyboard('shard_blue')),
+        lambda: convert(bot.RESET_MENU_KEYBOARDS['shard_blue']),
+    ),
+}
+
+
+def main():
+    assert convert(bot.create_reply_keyboard()) == bot.REPLY_KEYBOARD
+    print(f"{'payload':24s} {'built':>10s} {'cached':>10s} {'saved':>10s}")
+    for name, (built, cached) in CASES.items():
+        built_us = timeit.timeit(built, number=NUMBER) / NUMBER * 1e6
+        cached_us = timeit.timeit(cached, number=NUMBER) / NUMBER * 1e6
+        print(f"{name:24s} {built_us:>7.2f} us {cached_us:>7.2f} us {built_us - cached_us:>7.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Общая статистика: цена обновления при росте числа пользователей и цена запросов /top и /global
+
+Для сравнения — те же ответы полным перебором всех пользователей, как без индексов.
+Отдельно — слияние статистики, посчитанной по --shards шардам (так её собирает журнал).
+
+Запуск: python benchmarks/bench_leaderboard.py --users 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history import RARITIES  # noqa: E402
+from leaderboard import GlobalStats  # noqa: E402
+from sharding import shard_of  # noqa: E402
+
+SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+EVENTS_PER_USER = 3
+
+
+def feed(stats, users, seed=1):
+    """EVENTS_PER_USER событий на пользователя; возвращает (секунд на событие, открыто по пользователям)"""
+    rng = random.Random(seed)
+    opened = [{} for _ in SHARD_TYPES]
+    pulls = [[[] for _ in RARITIES] for _ in SHARD_TYPES]
+    events = users * EVENTS_PER_USER
+    started = time.perf_counter()
+    for i in range(events):
+        user_id = 10 ** 9 + i % users
+        shard = rng.randrange(len(SHARD_TYPES))
+        if rng.random() < 0.1:
+            rarity, value = rng.randrange(len(RARITIES)), rng.randint(0, 220)
+            stats.on_reset(user_id, shard, rarity, value)
+            pulls[shard][rarity].append(value)
+        else:
+            total = opened[shard][user_id] = opened[shard].get(user_id, 0) + rng.randint(1, 10)
+            stats.on_add(user_id, shard, total)
+    return (time.perf_counter() - started) / events, opened, pulls
+
+
+class Sharded:
+    """Раскладывает события по статистике шарда пользователя, как части журнала"""
+
+    def __init__(self, shards, top_k):
+        self.parts = [GlobalStats(SHARD_TYPES, RARITIES, top_k=top_k) for _ in range(shards)]
+
+    def on_add(self, user_id, shard, opened):
+        self.parts[shard_of(user_id, len(self.parts))].on_add(user_id, shard, opened)
+
+    def on_reset(self, user_id, shard, rarity, pulls):
+        self.parts[shard_of(user_id, len(self.parts))].on_reset(user_id, shard, rarity, pulls)
+
+
+def timed(function, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - started) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--shards', type=int, default=64)
+    args = parser.parse_args()
+
+    for users in args.users:
+        stats = GlobalStats(SHARD_TYPES, RARITIES, top_k=args.top)
+        per_event, opened, pulls = feed(stats, users)
+        print(f"{users} пользователей: обновление {per_event * 1e6:.2f} мкс/событие")
+
+        per_top, top = timed(lambda: stats.top_users('shard_blue', args.top), 1000)
+        per_scan, expected = timed(
+            lambda: sorted(opened[0].items(), key=lambda item: -item[1])[:args.top], 1
+        )
+        same = [score for _, score in top] == [score for _, score in expected]
+        print(f"   /top:    {per_top * 1e6:9.1f} мкс (перебор {per_scan * 1e3:.0f} мс), совпадает: {same}")
+
+        per_global, (_, mean, percentiles) = timed(lambda: stats.pulls_summary('shard_blue', 'legendary'), 1000)
+        values = sorted(pulls[0][1])
+        exact = {q: values[int(q / 100 * (len(values) - 1))] for q in percentiles}
+        error = max(abs(percentiles[q] - exact[q]) / max(1, exact[q]) for q in percentiles)
+        print(f"   /global: {per_global * 1e6:9.1f} мкс, среднее {mean:.1f}, перцентили "
+              f"{ {q: round(value) for q, value in percentiles.items()} } (точные {exact}, погрешность {error:.1%})")
+
+        sharded = Sharded(args.shards, args.top)
+        feed(sharded, users)
+
+        def merge():
+            merged = GlobalStats(SHARD_TYPES, RARITIES, top_k=args.top)
+            for part in sharded.parts:
+                merged.merge(part)
+            return merged
+        per_merge, merged = timed(merge, 10)
+        # Счета, а не ключи: кто из равных на последних местах попал в первые k, зависит от порядка событий
+        same = all(
+            [score for _, score in merged.top_users(shard_type, args.top)]
+            == [score for _, score in stats.top_users(shard_type, args.top)]
+            and merged.pulls_summary(shard_type, rarity) == stats.pulls_summary(shard_type, rarity)
+            for shard_type in SHARD_TYPES for rarity in RARITIES
+        )
+        print(f"   слияние {args.shards} шардов: {per_merge * 1e3:.1f} мс, совпадает с общей: {same}")
+
+
+if __name__ == '__main__':
+    main()
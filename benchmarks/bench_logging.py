@@ -0,0 +1,105 @@
+"""Цена логирования в обработчике: синхронный вывод против очереди с фоновым потоком
+
+Каждое «обновление» пишет две записи INFO, как обработчик бота. Вывод — в файл,
+каждая запись в который стоит --sink-latency (как stdout контейнера, который
+читает сборщик логов). Сравниваются задержки самого вызова логгера.
+
+Запуск: python benchmarks/bench_logging.py --updates 50000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import logs  # noqa: E402
+
+logger = logging.getLogger('bench')
+
+
+class SlowStream:
+    """Поток вывода, запись в который блокирует на latency секунд (без GIL, как настоящий write)"""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def run_eager(updates):
+    """Как было: f-строка форматируется всегда, запись — в вызывающем потоке"""
+    latencies = []
+    for update_id in range(updates):
+        started = time.perf_counter()
+        logger.info(f"📥 Обновление {update_id} от пользователя {update_id % 1000}: {{'text': '5'}}")
+        logger.info(f"📤 Ответ на обновление {update_id} поставлен в очередь")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_lazy(updates):
+    latencies = []
+    for update_id in range(updates):
+        started = time.perf_counter()
+        logs.bind_update(update_id)
+        logger.info("📥 Обновление %s от пользователя %s: %s", update_id, update_id % 1000, {'text': '5'})
+        logger.info("📤 Ответ на обновление %s поставлен в очередь", update_id)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(name, latencies):
+    us = [value * 1e6 for value in latencies]
+    print(f"{name:28s} p50={percentile(us, 50):6.1f} p99={percentile(us, 99):7.1f} "
+          f"max={max(us):8.1f} mean={statistics.mean(us):6.1f} мкс/обновление")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--sink-latency', type=float, default=0.0001, help='цена одной записи в вывод, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'sync.log'), 'w', encoding='utf-8') as sink:
+            root = logging.getLogger()
+            handler = logging.StreamHandler(SlowStream(sink, args.sink_latency))
+            handler.setFormatter(logging.Formatter(logs.TEXT_FORMAT))
+            root.handlers = [handler]
+            root.setLevel(logging.INFO)
+            report('синхронно, f-строки', run_eager(args.updates))
+
+        for name, json_format, sample_rate in (
+            ('очередь, текст', False, 1.0),
+            ('очередь, JSON', True, 1.0),
+            ('очередь, JSON, выборка 10%', True, 0.1),
+        ):
+            with open(os.path.join(directory, 'queued.log'), 'w', encoding='utf-8') as sink:
+                pipeline = logs.setup(
+                    json_format=json_format, sample_rate=sample_rate, max_queue=1000000,
+                    stream=SlowStream(sink, args.sink_latency)
+                )
+                report(name, run_lazy(args.updates))
+                started = time.perf_counter()
+                pipeline.stop()
+                print(f"{'':28s} фоновый поток дописал остаток за {(time.perf_counter() - started) * 1e3:.0f} мс, "
+                      f"отброшено {pipeline.dropped}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Память на пользователя: словарь словарей против CounterTable
+
+Запуск: python benchmarks/bench_memory.py --sizes 10000 100000 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from counters import CounterTable  # noqa: E402
+
+SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+
+
+def user_rows(count):
+    rng = random.Random(count)
+    # id пользователей Telegram — большие числа, не попадают в кэш малых int
+    for user_id in rng.sample(range(10 ** 9, 8 * 10 ** 9), count):
+        yield user_id, {shard_type: rng.randint(0, 250) for shard_type in SHARD_TYPES}
+
+
+def build_dicts(rows):
+    data = {}
+    for user_id, counts in rows:
+        data[user_id] = dict(counts)
+    return data
+
+
+def build_table(rows):
+    table = CounterTable(SHARD_TYPES)
+    for user_id, counts in rows:
+        table.insert(user_id, counts)
+    return table
+
+
+def measure(build, count):
+    rows = list(user_rows(count))
+    gc.collect()
+    tracemalloc.start()
+    structure = build(rows)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return structure, current
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'users':>9} {'dict-of-dicts':>16} {'CounterTable':>16} {'ratio':>7} {'dump':>12}")
+    for count in args.sizes:
+        dicts, dict_bytes = measure(build_dicts, count)
+        del dicts
+        table, table_bytes = measure(build_table, count)
+        started = time.perf_counter()
+        user_ids, rows = table.dump()
+        dump_ms = (time.perf_counter() - started) * 1000
+        print(f"{count:>9} {dict_bytes / count:>12.1f} B/u {table_bytes / count:>12.1f} B/u "
+              f"{dict_bytes / table_bytes:>6.1f}x {dump_ms:>9.1f} ms")
+        del table, user_ids, rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Калькулятор mercy: стоимость запроса и сверка с методом Монте-Карло
+
+Запуск: python benchmarks/bench_mercy.py --trials 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mercy  # noqa: E402
+from mercy import MercyRule, MercyTable  # noqa: E402
+
+RULES = {
+    'ancient epic': MercyRule(0.08, 20, 0.02),
+    'ancient legendary': MercyRule(0.005, 200, 0.05),
+    'primal mythic': MercyRule(0.005, 200, 0.10),
+    'sacred legendary': MercyRule(0.06, 12, 0.02),
+}
+COUNTS = (0, 15, 150, 205)
+
+
+def simulate(rule, count, rng):
+    """Число открытий до выпадения — открытие за открытием"""
+    pulls = 0
+    while True:
+        pulls += 1
+        k = count + pulls
+        if rng.random() < rule.base + rule.step * max(0, k - rule.threshold):
+            return pulls
+
+
+def monte_carlo(rule, count, trials, rng):
+    samples = sorted(simulate(rule, count, rng) for _ in range(trials))
+    percentiles = {q: samples[max(0, -(-q * trials // 100) - 1)] for q in mercy.PERCENTILES}
+    return sum(samples) / trials, percentiles
+
+
+def bench(rule, count, repeats=100000):
+    started = time.perf_counter()
+    MercyTable(rule)
+    build = time.perf_counter() - started
+    mercy.forecast.cache_clear()
+    table = mercy.table_for(rule)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        table.expected(count)
+        for q in mercy.PERCENTILES:
+            table.percentile(count, q)
+    uncached = (time.perf_counter() - started) / repeats
+    mercy.forecast(rule, count)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        mercy.forecast(rule, count)
+    cached = (time.perf_counter() - started) / repeats
+    return build, uncached, cached
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trials', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    for name, rule in RULES.items():
+        build, uncached, cached = bench(rule, COUNTS[0])
+        print(f"{name}: таблица {build * 1e6:.0f} мкс, запрос {uncached * 1e6:.2f} мкс, из кэша {cached * 1e6:.2f} мкс")
+        for count in COUNTS:
+            _, expected, percentiles = mercy.forecast(rule, count)
+            mc_expected, mc_percentiles = monte_carlo(rule, count, args.trials, rng)
+            deviation = abs(expected - mc_expected) / expected
+            print(f"   счётчик {count:3d}: среднее {expected:7.2f} (МК {mc_expected:7.2f}, отклонение {deviation:.2%}), "
+                  f"перцентили {percentiles} (МК {mc_percentiles})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Цена метрик: диспетчеризация обновления без наблюдателя и с гистограммой на обработчик
+
+Запуск: python benchmarks/bench_metrics.py --updates 200000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import metrics  # noqa: E402
+from dispatcher import Router  # noqa: E402
+
+
+def build_router():
+    router = Router()
+
+    @router.command('start')
+    async def send_welcome(message):
+        pass
+
+    @router.fallback
+    async def handle_message(message):
+        pass
+
+    return router
+
+
+def make_updates(count, users=1000):
+    updates = []
+    for update_id in range(count):
+        user = SimpleNamespace(id=1000 + update_id % users)
+        text = '/start' if update_id % 2 else str(update_id % 10)
+        message = SimpleNamespace(text=text, from_user=user)
+        updates.append(SimpleNamespace(update_id=update_id, message=message, callback_query=None))
+    return updates
+
+
+async def dispatch_all(router, updates):
+    started = time.perf_counter()
+    for update in updates:
+        await router.dispatch_update(update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=200000)
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates)
+    registry = metrics.Registry()
+    seconds = registry.histogram('bot_handler_duration_seconds', 'Время выполнения обработчика', ('handler',))
+    errors = registry.counter('bot_handler_errors', 'Исключения в обработчиках', ('handler',))
+
+    def observe(handler, elapsed, error):
+        seconds.labels(handler.__name__).observe(elapsed)
+        if error is not None:
+            errors.labels(handler.__name__).inc()
+
+    plain = build_router()
+    instrumented = build_router()
+    instrumented.observer = observe
+    # Чередуем, чтобы прогрев и шум не достались одному варианту
+    runs = {'без метрик': [], 'с метриками': []}
+    for _ in range(3):
+        runs['без метрик'].append(asyncio.run(dispatch_all(plain, updates)))
+        runs['с метриками'].append(asyncio.run(dispatch_all(instrumented, updates)))
+    base = min(runs['без метрик'])
+    for name, values in runs.items():
+        best = min(values)
+        print(f"{name:12s} {best * 1e6:6.2f} мкс/обновление (+{(best - base) * 1e9:5.0f} нс)")
+
+    child = seconds.labels('send_welcome')
+    started = time.perf_counter()
+    for _ in range(args.updates):
+        child.observe(0.003)
+    print(f"observe():   {(time.perf_counter() - started) / args.updates * 1e9:6.0f} нс")
+    started = time.perf_counter()
+    text = registry.render()
+    print(f"/metrics:    {(time.perf_counter() - started) * 1e3:6.2f} мс, {len(text)} байт")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Влияние Outbox на задержку ответа пользователю против последовательных await
+
+Каждое обновление делает то же, что handle_reset_shard: answerCallbackQuery и sendMessage.
+Режимы: serial — await по очереди, как было; outbox — конкурентно с порядком по чатам;
+inline — ответ на callback уходит в теле ответа вебхука.
+
+Запуск: python benchmarks/bench_outgoing.py --updates 2000 --chats 200 --rate 500 --api-latency 0.03
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telebot import asyncio_helper  # noqa: E402
+from telebot.async_telebot import AsyncTeleBot  # noqa: E402
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from outgoing import Outbox, WebhookReply, bind_webhook_reply  # noqa: E402
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+async def serial(bot, outbox, update_id, chat_id):
+    await bot.answer_callback_query(str(update_id), "Счётчик сброшен!")
+    await bot.send_message(chat_id, f"update {update_id}")
+
+
+async def concurrent(bot, outbox, update_id, chat_id):
+    outbox.answer_callback(str(update_id), "Счётчик сброшен!")
+    await outbox.send_message(chat_id, f"update {update_id}")
+
+
+async def inline(bot, outbox, update_id, chat_id):
+    bind_webhook_reply(WebhookReply())
+    await concurrent(bot, outbox, update_id, chat_id)
+
+
+async def run_mode(handler, args):
+    bot = AsyncTeleBot('123456:TEST')
+    outbox = Outbox(bot)
+    latencies = []
+
+    async def one(update_id):
+        # Обновления приходят равномерно с частотой --rate, а не все разом
+        await asyncio.sleep(update_id / args.rate)
+        started = time.perf_counter()
+        await handler(bot, outbox, update_id, 1000 + update_id % args.chats)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(update_id) for update_id in range(args.updates)))
+    await outbox.drain()
+    elapsed = time.perf_counter() - started
+    await asyncio_helper.session_manager.session.close()
+    return elapsed, latencies
+
+
+def check_order(api, chats):
+    """sendMessage в каждый чат должны приходить в порядке update_id"""
+    last = {}
+    for method, params in api.requests:
+        if method != 'sendMessage':
+            continue
+        chat_id, update_id = int(params['chat_id']), int(params['text'].split()[1])
+        if last.get(chat_id, -1) > update_id:
+            return False
+        last[chat_id] = update_id
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=500, help='обновлений в секунду')
+    parser.add_argument('--api-latency', type=float, default=0.03)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':8s} {'updates/s':>10s} {'p50 ms':>8s} {'p99 ms':>8s} {'API calls':>10s} {'ordered':>8s}")
+    for name, handler in (('serial', serial), ('outbox', concurrent), ('inline', inline)):
+        api = FakeBotAPI(latency=args.api_latency, record=True).start()
+        asyncio_helper.API_URL = api.api_url
+        elapsed, latencies = asyncio.run(run_mode(handler, args))
+        ms = [value * 1000 for value in latencies]
+        print(f"{name:8s} {args.updates / elapsed:>10.0f} {percentile(ms, 50):>8.1f} {percentile(ms, 99):>8.1f} "
+              f"{api.total_calls():>10d} {str(check_order(api, args.chats)):>8s}")
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
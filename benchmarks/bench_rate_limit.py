@@ -0,0 +1,97 @@
+"""Проверка лимитов Outbox и повторов на 429 против заглушки Bot API
+
+Отправляет пачку сообщений в несколько чатов, заглушка отвечает 429 на часть запросов.
+Выводит фактическую частоту (общую и на чат), число повторов и потерь, порядок в чатах.
+
+Запуск: python benchmarks/bench_rate_limit.py --messages 120 --chats 6 --flood 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telebot import asyncio_helper  # noqa: E402
+from telebot.async_telebot import AsyncTeleBot  # noqa: E402
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from outgoing import Outbox  # noqa: E402
+
+
+async def run(api, args):
+    bot = AsyncTeleBot('123456:TEST')
+    outbox = Outbox(bot, global_rate=args.global_rate, chat_rate=args.chat_rate, chat_burst=args.chat_burst)
+    sent_at = []
+    original = bot.send_message
+
+    async def send_and_record(chat_id, text, **kwargs):
+        result = await original(chat_id, text, **kwargs)
+        sent_at.append((time.perf_counter(), chat_id))
+        return result
+
+    bot.send_message = send_and_record
+    api.inject_429(args.flood, retry_after=args.retry_after)
+    max_depth = 0
+    started = time.perf_counter()
+    for i in range(args.messages):
+        outbox.send_message(1000 + i % args.chats, f"message {i}")
+        max_depth = max(max_depth, outbox.stats()['pending'])
+    await outbox.drain()
+    elapsed = time.perf_counter() - started
+    await asyncio_helper.session_manager.session.close()
+    return outbox, sent_at, elapsed, max_depth
+
+
+def max_rate(times, window=1.0):
+    """Максимум вызовов в любом окне длиной window секунд"""
+    best, left = 0, 0
+    for right in range(len(times)):
+        while times[right] - times[left] > window:
+            left += 1
+        best = max(best, right - left + 1)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=120)
+    parser.add_argument('--chats', type=int, default=6)
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--chat-rate', type=float, default=1)
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--flood', type=int, default=10, help='сколько запросов получат 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    api = FakeBotAPI(record=True).start()
+    asyncio_helper.API_URL = api.api_url
+    outbox, sent_at, elapsed, max_depth = asyncio.run(run(api, args))
+    api.stop()
+
+    times = sorted(at for at, _ in sent_at)
+    per_chat = {}
+    for at, chat_id in sorted(sent_at):
+        per_chat.setdefault(chat_id, []).append(at)
+    ordered = True
+    last = {}
+    for method, params in api.requests:
+        chat_id, number = int(params['chat_id']), int(params['text'].split()[1])
+        ordered &= last.get(chat_id, -1) < number
+        last[chat_id] = number
+
+    stats = outbox.stats()
+    print(f"delivered:        {api.calls['sendMessage']}/{args.messages} in {elapsed:.1f} s")
+    print(f"429 returned:     {sum(api.rejected.values())}, retries: {stats['retries']}, drops: {stats['drops']}")
+    print(f"max queue depth:  {max_depth}")
+    print(f"peak global rate: {max_rate(times)} msg/s (limit {args.global_rate:g})")
+    print(f"peak chat rate:   {max(max_rate(chat_times) for chat_times in per_chat.values())} msg/s "
+          f"(limit {args.chat_rate:g}, burst {args.chat_burst})")
+    print(f"per-chat order:   {'ok' if ordered else 'BROKEN'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Время запуска: импорт bot.py по модулям и момент, когда порт открыт и /ready отвечает 200
+
+Бот запускается как `python bot.py` против заглушки Bot API, которая отвечает
+с задержкой --api-latency, и с журналом осколков на --history записей: порт должен
+открыться сразу, а /ready — после установки вебхука и загрузки журнала.
+
+Запуск: python benchmarks/bench_startup.py --api-latency 2 --history 5000000
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from history import ADD, RECORD, RESET  # noqa: E402
+
+# Запуск bot.py как __main__, но с Bot API на заглушке
+LAUNCHER = (
+    "import runpy, sys; from telebot import asyncio_helper; asyncio_helper.API_URL = sys.argv[1]; "
+    "runpy.run_path('bot.py', run_name='__main__')"
+)
+
+
+def child_env(**extra):
+    env = dict(os.environ, BOT_TOKEN='123456:TEST', STORAGE_URL='memory://', KOYEB_APP_DOMAIN='bench.local')
+    env.update(extra)
+    return env
+
+
+def import_profile(top):
+    """Время импорта модулей, которые импортирует bot.py, по python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import bot'],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Вложенные импорты сдвинуты на два пробела на уровень; строка заголовка — не число.
+        # bot — последняя строка верхнего уровня, модули под ним сдвинуты на один уровень
+        if cumulative_us.strip().isdigit() and name.startswith('   ') and not name[3:].startswith(' '):
+            cumulative[name.strip()] = int(cumulative_us)
+        elif cumulative_us.strip().isdigit() and name.strip() == 'bot':
+            total = int(cumulative_us)
+    print(f"импорт bot.py: {total / 1000:.0f} мс")
+    for name, value in sorted(cumulative.items(), key=lambda item: -item[1])[:top]:
+        print(f"   {name:30s} {value / 1000:7.1f} мс")
+
+
+def write_history(path, records, users=100000, seed=1):
+    rng = random.Random(seed)
+    with open(path, 'wb') as log:
+        for start in range(0, records, 100000):
+            log.write(b''.join(
+                RECORD.pack(0, rng.randint(1, users), ADD, rng.randrange(4), 0, rng.randint(1, 50))
+                if rng.random() < 0.9 else
+                RECORD.pack(0, rng.randint(1, users), RESET, rng.randrange(4), rng.randrange(3), rng.randint(1, 200))
+                for _ in range(min(100000, records - start))
+            ))
+
+
+def wait_port(port, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def get_status(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+    try:
+        conn.request('GET', path)
+        return conn.getresponse().status
+    except OSError:
+        return None
+    finally:
+        conn.close()
+
+
+def startup(api, timeout, history_records):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    with tempfile.TemporaryDirectory() as directory:
+        if history_records:
+            write_history(os.path.join(directory, 'history.log'), history_records)
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-c', LAUNCHER, api.api_url],
+            cwd=ROOT, env=child_env(PORT=str(port), HISTORY_PATH=os.path.join(directory, 'history.log')),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            deadline = started + timeout
+            if not wait_port(port, deadline):
+                print("порт так и не открылся")
+                return
+            bound = time.perf_counter() - started
+            not_ready = get_status(port, '/ready')
+            while get_status(port, '/ready') != 200 and time.perf_counter() < deadline:
+                time.sleep(0.02)
+            ready = time.perf_counter() - started
+            print(f"порт открыт через {bound * 1000:.0f} мс (/ready тогда: {not_ready}), "
+                  f"готов через {ready * 1000:.0f} мс; вызовы API: {dict(api.calls)}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--api-latency', type=float, default=2.0, help='задержка заглушки Bot API, с')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--history', type=int, default=5000000, help='записей в журнале осколков при старте')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    import_profile(args.top)
+    api = FakeBotAPI(latency=args.api_latency).start()
+    print(f"первый запуск (вебхук ещё не установлен, журнал {args.history} записей):")
+    startup(api, args.timeout, args.history)
+    print("повторный запуск (getWebhookInfo уже совпадает, setWebhook не нужен):")
+    startup(api, args.timeout, args.history)
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Сравнение бэкендов хранилища: пакетная запись против записи на каждое обновление
+
+Запуск: python benchmarks/bench_storage.py --users 10000 --updates 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+from fake_redis import FakeRedis  # noqa: E402
+
+SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+
+
+def run(store, operations):
+    started = time.perf_counter()
+    for user_id, shard_type, delta in operations:
+        store.add(user_id, shard_type, delta)
+    store.flush()
+    return time.perf_counter() - started
+
+
+def run_unbatched(backend, operations):
+    """Как было бы без кэша: чтение и запись в бэкенд на каждое обновление"""
+    started = time.perf_counter()
+    for user_id, shard_type, delta in operations:
+        counts, _ = backend.load(user_id)
+        counts[shard_type] = counts.get(shard_type, 0) + delta
+        backend.write_batch({user_id: counts}, {})
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    operations = [
+        (rng.randrange(args.users), rng.choice(SHARD_TYPES), rng.randint(1, 10))
+        for _ in range(args.updates)
+    ]
+    expected = {}
+    for user_id, shard_type, delta in operations:
+        expected.setdefault(user_id, {}).setdefault(shard_type, 0)
+        expected[user_id][shard_type] += delta
+
+    tmpdir = tempfile.mkdtemp()
+    redis = FakeRedis().start()
+    backends = {
+        'memory': lambda: storage.MemoryBackend(),
+        'sqlite': lambda: storage.SQLiteBackend(os.path.join(tmpdir, f"bench-{time.time_ns()}.db")),
+        'redis (stand-in)': lambda: storage.create_backend(redis.url),
+    }
+    for name, factory in backends.items():
+        store = storage.ShardStore(factory(), SHARD_TYPES, max_dirty=args.users)
+        elapsed = run(store, operations)
+        # Проверяем, что после сброса бэкенд отдаёт те же данные
+        sample = rng.sample(sorted(expected), min(100, len(expected)))
+        assert all(store.backend.load(user_id)[0] == expected[user_id] for user_id in sample), name
+        store.close()
+        print(f"{name:18s} batched:   {args.updates / elapsed:>10.0f} updates/s")
+
+    unbatched_ops = operations[:min(len(operations), 5000)]
+    for name in ('sqlite', 'redis (stand-in)'):
+        backend = backends[name]()
+        elapsed = run_unbatched(backend, unbatched_ops)
+        backend.close()
+        print(f"{name:18s} unbatched: {len(unbatched_ops) / elapsed:>10.0f} updates/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""Сквозной прогон бота: /webhook -> обработчики -> заглушка Bot API, с проверкой итоговых счётчиков
+
+Поток обновлений — синтетический (updates.realistic_stream: /start, кнопки, выбор осколка,
+ввод числа, сбросы, повторные доставки) или записанный в продакшене
+(UPDATES_RECORD_PATH=updates.jsonl, затем --replay updates.jsonl). Обновления отправляются
+в /webhook из --concurrency потоков; все обновления одного пользователя идут через один поток
+по порядку, как их присылает Telegram. Параллельно тот же поток проигрывается эталонной
+моделью (Expected) — в конце счётчики и агрегаты журнала каждого пользователя сверяются с ней.
+
+Выводит пропускную способность, перцентили задержки ответа вебхука и обработки
+(от передачи в event loop до конца обработчика), память процесса и расхождения.
+Код выхода 1, если есть расхождения или исключения в обработчиках и вызовах Bot API.
+
+Запуск:
+    python benchmarks/e2e.py --updates 20000 --users 2000 --concurrency 16
+    python benchmarks/e2e.py --replay updates.jsonl
+    python benchmarks/e2e.py --updates 5000 --save stream.jsonl   # сохранить поток для --replay
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('STORAGE_URL', 'memory://')
+# Меряем сам бот, а не лимиты Telegram; ожидание ввода не должно истечь посреди прогона
+os.environ.setdefault('OUTGOING_GLOBAL_RATE', '1000000')
+os.environ.setdefault('OUTGOING_CHAT_RATE', '1000000')
+os.environ.setdefault('PENDING_INPUT_TTL_MINUTES', '1000000')
+# Не logging.disable: запись обновлений (UPDATES_RECORD_PATH) идёт через логгер уровня INFO
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from dedup import UpdateDeduplicator  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from history import RARITIES  # noqa: E402
+from load_webhook import percentile, start_webhook_server  # noqa: E402
+from updates import SHARD_TYPES, realistic_stream  # noqa: E402
+
+BUTTONS = frozenset(('📊 Статистика', '📥 Ввести кол-во осколков', '🎉 ВЫПАЛО!', 'ℹ️ Информация', '❓ Помощь'))
+
+
+def read_updates(path):
+    """Обновления из JSONL-файла (как пишет UPDATES_RECORD_PATH), можно .gz"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+def user_of(update):
+    for key in ('message', 'callback_query'):
+        item = update.get(key)
+        if item is not None:
+            return item.get('from', {}).get('id')
+    return None
+
+
+class Expected:
+    """Эталон: что должно оказаться в хранилище и журнале после обработки потока
+
+    Повторяет ветвления обработчиков bot.py, которые меняют состояние: выбор осколка
+    ставит ожидание ввода, число ≥ 0 при ожидании прибавляется и снимает его,
+    reset_{осколок}_{редкость} обнуляет счётчик. Повторы отсекаются тем же UpdateDeduplicator.
+    """
+
+    def __init__(self, dedup_window):
+        self.dedup = UpdateDeduplicator(window=dedup_window)
+        self.counts = {}    # {user_id: {shard_type: count}}
+        self.pending = {}   # {user_id: shard_type}
+        self.history = {}   # {user_id: {shard_type: [открыто, {rarity: [раз, сумма]}]}}
+        self.processed = 0
+
+    def _history(self, user_id, shard_type):
+        shards = self.history.setdefault(user_id, {})
+        return shards.setdefault(shard_type, [0, {}])
+
+    def apply(self, update):
+        if self.dedup.is_duplicate(update['update_id']):
+            return
+        self.processed += 1
+        message = update.get('message')
+        if message is not None:
+            self._message(message['from']['id'], message.get('text'))
+            return
+        call = update.get('callback_query')
+        if call is not None:
+            self._callback(call['from']['id'], call.get('data'))
+
+    def _message(self, user_id, text):
+        # Команды и кнопки состояние не меняют; остальное попадает в handle_message
+        if text is None or text.startswith('/') or text in BUTTONS:
+            return
+        shard_type = self.pending.get(user_id)
+        if shard_type is None:
+            return
+        try:
+            count = int(text.strip())
+        except ValueError:
+            return
+        if count < 0:
+            return
+        counts = self.counts.setdefault(user_id, {})
+        counts[shard_type] = counts.get(shard_type, 0) + count
+        self._history(user_id, shard_type)[0] += count
+        del self.pending[user_id]
+
+    def _callback(self, user_id, data):
+        if data is None:
+            return
+        if data in SHARD_TYPES:
+            self.pending[user_id] = data
+            return
+        if not data.startswith('reset_') or data.startswith('reset_choice_'):
+            return
+        parts = data.split('_', 3)
+        if len(parts) != 4 or f"{parts[1]}_{parts[2]}" not in SHARD_TYPES:
+            return
+        shard_type, rarity = f"{parts[1]}_{parts[2]}", parts[3]
+        counts = self.counts.setdefault(user_id, {})
+        if rarity in RARITIES and counts.get(shard_type, 0) > 0:
+            drops = self._history(user_id, shard_type)[1].setdefault(rarity, [0, 0])
+            drops[0] += 1
+            drops[1] += counts[shard_type]
+        counts[shard_type] = 0
+
+    def user_counts(self, user_id):
+        counts = self.counts.get(user_id, {})
+        return {shard_type: counts.get(shard_type, 0) for shard_type in SHARD_TYPES}
+
+    def user_summary(self, user_id):
+        """В формате HistoryLog.user_summary"""
+        shards = self.history.get(user_id)
+        if shards is None:
+            return None
+        summary = {}
+        for shard_type in SHARD_TYPES:
+            opened, drops = shards.get(shard_type, (0, {}))
+            summary[shard_type] = {
+                'opened': opened,
+                'drops': {rarity: (times, total / times) for rarity, (times, total) in drops.items()},
+            }
+        return summary
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def post_lanes(port, payloads_by_lane):
+    """Каждый поток по порядку отправляет свою дорожку; возвращает задержки ответов, с"""
+    latencies = []
+    lock = threading.Lock()
+
+    def run(payloads):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        local = []
+        for body in payloads:
+            started = time.perf_counter()
+            conn.request('POST', '/webhook', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=run, args=(payloads,)) for payloads in payloads_by_lane if payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def wait_processed(bot, expected_total, timeout=120.0):
+    deadline = time.perf_counter() + timeout
+    while bot.UPDATES_FINISHED.labels().value < expected_total and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return bot.UPDATES_FINISHED.labels().value
+
+
+def error_counts(counter):
+    """{значение метки: сколько раз} по ненулевым сериям счётчика ошибок бота"""
+    _, _, _, samples = counter.collect()
+    return {values[0]: value for _, _, values, value in samples if value}
+
+
+def compare(bot, expected, user_ids, show=5):
+    """[(user_id, что, в боте, в эталоне)] по всем расхождениям"""
+    diffs = []
+    for user_id in user_ids:
+        actual, wanted = bot.store.get_counts(user_id), expected.user_counts(user_id)
+        actual = {shard_type: actual.get(shard_type, 0) for shard_type in SHARD_TYPES}
+        if actual != wanted:
+            diffs.append((user_id, 'counts', actual, wanted))
+        actual, wanted = bot.history.user_summary(user_id), expected.user_summary(user_id)
+        if actual != wanted:
+            diffs.append((user_id, 'history', actual, wanted))
+    for user_id, what, actual, wanted in diffs[:show]:
+        print(f"  ✗ {user_id} {what}: бот {actual}, эталон {wanted}")
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка заглушки Bot API, с')
+    parser.add_argument('--replay', help='JSONL с записанными обновлениями (UPDATES_RECORD_PATH)')
+    parser.add_argument('--save', help='сохранить сгенерированный поток в JSONL для --replay')
+    parser.add_argument('--tracemalloc', action='store_true', help='пик памяти Python-объектов (медленнее)')
+    args = parser.parse_args()
+
+    if args.replay:
+        updates = read_updates(args.replay)
+        if not updates:
+            parser.error(f"в {args.replay} нет обновлений")
+        source = f"replay {args.replay}"
+    else:
+        updates = list(realistic_stream(args.updates, users=args.users, seed=args.seed))
+        source = f"synthetic, {args.users} users, seed {args.seed}"
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as target:
+                for update in updates:
+                    target.write(json.dumps(update, ensure_ascii=False) + '\n')
+
+    workdir = tempfile.mkdtemp(prefix='e2e-')
+    os.environ.setdefault('HISTORY_PATH', os.path.join(workdir, 'history.log'))
+    api = FakeBotAPI(latency=args.api_latency).start()
+    from telebot import asyncio_helper
+    asyncio_helper.API_URL = api.api_url
+    import bot
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    expected = Expected(bot.UPDATE_DEDUP_WINDOW)
+    for update in updates:
+        expected.apply(update)
+
+    # Задержка обработки: от передачи в event loop до конца обработчиков
+    processing = []
+    submit_update = bot.submit_update
+
+    def timed_submit(update, webhook_reply=None):
+        started = time.perf_counter()
+        future = submit_update(update, webhook_reply)
+        future.add_done_callback(lambda _: processing.append(time.perf_counter() - started))
+        return future
+    bot.submit_update = timed_submit
+
+    lanes = [[] for _ in range(args.concurrency)]
+    for update in updates:
+        key = user_of(update)
+        lanes[(key if key is not None else update['update_id']) % args.concurrency].append(
+            json.dumps(update, ensure_ascii=False).encode())
+
+    bot.ensure_event_loop()
+    server = start_webhook_server(bot.app)
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    latencies = post_lanes(server.server_port, lanes)
+    acked = time.perf_counter() - started
+    finished = wait_processed(bot, expected.processed)
+    handled = time.perf_counter() - started
+    api.wait_idle()
+    delivered = (api.last_call_at or started) - started
+
+    rss_after = rss_mb()
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    bot.history.flush()
+    user_ids = sorted({user_of(update) for update in updates} - {None})
+    diffs = compare(bot, expected, user_ids)
+
+    ack_ms = [value * 1000 for value in latencies]
+    processing_ms = [value * 1000 for value in processing]
+    print(f"source:           {source}")
+    print(f"updates:          {len(updates)} ({expected.processed} unique, {len(user_ids)} users, "
+          f"concurrency {args.concurrency})")
+    print(f"ack throughput:   {len(updates) / acked:.0f} updates/s")
+    print(f"handled:          {len(updates) / handled:.0f} updates/s ({finished}/{expected.processed})")
+    print(f"end-to-end:       {len(updates) / delivered:.0f} updates/s (до последнего вызова Bot API)")
+    print(f"ack latency, ms:  p50={percentile(ack_ms, 50):.2f} p90={percentile(ack_ms, 90):.2f} "
+          f"p99={percentile(ack_ms, 99):.2f} mean={statistics.mean(ack_ms):.2f}")
+    if processing_ms:
+        print(f"processing, ms:   p50={percentile(processing_ms, 50):.2f} p90={percentile(processing_ms, 90):.2f} "
+              f"p99={percentile(processing_ms, 99):.2f} max={max(processing_ms):.2f}")
+    print(f"memory, MB:       rss {rss_before:.1f} -> {rss_after:.1f}, "
+          f"peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}"
+          + (f", python peak {traced_peak / 2 ** 20:.1f}" if traced_peak is not None else ''))
+    print(f"store:            {bot.store.stats()}")
+    print(f"Bot API calls:    {dict(api.calls)}")
+    print(f"mismatches:       {len(diffs)} ({len({user_id for user_id, *_ in diffs})} users)")
+    # Ответ пользователю мог не уйти, хотя счётчики сошлись
+    handler_errors, api_errors = error_counts(bot.HANDLER_ERRORS), error_counts(bot.API_ERRORS)
+    print(f"handler errors:   {sum(handler_errors.values())} {handler_errors or ''}")
+    print(f"Bot API errors:   {sum(api_errors.values())} {api_errors or ''}")
+
+    server.shutdown()
+    bot.shutdown_event_loop()
+    api.stop()
+    sys.exit(1 if diffs or handler_errors or api_errors or finished != expected.processed else 0)
+
+
+if __name__ == '__main__':
+    main()
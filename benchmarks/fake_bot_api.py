@@ -0,0 +1,184 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов"""
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """aiohttp-сервер, отвечающий как api.telegram.org и считающий вызовы"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, record=False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.record = record
+        self.requests = []  # [(method, params)] при record=True
+        self.calls = Counter()
+        self.last_call_at = None
+        self.rejected = Counter()
+        self._flood = 0
+        self._flood_retry_after = 1
+        self._message_id = 0
+        self._updates = deque()  # очередь для getUpdates, по возрастанию update_id
+        self._updates_ready = None
+        self.confirmed_offset = 0
+        self.polls = 0
+        self.webhook = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def api_url(self):
+        """Шаблон URL в формате telebot.asyncio_helper.API_URL"""
+        return f"http://{self.host}:{self.port}/bot{{0}}/{{1}}"
+
+    def inject_429(self, count, retry_after=1):
+        """Следующие count запросов получат 429 Too Many Requests с retry_after"""
+        with self._lock:
+            self._flood = count
+            self._flood_retry_after = retry_after
+
+    def feed(self, updates):
+        """Ставит обновления (dict) в очередь, которую отдаёт getUpdates"""
+        with self._lock:
+            self._updates.extend(updates)
+        if self._updates_ready is not None:
+            self._loop.call_soon_threadsafe(self._updates_ready.set)
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def wait_idle(self, quiet=0.5, timeout=60.0):
+        """Ждёт, пока вызовы не прекратятся на quiet секунд"""
+        deadline = time.perf_counter() + timeout
+        seen = -1
+        while time.perf_counter() < deadline:
+            total = self.total_calls()
+            if total == seen:
+                return
+            seen = total
+            time.sleep(quiet)
+
+    def _result_for(self, method, params):
+        if method in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            chat_id = int(params.get('chat_id', 0) or 0)
+            return {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'fake', 'username': 'fake_bot'}
+        if method == 'getWebhookInfo':
+            return dict(self.webhook)
+        if method == 'setWebhook':
+            self.webhook['url'] = params.get('url', '')
+            if params.get('max_connections'):
+                self.webhook['max_connections'] = int(params['max_connections'])
+        if method == 'deleteWebhook':
+            self.webhook = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    def _take_updates(self, offset, limit):
+        with self._lock:
+            # Всё, что меньше offset, клиент подтвердил
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            self.confirmed_offset = max(self.confirmed_offset, offset)
+            return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    async def _get_updates(self, params):
+        """Long polling как у Telegram: ждёт обновлений не дольше timeout секунд"""
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = self._loop.time() + float(params.get('timeout') or 0)
+        with self._lock:
+            self.polls += 1
+        while True:
+            self._updates_ready.clear()
+            batch = self._take_updates(offset, limit)
+            remaining = deadline - self._loop.time()
+            if batch or remaining <= 0:
+                return web.json_response({'ok': True, 'result': batch})
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _params(request):
+        params = {}
+        if request.can_read_body:
+            if request.method in request.POST_METHODS:
+                params.update(await request.post())
+            else:
+                # telebot шлёт getUpdates методом GET с телом формы, а post() читает тело только у POST
+                params.update(parse_qsl(await request.text()))
+        params.update(request.query)
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        if method == 'getUpdates':
+            # Не считается в calls: холостой опрос не должен мешать wait_idle()
+            return await self._get_updates(params)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self._lock:
+            if self._flood > 0:
+                self._flood -= 1
+                self.rejected[method] += 1
+                return web.json_response({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self._flood_retry_after}",
+                    'parameters': {'retry_after': self._flood_retry_after},
+                }, status=429)
+            self.calls[method] += 1
+            self.last_call_at = time.perf_counter()
+            if self.record:
+                self.requests.append((method, params))
+            result = self._result_for(method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _start(self):
+        self._updates_ready = asyncio.Event()
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке и возвращает self"""
+        self._thread = threading.Thread(target=self._run, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
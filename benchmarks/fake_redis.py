@@ -0,0 +1,191 @@
+"""Минимальная замена Redis (подмножество RESP) для локальной проверки RedisBackend"""
+import asyncio
+import fnmatch
+import re
+import threading
+import time
+
+
+class Error(str):
+    """Ответ-ошибка (-ERR ...)"""
+
+
+class FakeRedis:
+    """Поддерживает PING, SELECT, AUTH, HGET, HGETALL, HSET, HDEL, DEL, MULTI/EXEC,
+    GET, SET (NX, PX), PEXPIRE, RPUSH, LLEN, BLPOP, SCAN (MATCH, COUNT) и EVAL
+    скриптов вида «если GET KEYS[1] == ARGV[1], выполнить команду над KEYS[1]»"""
+
+    _COMPARE_AND = re.compile(
+        r"if redis\.call\('GET', KEYS\[1\]\) == ARGV\[1\] then "
+        r"return redis\.call\('(\w+)', KEYS\[1\]((?:, ARGV\[\d+\])*)\) end return 0"
+    )
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.expires = {}  # {key: time.monotonic(), когда ключ истекает}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, Error):
+            return b'-%s\r\n' % str(value).encode('utf-8')
+        if isinstance(value, bool):
+            return b'+OK\r\n' if value else b'-ERR\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedis._encode(item) for item in value)
+        data = value if isinstance(value, bytes) else str(value).encode('utf-8')
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+
+    def _expire_keys(self):
+        now = time.monotonic()
+        for key in [key for key, deadline in self.expires.items() if deadline <= now]:
+            del self.expires[key]
+            self.data.pop(key, None)
+
+    def _apply(self, name, args):
+        self._expire_keys()
+        if name in ('PING', 'SELECT', 'AUTH'):
+            return True
+        if name == 'HGET':
+            return self.data.get(args[0], {}).get(args[1])
+        if name == 'HGETALL':
+            return [item for pair in self.data.get(args[0], {}).items() for item in pair]
+        if name == 'HSET':
+            bucket = self.data.setdefault(args[0], {})
+            added = sum(1 for field in args[1::2] if field not in bucket)
+            bucket.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == 'HDEL':
+            bucket = self.data.get(args[0], {})
+            return sum(1 for field in args[1:] if bucket.pop(field, None) is not None)
+        if name == 'DEL':
+            for key in args:
+                self.expires.pop(key, None)
+            return sum(1 for key in args if self.data.pop(key, None) is not None)
+        if name == 'GET':
+            return self.data.get(args[0])
+        if name == 'SET':
+            options = [arg.upper() for arg in args[2:]]
+            if 'NX' in options and args[0] in self.data:
+                return None
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            if 'PX' in options:
+                self.expires[args[0]] = time.monotonic() + int(args[2 + options.index('PX') + 1]) / 1000
+            return True
+        if name == 'PEXPIRE':
+            if args[0] not in self.data:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1]) / 1000
+            return 1
+        if name == 'RPUSH':
+            self.data.setdefault(args[0], []).extend(args[1:])
+            return len(self.data[args[0]])
+        if name == 'LLEN':
+            return len(self.data.get(args[0], []))
+        if name == 'EVAL':
+            # Выполняется целиком внутри _apply, то есть атомарно, как в Redis
+            match = self._COMPARE_AND.fullmatch(args[0])
+            if match is None:
+                raise ValueError(name)
+            keys, argv = args[2:2 + int(args[1])], args[2 + int(args[1]):]
+            if self.data.get(keys[0]) != argv[0]:
+                return 0
+            extra = [argv[int(index) - 1] for index in re.findall(r'ARGV\[(\d+)\]', match.group(2))]
+            return self._apply(match.group(1), [keys[0], *extra])
+        if name == 'SCAN':
+            # Курсор — позиция в отсортированном списке ключей
+            options = {args[i].upper(): args[i + 1] for i in range(1, len(args) - 1, 2)}
+            keys = sorted(self.data)
+            start, count = int(args[0]), int(options.get('COUNT', 10))
+            end = min(len(keys), start + count)
+            pattern = options.get('MATCH', '*')
+            matched = [key for key in keys[start:end] if fnmatch.fnmatchcase(key, pattern)]
+            return [str(end if end < len(keys) else 0), matched]
+        raise ValueError(name)
+
+    def _apply_or_error(self, name, args):
+        try:
+            return self._apply(name, args)
+        except ValueError:
+            return Error(f"ERR unknown command '{name}'")
+
+    def _pop_first(self, keys):
+        self._expire_keys()
+        for key in keys:
+            items = self.data.get(key)
+            if items:
+                value = items.pop(0)
+                if not items:
+                    del self.data[key]
+                return [key, value]
+        return None
+
+    async def _blpop(self, keys, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self._pop_first(keys)
+            if result is not None or time.monotonic() >= deadline:
+                return result
+            await asyncio.sleep(0.002)
+
+    async def _read_command(self, reader):
+        header = await reader.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode('utf-8'))
+        return args
+
+    async def _client(self, reader, writer):
+        queued = None
+        while True:
+            command = await self._read_command(reader)
+            if command is None:
+                break
+            name, args = command[0].upper(), command[1:]
+            if name == 'MULTI':
+                queued = []
+                writer.write(b'+OK\r\n')
+            elif name == 'EXEC':
+                # Как в Redis: ошибка одной команды приходит элементом массива, остальные выполняются
+                results = [self._apply_or_error(queued_name, queued_args) for queued_name, queued_args in queued or []]
+                queued = None
+                writer.write(self._encode(results))
+            elif name == 'BLPOP' and queued is None:
+                writer.write(self._encode(await self._blpop(args[:-1], float(args[-1]))))
+            elif queued is not None:
+                queued.append((name, args))
+                writer.write(b'+QUEUED\r\n')
+            else:
+                writer.write(self._encode(self._apply_or_error(name, args)))
+            await writer.drain()
+        writer.close()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._client, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake-redis', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
@@ -0,0 +1,97 @@
+"""Long polling против вебхука: пропускная способность на одной и той же заглушке Bot API
+
+Вебхук получает обновления POST-запросами с --concurrency потоков; polling забирает
+ту же по объёму очередь через getUpdates с разным limit. Время — от начала до
+последнего вызова Bot API, т.е. обновления не только приняты, но и обработаны.
+
+Запуск: python benchmarks/load_polling.py --updates 2000 --limits 1,10,100
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from load_webhook import start_webhook_server  # noqa: E402 (заодно задаёт переменные окружения)
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from updates import mixed_stream  # noqa: E402
+
+
+def run_webhook(bot, api, updates, concurrency):
+    server = start_webhook_server(bot.app)
+    port = server.server_port
+    payloads = [json.dumps(update).encode() for update in updates]
+    local = threading.local()
+
+    def post(body):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('POST', '/webhook', body, {'Content-Type': 'application/json'})
+        conn.getresponse().read()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(post, payloads))
+    api.wait_idle()
+    server.shutdown()
+    return api.last_call_at - started
+
+
+def run_polling(bot, api, updates, limit, concurrency):
+    from polling import UpdatePoller
+    poller = UpdatePoller(bot.bot, bot.process_update, limit=limit, timeout=1, concurrency=concurrency)
+    api.feed(updates)
+    started = time.perf_counter()
+    future = asyncio.run_coroutine_threadsafe(poller.run(), bot.loop)
+    while poller.updates < len(updates):
+        time.sleep(0.01)
+    api.wait_idle()
+    bot.loop.call_soon_threadsafe(poller.stop)
+    future.result(timeout=10)
+    return api.last_call_at - started, poller.batches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16, help='параллельных POST для вебхука')
+    parser.add_argument('--polling-concurrency', type=int, default=100)
+    parser.add_argument('--limits', default='1,10,100', help='значения limit для getUpdates')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка заглушки Bot API, с')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.api_latency).start()
+    from telebot import asyncio_helper
+    asyncio_helper.API_URL = api.api_url
+
+    import logging
+    logging.disable(logging.INFO)
+    import bot
+
+    bot.ensure_event_loop()
+    next_id = 1
+
+    def batch():
+        nonlocal next_id
+        updates = list(mixed_stream(args.updates, users=args.users, start_id=next_id))
+        next_id += args.updates
+        return updates
+
+    print(f"{args.updates} обновлений, задержка Bot API {args.api_latency * 1000:.0f} мс")
+    elapsed = run_webhook(bot, api, batch(), args.concurrency)
+    print(f"webhook (concurrency {args.concurrency}):{'':8s} {args.updates / elapsed:7.0f} updates/s")
+    for limit in (int(value) for value in args.limits.split(',')):
+        elapsed, batches = run_polling(bot, api, batch(), limit, args.polling_concurrency)
+        print(f"polling (limit {limit:3d}, {batches:4d} getUpdates): {args.updates / elapsed:7.0f} updates/s")
+    print(f"Bot API calls: {dict(api.calls)}, подтверждённый offset {api.confirmed_offset}")
+
+    bot.shutdown_event_loop()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
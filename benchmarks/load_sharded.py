@@ -0,0 +1,99 @@
+"""Масштабирование по процессам: пропускная способность при 1, 2, 4... рабочих процессах
+
+Обновления делятся по шардам (sharding.update_shard) и раскладываются по очередям,
+рабочие процессы обрабатывают их кодом бота. У каждого процесса своя заглушка Bot API,
+чтобы общая заглушка не стала узким местом. Время — от первой постановки в очередь
+до завершения всех процессов, т.е. все вызовы Bot API уже сделаны.
+
+Запуск: python benchmarks/load_sharded.py --updates 20000 --workers 1,2,4
+С очередями в Redis (заглушка в этом же процессе): --fake-redis
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('STORAGE_URL', 'memory://')
+os.environ.setdefault('OUTGOING_GLOBAL_RATE', '1000000')
+os.environ.setdefault('OUTGOING_CHAT_RATE', '1000000')
+
+import sharding  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_redis import FakeRedis  # noqa: E402
+from updates import mixed_stream  # noqa: E402
+
+
+class BenchWorker:
+    """Цель рабочего процесса: поднимает свою заглушку Bot API и запускает bot.run_shard_worker"""
+
+    def __init__(self, ready, processed, api_latency):
+        self.ready = ready
+        self.processed = processed
+        self.api_latency = api_latency
+
+    def __call__(self, queues, index, stopping, reports):
+        api = FakeBotAPI(latency=self.api_latency).start()
+        from telebot import asyncio_helper
+        asyncio_helper.API_URL = api.api_url
+        logging.disable(logging.INFO)
+        import bot
+
+        bot.ensure_event_loop()
+        self.ready.release()
+        processed = bot.run_shard_worker(queues, index, stopping, reports)
+        with self.processed.get_lock():
+            self.processed.value += processed
+        api.stop()
+
+
+def run(workers, updates, users, api_latency, queue_url=None):
+    context = multiprocessing.get_context('spawn')
+    ready = context.Semaphore(0)
+    processed = context.Value('q', 0)
+    queues = sharding.RedisQueues(queue_url, workers * 8) if queue_url else sharding.LocalQueues(workers * 8, workers, context)
+    pool = sharding.WorkerPool(BenchWorker(ready, processed, api_latency), queues, workers, context).start()
+    for _ in range(workers):
+        ready.acquire()
+    # В Redis шарды разбираются по арендам — даём процессам время поделить их поровну
+    if queue_url:
+        time.sleep(2)
+
+    started = time.perf_counter()
+    for update in mixed_stream(updates, users=users):
+        queues.publish(sharding.update_shard(update, queues.shards), update)
+    if queue_url:
+        # Рабочие процессы Redis-очередей при остановке не дочитывают их — ждём, пока разберут
+        while queues.backlog():
+            time.sleep(0.01)
+    pool.stop(timeout=300)
+    elapsed = time.perf_counter() - started
+    return elapsed, processed.value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--workers', default='1,2,4', help='числа рабочих процессов через запятую')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка заглушки Bot API, с')
+    parser.add_argument('--fake-redis', action='store_true', help='очереди шардов в заглушке Redis')
+    args = parser.parse_args()
+
+    redis = FakeRedis().start() if args.fake_redis else None
+    print(f"{args.updates} обновлений, {args.users} пользователей, ядер: {os.cpu_count()}, "
+          f"очереди: {'Redis' if redis else 'локальные'}")
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(',')):
+        elapsed, processed = run(workers, args.updates, args.users, args.api_latency, redis.url if redis else None)
+        rate = processed / elapsed
+        baseline = baseline or rate
+        print(f"workers {workers:2d}: {rate:7.0f} updates/s, ускорение x{rate / baseline:.2f} "
+              f"(идеал x{workers}), обработано {processed}")
+
+
+if __name__ == '__main__':
+    main()
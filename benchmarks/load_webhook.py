@@ -0,0 +1,97 @@
+"""Нагрузочный тест /webhook: синтетические обновления против заглушки Bot API
+
+Запуск: python benchmarks/load_webhook.py --updates 2000 --concurrency 16
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('STORAGE_URL', 'memory://')
+# Меряем сам бот, а не лимиты Telegram
+os.environ.setdefault('OUTGOING_GLOBAL_RATE', '1000000')
+os.environ.setdefault('OUTGOING_CHAT_RATE', '1000000')
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from updates import mixed_stream  # noqa: E402
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_webhook_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка заглушки Bot API, с')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.api_latency).start()
+
+    from telebot import asyncio_helper
+    asyncio_helper.API_URL = api.api_url
+
+    import logging
+    logging.disable(logging.INFO)
+    import bot
+
+    bot.ensure_event_loop()
+    server = start_webhook_server(bot.app)
+    port = server.server_port
+    payloads = [json.dumps(update).encode() for update in mixed_stream(args.updates, users=args.users)]
+
+    local = threading.local()
+
+    def post(body):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        started = time.perf_counter()
+        conn.request('POST', '/webhook', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        latencies = list(pool.map(post, payloads))
+    acked = time.perf_counter() - started
+
+    # Ждём, пока обработка догонит приём, и берём время последнего вызова Bot API
+    api.wait_idle()
+    processed = api.last_call_at - started
+
+    ms = [value * 1000 for value in latencies]
+    print(f"updates:          {len(payloads)} (concurrency {args.concurrency})")
+    print(f"ack throughput:   {len(payloads) / acked:.0f} updates/s")
+    print(f"end-to-end:       {len(payloads) / processed:.0f} updates/s")
+    print(f"ack latency, ms:  p50={percentile(ms, 50):.2f} p90={percentile(ms, 90):.2f} "
+          f"p99={percentile(ms, 99):.2f} mean={statistics.mean(ms):.2f}")
+    print(f"Bot API calls:    {dict(api.calls)}")
+
+    server.shutdown()
+    bot.shutdown_event_loop()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Генерация синтетических обновлений Telegram в формате types.Update JSON"""
+import itertools
+import random
+import time
+
+SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+# Редкости на клавиатуре «ВЫПАЛО!» для каждого осколка (как create_reset_rarity_keyboard)
+RESET_RARITIES = {
+    'shard_blue': ('epic', 'legendary'),
+    'shard_void': ('epic', 'legendary'),
+    'shard_mythic': ('legendary', 'mythic'),
+    'shard_sacred': ('legendary',),
+}
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'Выберите тип осколка:',
+            },
+        },
+    }
+
+
+def mixed_stream(count, users=100, start_id=1):
+    """Смесь из выбора осколка, ввода числа и сброса — типичный сценарий пользователя"""
+    shard_types = SHARD_TYPES
+    for offset in range(count):
+        update_id = start_id + offset
+        user_id = 1000 + offset % users
+        round_no = offset // users
+        shard_type = shard_types[(round_no // 3) % len(shard_types)]
+        action = round_no % 3
+        if action == 0:
+            yield callback_update(update_id, user_id, shard_type)
+        elif action == 1:
+            yield message_update(update_id, user_id, str(1 + offset % 10))
+        else:
+            yield callback_update(update_id, user_id, f"reset_{shard_type}_legendary")
+
+
+def user_session(rng):
+    """Бесконечный сценарий одного пользователя: [(вид, текст или data)] по шагам
+
+    Начинается с /start; дальше в основном выбор осколка и ввод числа (иногда с опечаткой
+    или отрицательным числом), реже «ВЫПАЛО!» со сбросом, просмотр статистики и команды.
+    """
+    yield [('text', '/start')]
+    while True:
+        roll = rng.random()
+        shard_type = rng.choices(SHARD_TYPES, weights=(6, 2, 1, 3))[0]
+        if roll < 0.55:
+            step = []
+            if rng.random() < 0.3:
+                step.append(('text', '📥 Ввести кол-во осколков'))
+            step.append(('callback', shard_type))
+            typo = rng.random()
+            if typo < 0.05:
+                step.append(('text', 'десять'))
+            elif typo < 0.07:
+                step.append(('text', '-5'))
+            step.append(('text', str(rng.randint(1, 50))))
+            yield step
+        elif roll < 0.63:
+            rarity = rng.choice(RESET_RARITIES[shard_type])
+            if rng.random() < 0.5:
+                first = [('text', '🎉 ВЫПАЛО!'), ('callback', f"reset_choice_{shard_type}")]
+            else:
+                first = [('callback', f"show_reset_menu_{shard_type}")]
+            if rng.random() < 0.1:
+                yield first + [('callback', 'cancel_reset')]
+            else:
+                yield first + [('callback', f"reset_{shard_type}_{rarity}")]
+        elif roll < 0.80:
+            yield [('text', rng.choice(('📊 Статистика', '/stats', '/history', '/chances')))]
+        elif roll < 0.87:
+            yield [('callback', 'show_stats')]
+        elif roll < 0.95:
+            yield [('text', rng.choice(('/top', '/global', 'ℹ️ Информация', '❓ Помощь', '/help', '/info_shard')))]
+        else:
+            yield [('text', rng.choice(('привет', 'спасибо!', '/unknown')))]
+
+
+def realistic_stream(count, users=1000, seed=1, start_id=1, duplicate_rate=0.002):
+    """count обновлений от users пользователей с неравномерной активностью
+
+    Активность по закону Ципфа: немногие пользователи присылают большую часть обновлений.
+    Шаги сценария пользователя идут подряд, но между ними вклиниваются другие пользователи;
+    доля duplicate_rate — повторные доставки недавних обновлений с тем же update_id.
+    """
+    rng = random.Random(seed)
+    user_ids = [1000 + i for i in range(users)]
+    weights = list(itertools.accumulate(1 / (rank + 1) ** 1.1 for rank in range(users)))
+    sessions = {}
+    queued = {}  # {user_id: оставшиеся действия текущего шага}
+    recent = []
+    update_id = start_id
+    produced = 0
+    while produced < count:
+        if recent and rng.random() < duplicate_rate:
+            yield rng.choice(recent)
+            produced += 1
+            continue
+        user_id = rng.choices(user_ids, cum_weights=weights)[0]
+        actions = queued.get(user_id)
+        if not actions:
+            session = sessions.get(user_id)
+            if session is None:
+                session = sessions[user_id] = user_session(random.Random(rng.random()))
+            actions = queued[user_id] = list(next(session))
+        kind, value = actions.pop(0)
+        if kind == 'text':
+            update = message_update(update_id, user_id, value)
+        else:
+            update = callback_update(update_id, user_id, value)
+        recent.append(update)
+        if len(recent) > 100:
+            recent.pop(0)
+        update_id += 1
+        produced += 1
+        yield update
@@ -1,19 +1,41 @@
 import os
+import hmac
+import json
 import signal
 import asyncio
-import requests
+import threading
+import time
 from telebot.async_telebot import AsyncTeleBot
 from telebot import types
 import logging
-from flask import Flask, request
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from flask import Flask, Response, jsonify, request
+
+import logs
+import metrics
+import sharding
+import storage
+from dedup import UpdateDeduplicator
+from dispatcher import Router
+from history import RARITIES, HistoryLog
+from leaderboard import GlobalStats
+from mercy import MercyRule, forecast
+from outgoing import Outbox, WebhookReply, bind_webhook_reply, retry_after
+from polling import RawUpdateSource, UpdatePoller
+
+# Настройка логирования: записи уходят в очередь, выводит их фоновый поток.
+# LOG_FORMAT=json — строка JSON на запись; LOG_SAMPLE_RATE — доля обновлений, чьи логи пишутся
+log_pipeline = logs.setup(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    json_format=os.getenv('LOG_FORMAT', 'text').lower() == 'json',
+    sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
 )
 logger = logging.getLogger(__name__)
 
+# UPDATES_RECORD_PATH — файл, куда дописываются входящие обновления (JSON по строке),
+# чтобы проиграть их потом в benchmarks/e2e.py --replay
+UPDATES_RECORD_PATH = os.getenv('UPDATES_RECORD_PATH')
+update_recorder, record_pipeline = logs.recorder(UPDATES_RECORD_PATH) if UPDATES_RECORD_PATH else (None, None)
+
 # Получаем токен из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
@@ -27,6 +49,28 @@ if not KOYEB_APP_DOMAIN:
     KOYEB_APP_DOMAIN = "koyeb.app"
 
 WEBHOOK_URL = f"https://{KOYEB_APP_DOMAIN}/webhook"
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Режим получения обновлений: webhook (по умолчанию) или polling — getUpdates, домен не нужен.
+# В режиме polling Flask продолжает отвечать на проверки здоровья
+RUN_MODE = os.getenv('RUN_MODE', 'webhook').lower()
+if RUN_MODE not in ('webhook', 'polling'):
+    raise RuntimeError(f"Неизвестный RUN_MODE: {RUN_MODE} (ожидается webhook или polling)")
+POLLING_LIMIT = int(os.getenv('POLLING_LIMIT', '100'))
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '50'))
+POLLING_CONCURRENCY = int(os.getenv('POLLING_CONCURRENCY', '100'))
+
+# Горизонтальное масштабирование: WORKERS рабочих процессов, обновления делятся на SHARDS шардов
+# по from_user.id, шарды — между процессами. Без SHARD_QUEUE_URL очереди локальные (один инстанс);
+# с SHARD_QUEUE_URL=redis://host:port/db — общие для всех инстансов.
+# Несколько инстансов должны делить и хранилище (STORAGE_URL=redis://...).
+# SHARDS не зависит от WORKERS: по шардам делится журнал осколков, менять SHARDS на живых данных нельзя
+WORKERS = int(os.getenv('WORKERS', '1'))
+SHARD_QUEUE_URL = os.getenv('SHARD_QUEUE_URL', '')
+SHARDED = WORKERS > 1 or bool(SHARD_QUEUE_URL)
+SHARDS = int(os.getenv('SHARDS', '64')) if SHARDED else 1
+# Как часто рабочий процесс отправляет свои метрики главному (они попадают в /metrics с меткой worker)
+WORKER_METRICS_INTERVAL = float(os.getenv('WORKER_METRICS_INTERVAL', '5'))
 
 # Создаём Flask приложение
 app = Flask(__name__)
@@ -34,9 +78,38 @@ app = Flask(__name__)
 # Создаём бота
 bot = AsyncTeleBot(BOT_TOKEN)
 
-# Хранение данных в памяти (для продакшена — использовать Redis/БД)
-user_shards_data = {}  # {user_id: {shard_type: count}}
-waiting_for_input = {}  # {user_id: shard_type}
+# Обработчики ищутся по таблицам (команда, текст кнопки, callback_data, префикс)
+# вместо цепочки фильтров telebot
+router = Router()
+
+# Исходящие вызовы: обработчики не ждут Telegram, сообщения в один чат идут по порядку.
+# Лимиты Telegram: около 30 сообщений в секунду всего и около 1 в секунду на чат.
+# Общий лимит делится между рабочими процессами инстанса (чат целиком живёт в одном процессе)
+outbox = Outbox(
+    bot,
+    global_rate=float(os.getenv('OUTGOING_GLOBAL_RATE', '30')) / max(1, WORKERS),
+    chat_rate=float(os.getenv('OUTGOING_CHAT_RATE', '1'))
+)
+
+# Сколько ждать ответа на callback, чтобы вернуть его прямо в ответе вебхука
+WEBHOOK_REPLY_WAIT = float(os.getenv('WEBHOOK_REPLY_WAIT', '0.05'))
+
+# Постоянный event loop: один на процесс, вместе с ним живёт и aiohttp-сессия бота
+loop = asyncio.new_event_loop()
+_loop_thread = None
+_loop_lock = threading.Lock()
+_poller_future = None
+# Установлен, когда Telegram подтвердил наш вебхук (для /ready)
+webhook_ready = threading.Event()
+# Установлен, когда вебхук снят и начался опрос (режим polling, для /ready)
+polling_ready = threading.Event()
+# Установлен, когда восстановлены отметка update_id, хранилище и журнал; до этого event loop не запущен
+state_ready = threading.Event()
+
+# Режим шардов: очереди и рабочие процессы живут только в главном процессе
+shard_queues = None
+worker_pool = None
+_route_lock = threading.Lock()
 
 # Пороги
 LEGENDARY_THRESHOLDS = {
@@ -46,6 +119,9 @@ LEGENDARY_THRESHOLDS = {
     'shard_sacred': 12
 }
 
+# Больше за всё время не открыть; запас до int64 нужен суммам по всем пользователям в журнале
+MAX_SHARD_COUNT = 10 ** 9
+
 EPIC_THRESHOLDS = {
     'shard_blue': 20,
     'shard_void': 20,
@@ -53,6 +129,128 @@ EPIC_THRESHOLDS = {
     'shard_sacred': None
 }
 
+# Базовые шансы и прибавка за каждое открытие сверх порога — для калькулятора /chances
+MERCY_RULES = {
+    'shard_blue': {
+        'epic': MercyRule(0.08, EPIC_THRESHOLDS['shard_blue'], 0.02),
+        'legendary': MercyRule(0.005, LEGENDARY_THRESHOLDS['shard_blue'], 0.05)
+    },
+    'shard_void': {
+        'epic': MercyRule(0.08, EPIC_THRESHOLDS['shard_void'], 0.02),
+        'legendary': MercyRule(0.005, LEGENDARY_THRESHOLDS['shard_void'], 0.05)
+    },
+    'shard_mythic': {
+        'mythic': MercyRule(0.005, LEGENDARY_THRESHOLDS['shard_mythic'], 0.10)
+    },
+    'shard_sacred': {
+        'legendary': MercyRule(0.06, LEGENDARY_THRESHOLDS['shard_sacred'], 0.02)
+    }
+}
+
+# Хранилище счётчиков {user_id: {shard_type: count}} и ожидаемого ввода {user_id: shard_type}.
+# По умолчанию SQLite (WAL) рядом с ботом; memory:// — без персистентности, redis://host:port/db — общий Redis
+STORAGE_URL = os.getenv('STORAGE_URL', 'sqlite:///shards.db')
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '1.0'))
+# Сколько пользователей держать в памяти и сколько минут ждать ввода числа после выбора осколка
+STORE_CAPACITY = int(os.getenv('STORE_CAPACITY', '50000'))
+PENDING_INPUT_TTL_MINUTES = float(os.getenv('PENDING_INPUT_TTL_MINUTES', '10'))
+store = storage.ShardStore(
+    storage.create_backend(STORAGE_URL),
+    shard_types=tuple(LEGENDARY_THRESHOLDS),
+    flush_interval=STORAGE_FLUSH_INTERVAL,
+    capacity=STORE_CAPACITY,
+    pending_ttl=PENDING_INPUT_TTL_MINUTES * 60
+)
+
+# Повторно доставленные обновления (тот же update_id) пропускаются.
+# С вебхуком верхняя отметка сохраняется в хранилище, чтобы не обработать их заново после перезапуска.
+# С polling — нет: отметка ставится при получении, а пачка, не подтверждённая offset'ом из-за падения,
+# должна после перезапуска прийти и обработаться снова; подтверждённые Telegram и так не пришлёт
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', '10000'))
+UPDATE_HIGH_WATER_KEY = 'update_high_water'
+PERSIST_UPDATE_MARK = RUN_MODE == 'webhook'
+dedup = UpdateDeduplicator(window=UPDATE_DEDUP_WINDOW)
+
+# Журнал добавлений и сбросов для /history; в режиме шардов — файл на шард (shards_history.<шард>.log),
+# рабочий процесс ведёт файлы своих шардов.
+# Агрегаты пользователей лежат в том же хранилище, что и счётчики (пространство имён history),
+# в памяти — не больше STORE_CAPACITY пользователей.
+# Добавления одного осколка сливаются, когда их набирается HISTORY_COMPACT_AFTER
+HISTORY_PATH = os.getenv('HISTORY_PATH', 'shards_history.log')
+# Таблица лидеров и перцентили для /top и /global обновляются вместе с журналом, по доле на шард
+TOP_SIZE = int(os.getenv('TOP_SIZE', '10'))
+history = HistoryLog(
+    HISTORY_PATH,
+    shard_types=tuple(LEGENDARY_THRESHOLDS),
+    backend=storage.create_backend(STORAGE_URL, namespace='history'),
+    shards=SHARDS,
+    flush_interval=STORAGE_FLUSH_INTERVAL,
+    compact_after=int(os.getenv('HISTORY_COMPACT_AFTER', '100000')),
+    capacity=STORE_CAPACITY,
+    stats_factory=lambda: GlobalStats(shard_types=tuple(LEGENDARY_THRESHOLDS), rarities=RARITIES, top_k=TOP_SIZE)
+)
+
+
+# Выгрузка и загрузка счётчиков и журнала на живом боте (/admin/export, /admin/import).
+# Запрос должен нести заголовок Authorization: Bearer <ADMIN_TOKEN>; без ADMIN_TOKEN маршруты отключены
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+# Метрики Prometheus (/metrics): задержки обработчиков и вызовов Bot API, очереди, размеры кэшей, лаг event loop
+registry = metrics.Registry()
+HANDLER_SECONDS = registry.histogram(
+    'bot_handler_duration_seconds', 'Время выполнения обработчика', ('handler',)
+)
+HANDLER_ERRORS = registry.counter('bot_handler_errors', 'Исключения в обработчиках', ('handler',))
+API_SECONDS = registry.histogram('bot_api_call_duration_seconds', 'Время вызова Bot API', ('method',))
+API_ERRORS = registry.counter('bot_api_errors', 'Ошибки вызовов Bot API', ('method',))
+UPDATES_RECEIVED = registry.counter('bot_updates_received', 'Обновления, переданные в обработку')
+UPDATES_FINISHED = metrics.Counter('bot_updates_finished', 'Обработанные обновления')
+LOOP_LAG = registry.histogram(
+    'bot_event_loop_lag_seconds', 'Опоздание event loop относительно запланированного пробуждения'
+)
+registry.gauge(
+    'bot_updates_in_flight', 'Обновления в обработке, включая ожидающие своей очереди у пользователя',
+    lambda: UPDATES_RECEIVED.labels().value - UPDATES_FINISHED.labels().value
+)
+registry.gauge(
+    'bot_outbox', 'Очередь исходящих вызовов', lambda: {(key,): value for key, value in outbox.stats().items()}, ('stat',)
+)
+registry.gauge(
+    'bot_store', 'Кэш хранилища счётчиков', lambda: {(key,): value for key, value in store.stats().items()}, ('stat',)
+)
+registry.gauge('bot_user_locks', 'Пользователи в обработке или в очереди', lambda: router.stats()['user_locks'])
+registry.gauge('bot_dedup_window', 'update_id в окне защиты от повторов', lambda: len(dedup))
+registry.gauge('bot_history_records', 'Записи журнала осколков', lambda: history.records)
+
+
+def _observe_handler(handler, seconds, error):
+    HANDLER_SECONDS.labels(handler.__name__).observe(seconds)
+    if error is not None:
+        HANDLER_ERRORS.labels(handler.__name__).inc()
+
+
+def _observe_api_call(method, seconds, error):
+    API_SECONDS.labels(method).observe(seconds)
+    if error is not None:
+        API_ERRORS.labels(method).inc()
+
+
+def _preload(user_id):
+    store.preload(user_id)
+    history.preload(user_id)
+
+
+async def _preload_user(user_id):
+    # Промах кэша читает базу: в пуле потоков, чтобы не останавливать event loop
+    if not store.is_cached(user_id) or not history.aggregates.is_cached(user_id):
+        await loop.run_in_executor(None, _preload, user_id)
+
+
+router.observer = _observe_handler
+router.preload = _preload_user
+outbox.observer = _observe_api_call
+
 
 # === Вспомогательные функции ===
 
@@ -108,11 +306,71 @@ def create_reset_rarity_keyboard(shard_type):
     return markup
 
 
+def create_reset_menu_keyboard(shard_type):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🎉 ВЫПАЛО! → Сбросить счётчик", callback_data=f"show_reset_menu_{shard_type}"))
+    return markup
+
+
+# Клавиатуры и статические тексты строятся один раз при старте и уходят в Bot API
+# уже сериализованными в JSON — telebot передаёт строку reply_markup как есть
+REPLY_KEYBOARD = create_reply_keyboard().to_json()
+SHARDS_KEYBOARD = create_shards_keyboard().to_json()
+SHARDS_RESET_KEYBOARD = create_shards_reset_keyboard().to_json()
+RESET_RARITY_KEYBOARDS = {
+    shard_type: create_reset_rarity_keyboard(shard_type).to_json() for shard_type in LEGENDARY_THRESHOLDS
+}
+RESET_MENU_KEYBOARDS = {
+    shard_type: create_reset_menu_keyboard(shard_type).to_json() for shard_type in LEGENDARY_THRESHOLDS
+}
+
+HELP_TEXT = """📚 <b>Доступные команды:</b>
+
+/start — 🚀 Начать
+/info_shard — ℹ️ Шансы призыва
+/stats — 📊 Статистика
+/history — 📜 История выпадений
+/chances — 🎲 Шансы по вашим счётчикам
+/top — 🏆 Лидеры по открытым осколкам
+/global — 🌍 Общая статистика
+📥 Ввести кол-во осколков — указать количество
+🎉 ВЫПАЛО! — сбросить счётчик"""
+
+SHARD_INFO_TEXT = """📊 <b>Шансы призыва по системе компенсации неудач</b>
+
+🔵 <b>Древний / Темный осколок</b>
+   • Эпик: 20+ → +2%
+   • Легенда: 200+ → +5%
+
+💎 <b>Циркон Первозданный осколок</b>
+   • Мифик: 200+ → +10%
+
+⭐ <b>Сакральный осколок</b>
+   • Легенда: 12+ → +2%"""
+
+NO_STATS_TEXT = (
+    "📊 <b>Статистика открытых осколков</b>\n\n"
+    "❌ У вас пока нет данных.\n"
+    "👉 Укажите количество или нажмите «📥 Ввести кол-во осколков»."
+)
+
+NO_TOP_TEXT = (
+    "🏆 <b>Лидеры по открытым осколкам</b>\n\n"
+    "❌ Пока никто не добавлял осколки."
+)
+
+NO_HISTORY_TEXT = (
+    "📜 <b>История выпадений</b>\n\n"
+    "❌ Записей пока нет.\n"
+    "👉 Добавляйте осколки и отмечайте «🎉 ВЫПАЛО!» — здесь появится, за сколько выпадают герои."
+)
+
+
 def format_stats(user_id):
-    if user_id not in user_shards_data or not user_shards_data[user_id]:
+    stats = store.get_counts(user_id)
+    if not stats:
         return None
     
-    stats = user_shards_data[user_id]
     shard_display = {
         'shard_blue': '💠 Синий',
         'shard_void': '🔷 Войд',
@@ -136,129 +394,505 @@ def format_stats(user_id):
     return stats_text
 
 
+def format_history(user_id):
+    summary = history.user_summary(user_id)
+    if summary is None:
+        return None
+
+    shard_display = {
+        'shard_blue': '💠 Синий',
+        'shard_void': '🔷 Войд',
+        'shard_mythic': '♦️ Мифик',
+        'shard_sacred': '✨ Сакрал'
+    }
+    rarity_display = {
+        'epic': '🟣 Эпик',
+        'legendary': '🟡 Легенда',
+        'mythic': '🔮 Мифик'
+    }
+    history_text = "📜 <b>История выпадений</b>\n\n"
+
+    for shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
+        shard = summary[shard_type]
+        if not shard['opened'] and not shard['drops']:
+            continue
+        history_text += f"{shard_display[shard_type]}: открыто <b>{shard['opened']}</b>\n"
+        for rarity, (drops, average) in shard['drops'].items():
+            history_text += f"   {rarity_display[rarity]}: <b>{drops}</b> раз, в среднем за <b>{average:.1f}</b>\n"
+        history_text += "\n"
+
+    return history_text
+
+
+def format_chances(user_id):
+    stats = store.get_counts(user_id)
+
+    shard_display = {
+        'shard_blue': '💠 Синий',
+        'shard_void': '🔷 Войд',
+        'shard_mythic': '♦️ Мифик',
+        'shard_sacred': '✨ Сакрал'
+    }
+    rarity_display = {
+        'epic': '🟣 Эпик',
+        'legendary': '🟡 Легенда',
+        'mythic': '🔮 Мифик'
+    }
+    chances_text = "🎲 <b>Шансы с учётом компенсации неудач</b>\n\n"
+
+    for shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
+        count = stats.get(shard_type, 0)
+        chances_text += f"{shard_display[shard_type]}: открыто <b>{count}</b>\n"
+        for rarity, rule in MERCY_RULES[shard_type].items():
+            chance, expected, percentiles = forecast(rule, count)
+            chances_text += (
+                f"   {rarity_display[rarity]}: сейчас <b>{chance * 100:.1f}%</b>, "
+                f"в среднем ещё <b>{expected:.1f}</b>\n"
+                f"      " + ", ".join(f"{q}% — за {pulls}" for q, pulls in percentiles.items()) + "\n"
+            )
+        chances_text += "\n"
+
+    return chances_text
+
+
+def format_top(user_id):
+    shard_display = {
+        'shard_blue': '💠 Синий',
+        'shard_void': '🔷 Войд',
+        'shard_mythic': '♦️ Мифик',
+        'shard_sacred': '✨ Сакрал'
+    }
+    top_text = "🏆 <b>Лидеры по открытым осколкам</b>\n\n"
+    has_leaders = False
+    global_stats = history.global_stats()
+
+    for shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
+        leaders = global_stats.top_users(shard_type, TOP_SIZE)
+        if not leaders:
+            continue
+        has_leaders = True
+        top_text += f"{shard_display[shard_type]}\n"
+        for place, (leader_id, opened) in enumerate(leaders, 1):
+            # id целиком не показываем — только последние цифры
+            name = "вы" if leader_id == user_id else f"игрок …{str(leader_id)[-4:]}"
+            top_text += f"   {place}. {name} — <b>{opened}</b>\n"
+        top_text += "\n"
+
+    return top_text if has_leaders else None
+
+
+def format_global():
+    # Итоги и статистика из одного снимка: иначе свежее выпадение есть в итогах, а в статистике ещё нет
+    totals, global_stats = history.global_snapshot()
+
+    shard_display = {
+        'shard_blue': '💠 Синий',
+        'shard_void': '🔷 Войд',
+        'shard_mythic': '♦️ Мифик',
+        'shard_sacred': '✨ Сакрал'
+    }
+    rarity_display = {
+        'epic': '🟣 Эпик',
+        'legendary': '🟡 Легенда',
+        'mythic': '🔮 Мифик'
+    }
+    global_text = "🌍 <b>Общая статистика</b>\n\n"
+
+    for shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
+        global_text += f"{shard_display[shard_type]}: открыто <b>{totals[shard_type]['opened']}</b>\n"
+        for rarity in totals[shard_type]['drops']:
+            drops, mean, percentiles = global_stats.pulls_summary(shard_type, rarity)
+            if not drops:
+                continue
+            global_text += (
+                f"   {rarity_display[rarity]}: <b>{drops}</b> раз, в среднем за <b>{mean:.1f}</b>, "
+                f"медиана {percentiles[50]:.0f}, 90% — до {percentiles[90]:.0f}\n"
+            )
+        global_text += "\n"
+
+    return global_text
+
+
+async def register_webhook(force=False, attempts=None, retry_delay=1.0, max_retry_delay=60.0):
+    """Устанавливает вебхук, если Telegram ещё не знает этот URL; при ошибках повторяет с нарастающей паузой
+
+    Возвращает True, когда вебхук установлен, или False после attempts неудачных попыток.
+    """
+    delay = retry_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            info = await bot.get_webhook_info()
+            logger.debug("🔍 Информация о вебхуке: %s", info)
+            if not force and info.url == WEBHOOK_URL and info.max_connections == WEBHOOK_MAX_CONNECTIONS:
+                logger.info(f"✅ Вебхук уже установлен: {WEBHOOK_URL}")
+            else:
+                logger.info(f"🔄 Устанавливаем вебхук на URL: {WEBHOOK_URL}")
+                await bot.set_webhook(
+                    url=WEBHOOK_URL, max_connections=WEBHOOK_MAX_CONNECTIONS, drop_pending_updates=True
+                )
+                logger.info(f"✅ Вебхук успешно установлен: {WEBHOOK_URL}")
+            webhook_ready.set()
+            return True
+        except Exception as e:
+            if attempts is not None and attempt >= attempts:
+                logger.error(f"❌ Ошибка установки вебхука: {e}")
+                return False
+            wait = retry_after(e) or delay
+            logger.error(f"❌ Ошибка установки вебхука: {e}. Повтор через {wait:.0f} с")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, max_retry_delay)
+
+
+def start_webhook_registration():
+    """Регистрирует вебхук в фоне — сервер тем временем уже принимает запросы"""
+    future = asyncio.run_coroutine_threadsafe(register_webhook(), ensure_event_loop())
+    future.add_done_callback(_log_update_error)
+    return future
+
+
 def setup_webhook_sync():
-    """Синхронная функция для установки вебхука через GET запрос"""
+    """Принудительная установка вебхука (одна попытка); True при успехе"""
+    future = asyncio.run_coroutine_threadsafe(register_webhook(force=True, attempts=1), ensure_event_loop())
     try:
-        # Формируем URL для установки вебхука
-        telegram_api_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
-        
-        # Параметры для запроса
-        params = {
-            'url': WEBHOOK_URL,
-            'max_connections': 40,
-            'drop_pending_updates': True
-        }
-        
-        logger.info(f"🔄 Устанавливаем вебхук на URL: {WEBHOOK_URL}")
-        
-        # Отправляем GET запрос
-        response = requests.get(telegram_api_url, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
-                logger.info(f"✅ Вебхук успешно установлен: {WEBHOOK_URL}")
-                logger.info(f"📝 Ответ Telegram API: {result.get('description', 'Успешно')}")
-                
-                # Проверяем информацию о вебхуке
-                check_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
-                check_response = requests.get(check_url, timeout=10)
-                if check_response.status_code == 200:
-                    webhook_info = check_response.json()
-                    if webhook_info.get('ok'):
-                        logger.info(f"🔍 Информация о вебхуке: {webhook_info.get('result', {})}")
-            else:
-                logger.error(f"❌ Ошибка установки вебхука: {result}")
-        else:
-            logger.error(f"❌ HTTP ошибка: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ Ошибка сети при установке вебхука: {e}")
+        return future.result(timeout=30)
     except Exception as e:
         logger.error(f"❌ Неожиданная ошибка при установке вебхука: {e}")
+        return False
+
+
+def _load_state(retry_delay=1.0, max_retry_delay=60.0):
+    """Восстанавливает отметку update_id, запускает хранилище и журнал; при ошибках повторяет с нарастающей паузой"""
+    delay = retry_delay
+    while True:
+        try:
+            if PERSIST_UPDATE_MARK and dedup.load(store.get_meta(UPDATE_HIGH_WATER_KEY)):
+                logger.info(f"🔁 Восстановлена отметка update_id: {dedup.high_water}")
+            store.start()
+            # В режиме шардов процесс забирает части журнала вместе со своими шардами
+            history.start(() if SHARDED else None)
+            break
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки хранилища или журнала: {e}. Повтор через {delay:.0f} с")
+            time.sleep(delay)
+            delay = min(delay * 2, max_retry_delay)
+    state_ready.set()
+    logger.info("✅ Хранилище и журнал загружены")
+
+
+def _run_event_loop():
+    # Обновления, пришедшие во время загрузки, ждут в очереди ещё не запущенного loop
+    # и обрабатываются в порядке поступления
+    _load_state()
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def ensure_event_loop():
+    """Запускает постоянный event loop в фоновом потоке (один раз на процесс)
+
+    Поток сначала загружает хранилище и журнал, поэтому вызов не ждёт ни их, ни базы.
+    """
+    global _loop_thread
+    if _loop_thread is not None:
+        return loop
+    with _loop_lock:
+        if _loop_thread is None:
+            thread = threading.Thread(target=_run_event_loop, name='bot-event-loop', daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(metrics.watch_loop_lag(LOOP_LAG), loop)
+            _loop_thread = thread
+    return loop
+
+
+def shutdown_event_loop():
+    """Закрывает aiohttp-сессию бота и останавливает event loop"""
+    global _loop_thread
+    if _loop_thread is None:
+        return
+    stop_polling()
+    stop_workers()
+    try:
+        asyncio.run_coroutine_threadsafe(outbox.drain(), loop).result(timeout=10)
+        asyncio.run_coroutine_threadsafe(bot.close_session(), loop).result(timeout=5)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+    _loop_thread.join(timeout=5)
+    _loop_thread = None
+    store.close()
+    history.close()
+    if record_pipeline is not None:
+        record_pipeline.stop()
+    log_pipeline.stop()
+
+
+def _log_update_error(future):
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("❌ Ошибка обработки обновления: %s", error)
+
+
+async def process_update(update, webhook_reply=None):
+    logs.bind_update(update.update_id)
+    if dedup.is_duplicate(update.update_id):
+        logger.debug("🔁 Повторная доставка обновления %s пропущена", update.update_id)
+        return
+    if PERSIST_UPDATE_MARK:
+        store.set_meta(UPDATE_HIGH_WATER_KEY, dedup.dump())
+    if webhook_reply is not None:
+        bind_webhook_reply(webhook_reply)
+    UPDATES_RECEIVED.inc()
+    try:
+        await router.dispatch_update(update)
+    finally:
+        UPDATES_FINISHED.inc()
+
+
+def submit_update(update, webhook_reply=None):
+    """Передаёт обновление в постоянный event loop, не дожидаясь обработки"""
+    future = asyncio.run_coroutine_threadsafe(process_update(update, webhook_reply), ensure_event_loop())
+    future.add_done_callback(_log_update_error)
+    return future
+
+
+# === Режим шардов ===
+
+def route_update(data):
+    """Отсекает повторы и кладёт обновление (dict) в очередь шарда его пользователя"""
+    # Отметка update_id восстанавливается в фоне — до неё повторы не отличить
+    state_ready.wait()
+    with _route_lock:
+        if dedup.is_duplicate(data['update_id']):
+            logger.debug("🔁 Повторная доставка обновления %s пропущена", data['update_id'])
+            return
+        if PERSIST_UPDATE_MARK:
+            store.set_meta(UPDATE_HIGH_WATER_KEY, dedup.dump())
+    shard_queues.publish(sharding.update_shard(data, shard_queues.shards), data)
+
+
+async def route_polled_update(update):
+    if update_recorder is not None:
+        update_recorder.info(json.dumps(update.json, ensure_ascii=False))
+    route_update(update.json)
+
+
+async def process_recorded_update(update):
+    """Опрос с записью обновлений: исходный dict пишется в файл и разбирается уже здесь"""
+    update_recorder.info(json.dumps(update.json, ensure_ascii=False))
+    await process_update(types.Update.de_json(update.json))
+
+
+def start_workers():
+    """Создаёт очереди шардов и запускает рабочие процессы"""
+    global shard_queues, worker_pool
+    if SHARD_QUEUE_URL:
+        shard_queues = sharding.RedisQueues(SHARD_QUEUE_URL, SHARDS)
+    else:
+        shard_queues = sharding.LocalQueues(SHARDS, WORKERS)
+    logger.info(f"🔀 Шардов: {shard_queues.shards}, очереди: {'Redis' if SHARD_QUEUE_URL else 'локальные'}")
+    worker_pool = sharding.WorkerPool(run_shard_worker, shard_queues, WORKERS).start()
+    return worker_pool
+
+
+def stop_workers():
+    """Дожидается обработки поставленных обновлений и останавливает рабочие процессы"""
+    global worker_pool
+    if worker_pool is None:
+        return
+    worker_pool.stop()
+    worker_pool = None
+
+
+def _report_metrics(index, reports, stopping):
+    """Отправляет метрики процесса главному, пока процесс не останавливают"""
+    # Главный процесс перестаёт читать отчёты при остановке — выход не должен ждать очередь
+    reports.cancel_join_thread()
+    while not stopping.wait(WORKER_METRICS_INTERVAL):
+        try:
+            reports.put((index, registry.collect()))
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки метрик процесса {index}: {e}")
+
+
+def run_shard_worker(queues, index, stopping, reports=None):
+    """Точка входа рабочего процесса: обрабатывает обновления своих шардов"""
+    # Ctrl+C получает вся группа процессов — останавливает нас главный процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    history.shards = queues.shards
+    # /top и /global этого процесса — по всем шардам, чужие доли читаются из хранилища
+    history.share = True
+    ensure_event_loop()
+    if reports is not None:
+        threading.Thread(
+            target=_report_metrics, args=(index, reports, stopping), name='worker-metrics', daemon=True
+        ).start()
+
+    async def handle(update):
+        logs.bind_update(update.update_id)
+        UPDATES_RECEIVED.inc()
+        try:
+            await router.dispatch_update(update)
+        finally:
+            UPDATES_FINISHED.inc()
+
+    def submit(update, shard):
+        future = asyncio.run_coroutine_threadsafe(handle(types.Update.de_json(update)), loop)
+        future.add_done_callback(_log_update_error)
+        return future
+
+    def forget(shard):
+        # Шард перешёл к другому процессу: его пользователи будут перечитаны из хранилища
+        store.forget(lambda user_id: sharding.shard_of(user_id, queues.shards) == shard)
+        history.release(shard)
+
+    worker = sharding.ShardWorker(queues.consumer(index, stopping), submit, forget, history.acquire)
+    worker.run()
+    shutdown_event_loop()
+    return worker.processed
+
+
+# В режиме шардов опрос только раскладывает исходные обновления по очередям;
+# при записи обновлений они тоже нужны в исходном виде
+if SHARDED:
+    process_polled = route_polled_update
+elif update_recorder is not None:
+    process_polled = process_recorded_update
+else:
+    process_polled = process_update
+poller = UpdatePoller(
+    RawUpdateSource(BOT_TOKEN) if SHARDED or update_recorder is not None else bot,
+    process_polled,
+    limit=POLLING_LIMIT, timeout=POLLING_TIMEOUT, concurrency=POLLING_CONCURRENCY
+)
+
+
+async def remove_webhook(retry_delay=1.0, max_retry_delay=60.0):
+    """Снимает вебхук; при ошибках повторяет с нарастающей паузой, пока не получится"""
+    delay = retry_delay
+    while True:
+        try:
+            await bot.delete_webhook()
+            return
+        except Exception as e:
+            wait = retry_after(e) or delay
+            logger.error(f"❌ Ошибка снятия вебхука: {e}. Повтор через {wait:.0f} с")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, max_retry_delay)
+
+
+async def _run_polling():
+    # Пока установлен вебхук, getUpdates отвечает 409
+    await remove_webhook()
+    polling_ready.set()
+    await poller.run()
+
+
+def start_polling():
+    """Запускает long polling в постоянном event loop"""
+    global _poller_future
+    _poller_future = asyncio.run_coroutine_threadsafe(_run_polling(), ensure_event_loop())
+    _poller_future.add_done_callback(_log_update_error)
+    return _poller_future
+
+
+def stop_polling():
+    """Останавливает опрос, дожидаясь обработки текущей пачки"""
+    global _poller_future
+    if _poller_future is None:
+        return
+    if not polling_ready.is_set():
+        # Вебхук ещё не снят — опрос не начинался, дожидаться нечего
+        _poller_future.cancel()
+        _poller_future = None
+        return
+    loop.call_soon_threadsafe(poller.stop)
+    try:
+        _poller_future.result(timeout=15)
+    except Exception:
+        _poller_future.cancel()
+    _poller_future = None
 
 
 # === Обработчики команд ===
 
-@bot.message_handler(commands=['start'])
+@router.command('start')
 async def send_welcome(message):
-    reply_keyboard = create_reply_keyboard()
-    await bot.reply_to(message, (
+    outbox.reply_to(message, (
         "👋 Привет! Я бот для статистики Raid Shards.\n\n"
         "🎯 Выберите тип осколка или воспользуйтесь кнопками ниже!\n\n"
         "💡 Нажмите «🎉 ВЫПАЛО!», если получили героя и хотите сбросить счётчик."
-    ), reply_markup=reply_keyboard)
-    await bot.send_message(message.chat.id, "Выберите тип осколка:", reply_markup=create_shards_keyboard())
+    ), reply_markup=REPLY_KEYBOARD)
+    outbox.send_message(message.chat.id, "Выберите тип осколка:", reply_markup=SHARDS_KEYBOARD)
 
 
-@bot.message_handler(commands=['help'])
+@router.command('help')
 async def send_help(message):
-    help_text = """📚 <b>Доступные команды:</b>
-
-/start — 🚀 Начать
-/info_shard — ℹ️ Шансы призыва
-/stats — 📊 Статистика
-📥 Ввести кол-во осколков — указать количество
-🎉 ВЫПАЛО! — сбросить счётчик"""
-    await bot.reply_to(message, help_text, parse_mode='HTML', reply_markup=create_reply_keyboard())
+    outbox.reply_to(message, HELP_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
 
-@bot.message_handler(commands=['stats'])
+@router.command('stats')
 async def send_stats_command(message):
     user_id = message.from_user.id
     stats_text = format_stats(user_id)
     if not stats_text:
-        await bot.reply_to(
-            message,
-            "📊 <b>Статистика открытых осколков</b>\n\n"
-            "❌ У вас пока нет данных.\n"
-            "👉 Укажите количество или нажмите «📥 Ввести кол-во осколков».",
-            parse_mode='HTML',
-            reply_markup=create_reply_keyboard()
-        )
+        outbox.reply_to(message, NO_STATS_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
     else:
-        await bot.reply_to(message, stats_text, parse_mode='HTML', reply_markup=create_reply_keyboard())
+        outbox.reply_to(message, stats_text, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
 
-@bot.message_handler(commands=['info_shard'])
-async def send_shard_info(message):
-    info_text = """📊 <b>Шансы призыва по системе компенсации неудач</b>
+@router.command('history')
+async def send_history(message):
+    history_text = format_history(message.from_user.id)
+    if not history_text:
+        outbox.reply_to(message, NO_HISTORY_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
+    else:
+        outbox.reply_to(message, history_text, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
-🔵 <b>Древний / Темный осколок</b>
-   • Эпик: 20+ → +2%
-   • Легенда: 200+ → +5%
 
-💎 <b>Циркон Первозданный осколок</b>
-   • Мифик: 200+ → +10%
+@router.command('chances')
+async def send_chances(message):
+    outbox.reply_to(message, format_chances(message.from_user.id), parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
+
+
+@router.command('top')
+async def send_top(message):
+    top_text = format_top(message.from_user.id)
+    if not top_text:
+        outbox.reply_to(message, NO_TOP_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
+    else:
+        outbox.reply_to(message, top_text, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
-⭐ <b>Сакральный осколок</b>
-   • Легенда: 12+ → +2%"""
-    await bot.reply_to(message, info_text, parse_mode='HTML', reply_markup=create_reply_keyboard())
+
+@router.command('global')
+async def send_global(message):
+    outbox.reply_to(message, format_global(), parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
+
+
+@router.command('info_shard')
+async def send_shard_info(message):
+    outbox.reply_to(message, SHARD_INFO_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
 
 # === Callback-обработчики ===
 
-@bot.callback_query_handler(func=lambda call: call.data == 'show_stats')
+@router.callback('show_stats')
 async def show_stats_callback(call):
-    await bot.answer_callback_query(call.id)
+    outbox.answer_callback(call.id)
     user_id = call.from_user.id
     stats_text = format_stats(user_id)
     if not stats_text:
-        await bot.send_message(
-            call.message.chat.id,
-            "📊 <b>Статистика открытых осколков</b>\n\n"
-            "❌ У вас пока нет данных.\n"
-            "👉 Укажите количество или нажмите «📥 Ввести кол-во осколков».",
-            parse_mode='HTML',
-            reply_markup=create_reply_keyboard()
-        )
+        outbox.send_message(call.message.chat.id, NO_STATS_TEXT, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
     else:
-        await bot.send_message(call.message.chat.id, stats_text, parse_mode='HTML', reply_markup=create_reply_keyboard())
+        outbox.send_message(call.message.chat.id, stats_text, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred'])
+@router.callback(*LEGENDARY_THRESHOLDS)
 async def handle_shard_selection(call):
-    await bot.answer_callback_query(call.id)
+    outbox.answer_callback(call.id)
     user_id = call.from_user.id
     shard_type = call.data
 
@@ -270,20 +904,17 @@ async def handle_shard_selection(call):
     }
     shard_name = shard_names[shard_type]
 
-    if user_id not in user_shards_data:
-        user_shards_data[user_id] = {}
-
-    current_count = user_shards_data[user_id].get(shard_type, 0)
+    current_count = store.get_count(user_id, shard_type)
 
     if current_count == 0:
-        waiting_for_input[user_id] = shard_type
-        await bot.send_message(
+        store.set_pending(user_id, shard_type)
+        outbox.send_message(
             call.message.chat.id,
             f"✅ Выбран {shard_name}!\n\n📝 Укажите кол-во открытых осколков!\n\n"
             f"ℹ️ Текущее количество: <b>0</b>\n"
             f"💡 Введите число, чтобы добавить к текущему количеству.",
             parse_mode='HTML',
-            reply_markup=create_reply_keyboard()
+            reply_markup=REPLY_KEYBOARD
         )
     else:
         threshold = LEGENDARY_THRESHOLDS[shard_type]
@@ -297,50 +928,53 @@ async def handle_shard_selection(call):
         stats_text += f"⏳ До легендарного: <b>{remaining}</b>\n\n"
         stats_text += f"💡 Введите число, чтобы добавить к текущему количеству:"
 
-        await bot.send_message(call.message.chat.id, stats_text, parse_mode='HTML', reply_markup=create_reply_keyboard())
-        waiting_for_input[user_id] = shard_type
+        outbox.send_message(call.message.chat.id, stats_text, parse_mode='HTML', reply_markup=REPLY_KEYBOARD)
+        store.set_pending(user_id, shard_type)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("show_reset_menu_"))
+@router.callback_prefix("show_reset_menu_")
 async def show_reset_menu(call):
     shard_type = call.data.replace("show_reset_menu_", "")
     if shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
-        await bot.answer_callback_query(call.id)
-        markup = create_reset_rarity_keyboard(shard_type)
-        await bot.send_message(call.message.chat.id, "Выберите редкость героя, который выпал:", reply_markup=markup)
+        outbox.answer_callback(call.id)
+        markup = RESET_RARITY_KEYBOARDS[shard_type]
+        outbox.send_message(call.message.chat.id, "Выберите редкость героя, который выпал:", reply_markup=markup)
     else:
-        await bot.answer_callback_query(call.id, "Ошибка", show_alert=True)
+        outbox.answer_callback(call.id, "Ошибка", show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("reset_choice_"))
+@router.callback_prefix("reset_choice_")
 async def handle_reset_shard_choice(call):
     shard_type = call.data.replace("reset_choice_", "")
     if shard_type in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
-        await bot.answer_callback_query(call.id)
-        markup = create_reset_rarity_keyboard(shard_type)
-        await bot.send_message(call.message.chat.id, "Выберите редкость героя, который выпал:", reply_markup=markup)
+        outbox.answer_callback(call.id)
+        markup = RESET_RARITY_KEYBOARDS[shard_type]
+        outbox.send_message(call.message.chat.id, "Выберите редкость героя, который выпал:", reply_markup=markup)
     else:
-        await bot.answer_callback_query(call.id, "Неверный тип осколка", show_alert=True)
+        outbox.answer_callback(call.id, "Неверный тип осколка", show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("reset_"))
+@router.callback_prefix("reset_")
 async def handle_reset_shard(call):
     user_id = call.from_user.id
     parts = call.data.split('_', 3)
     if len(parts) != 4:
-        await bot.answer_callback_query(call.id, "Ошибка", show_alert=True)
+        outbox.answer_callback(call.id, "Ошибка", show_alert=True)
         return
 
     shard_type = f"{parts[1]}_{parts[2]}"
     rarity_key = parts[3]
 
     if shard_type not in ['shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred']:
-        await bot.answer_callback_query(call.id, "Неверный тип", show_alert=True)
+        outbox.answer_callback(call.id, "Неверный тип", show_alert=True)
         return
 
-    if user_id not in user_shards_data:
-        user_shards_data[user_id] = {}
-    user_shards_data[user_id][shard_type] = 0
+    pulls = store.get_count(user_id, shard_type)
+    if rarity_key in RARITIES and pulls > 0:
+        # Сколько осколков понадобилось до героя — для /history; сброс пустого счётчика
+        # не выпадение и среднее не портит
+        history.record_reset(user_id, shard_type, rarity_key, pulls)
+    store.set_count(user_id, shard_type, 0)
 
     shard_names = {
         'shard_blue': 'Синий 💠',
@@ -357,59 +991,56 @@ async def handle_reset_shard(call):
     shard_name = shard_names[shard_type]
     rarity_name = rarity_names.get(rarity_key, 'Неизвестной')
 
-    await bot.answer_callback_query(call.id, "Счётчик сброшен!")
-    await bot.send_message(
+    outbox.answer_callback(call.id, "Счётчик сброшен!")
+    outbox.send_message(
         call.message.chat.id,
         f"✅ Счётчик для {shard_name}, {rarity_name} героя сброшен!",
-        reply_markup=create_reply_keyboard()
+        reply_markup=REPLY_KEYBOARD
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "cancel_reset")
+@router.callback("cancel_reset")
 async def handle_cancel_reset(call):
-    await bot.answer_callback_query(call.id, "Сброс отменён")
-    try:
-        await bot.delete_message(call.message.chat.id, call.message.message_id)
-    except:
-        pass
+    outbox.answer_callback(call.id, "Сброс отменён")
+    outbox.delete_message(call.message.chat.id, call.message.message_id)
 
 
 # === Обработка текстовых кнопок ===
 
-@bot.message_handler(func=lambda message: message.text == "📊 Статистика")
+@router.text("📊 Статистика")
 async def stats_from_button(message):
     await send_stats_command(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "📥 Ввести кол-во осколков")
+@router.text("📥 Ввести кол-во осколков")
 async def enter_count_button(message):
-    await bot.reply_to(message, 
+    outbox.reply_to(message, 
         "🎯 Выберите тип осколка для ввода количества!",
-        reply_markup=create_reply_keyboard()
+        reply_markup=REPLY_KEYBOARD
     )
-    await bot.send_message(message.chat.id, "Выберите тип осколка:", reply_markup=create_shards_keyboard())
+    outbox.send_message(message.chat.id, "Выберите тип осколка:", reply_markup=SHARDS_KEYBOARD)
 
 
-@bot.message_handler(func=lambda message: message.text == "🎉 ВЫПАЛО!")
+@router.text("🎉 ВЫПАЛО!")
 async def handle_reset_button(message):
-    await bot.send_message(
+    outbox.send_message(
         message.chat.id,
         "Выберите тип осколка, по которому выпал герой:",
-        reply_markup=create_shards_reset_keyboard()
+        reply_markup=SHARDS_RESET_KEYBOARD
     )
 
 
-@bot.message_handler(func=lambda message: message.text == "ℹ️ Информация")
+@router.text("ℹ️ Информация")
 async def info_from_button(message):
     await send_shard_info(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "❓ Помощь")
+@router.text("❓ Помощь")
 async def help_from_button(message):
     await send_help(message)
 
 
-@bot.message_handler(func=lambda message: True)
+@router.fallback
 async def handle_message(message):
     user_id = message.from_user.id
     text = message.text.strip()
@@ -417,22 +1048,21 @@ async def handle_message(message):
     if text.startswith('/'):
         return
 
-    if user_id in waiting_for_input:
-        shard_type = waiting_for_input[user_id]
+    shard_type = store.get_pending(user_id)
+    if shard_type is not None:
         try:
             count = int(text)
             if count < 0:
-                await bot.reply_to(message, "❌ Число должно быть ≥ 0!", reply_markup=create_reply_keyboard())
+                outbox.reply_to(message, "❌ Число должно быть ≥ 0!", reply_markup=REPLY_KEYBOARD)
+                return
+            # Счётчики — int64: проверяем и само число, и сумму с уже открытым
+            if count > MAX_SHARD_COUNT - store.get_count(user_id, shard_type):
+                outbox.reply_to(message, "❌ Слишком большое число", reply_markup=REPLY_KEYBOARD)
                 return
 
-            if user_id not in user_shards_data:
-                user_shards_data[user_id] = {}
-            
-            # Получаем текущее количество и прибавляем новое
-            current_count = user_shards_data[user_id].get(shard_type, 0)
-            new_count = current_count + count
-            
-            user_shards_data[user_id][shard_type] = new_count
+            # Прибавляем к текущему количеству
+            new_count = store.add(user_id, shard_type, count)
+            history.record_add(user_id, shard_type, count)
 
             shard_names = {
                 'shard_blue': 'Синий 💠',
@@ -456,16 +1086,14 @@ async def handle_message(message):
                 stats_text += f"⚡ До эпического: <b>{epic_remaining}</b>\n"
             stats_text += f"⏳ До легендарного: <b>{remaining}</b>"
 
-            reset_markup = types.InlineKeyboardMarkup()
-            reset_markup.add(types.InlineKeyboardButton("🎉 ВЫПАЛО! → Сбросить счётчик", callback_data=f"show_reset_menu_{shard_type}"))
-            await bot.reply_to(message, stats_text, parse_mode='HTML', reply_markup=reset_markup)
+            outbox.reply_to(message, stats_text, parse_mode='HTML', reply_markup=RESET_MENU_KEYBOARDS[shard_type])
 
-            del waiting_for_input[user_id]
+            store.clear_pending(user_id)
 
         except ValueError:
-            await bot.reply_to(message, "❌ Введите число!", reply_markup=create_reply_keyboard())
+            outbox.reply_to(message, "❌ Введите число!", reply_markup=REPLY_KEYBOARD)
     else:
-        await bot.reply_to(message, "Неизвестная команда. Используйте кнопки.", reply_markup=create_reply_keyboard())
+        outbox.reply_to(message, "Неизвестная команда. Используйте кнопки.", reply_markup=REPLY_KEYBOARD)
 
 
 # === Flask роуты для вебхука ===
@@ -474,15 +1102,35 @@ async def handle_message(message):
 def index():
     return "Telegram Bot is running on Koyeb! Webhook URL: " + WEBHOOK_URL
 
+@app.route('/metrics')
+def metrics_route():
+    # С WORKERS — вместе с последними метриками рабочих процессов
+    workers = worker_pool.reports_by_worker() if worker_pool is not None else None
+    return Response(registry.render(workers), mimetype='text/plain; version=0.0.4')
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     if request.headers.get('content-type') == 'application/json':
         json_string = request.get_data().decode('utf-8')
+        if update_recorder is not None:
+            update_recorder.info(json_string)
+        if SHARDED:
+            # Обрабатывает рабочий процесс шарда; ответ на callback уйдёт отдельным запросом
+            route_update(json.loads(json_string))
+            return ''
         update = types.Update.de_json(json_string)
         
-        # Обрабатываем обновление асинхронно
-        asyncio.run(bot.process_new_updates([update]))
-        
+        # Отдаём обновление постоянному event loop и сразу отвечаем 200.
+        # Ответ на callback-запрос возвращаем прямо в теле ответа — на один запрос к API меньше
+        if update.callback_query is None:
+            submit_update(update)
+            return ''
+        webhook_reply = WebhookReply()
+        future = submit_update(update, webhook_reply)
+        future.add_done_callback(lambda _: webhook_reply.finish())
+        payload = webhook_reply.take(WEBHOOK_REPLY_WAIT)
+        if payload is not None:
+            return jsonify(payload)
         return ''
     return 'Bad Request', 400
 
@@ -492,6 +1140,58 @@ def setup_webhook_route():
     setup_webhook_sync()
     return f"Webhook setup attempted for URL: {WEBHOOK_URL}<br>Check logs for details."
 
+@app.route('/ready')
+def ready():
+    """Проба готовности: 200, когда обновления действительно начнут приходить и обрабатываться"""
+    checks = {'state': state_ready.is_set(), 'event_loop': _loop_thread is not None and loop.is_running()}
+    if RUN_MODE == 'polling':
+        checks['polling'] = polling_ready.is_set() and _poller_future is not None and not _poller_future.done()
+    else:
+        checks['webhook'] = webhook_ready.is_set()
+    if SHARDED:
+        checks['workers'] = worker_pool is not None
+    status = 200 if all(checks.values()) else 503
+    return jsonify({'ready': status == 200, 'checks': checks}), status
+
+
+def _admin_allowed():
+    expected = f"Bearer {ADMIN_TOKEN}"
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), expected)
+
+
+@app.route('/admin/export', methods=['GET'])
+def export_route():
+    """Потоковая выгрузка счётчиков и журнала: ?format=ndjson (по умолчанию) или binary"""
+    if not _admin_allowed():
+        return 'Not Found', 404
+    export_format = request.args.get('format', 'ndjson')
+    import transfer  # только для администратора — не замедляет запуск
+
+    if export_format not in transfer.FORMATS:
+        return 'Bad Request', 400
+    logger.info(f"📤 Выгрузка счётчиков ({export_format})")
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/octet-stream'
+    return Response(transfer.export_stream(store, history, export_format), mimetype=mimetype)
+
+
+@app.route('/admin/import', methods=['POST'])
+def import_route():
+    """Загрузка выгрузки из тела запроса; формат определяется по содержимому"""
+    if not _admin_allowed():
+        return 'Not Found', 404
+    if SHARDED:
+        # Счётчики живут в кэшах рабочих процессов — запись в обход них была бы перезаписана
+        return 'Conflict: загрузка недоступна в режиме шардов', 409
+    import transfer
+
+    try:
+        # Небольшие пачки: пока пачка пишется в бэкенд, обработчики ждут блокировку хранилища
+        result = transfer.import_stream(request.stream, store, history, chunk_size=1000)
+    except ValueError as e:
+        return f"Bad Request: {e}", 400
+    logger.info(f"📥 Загружено: {result}")
+    return jsonify(result)
+
 
 # === Запуск бота на Koyeb ===
 
@@ -499,20 +1199,37 @@ def run_flask():
     """Запуск Flask приложения"""
     port = int(os.environ.get('PORT', 8080))
     logger.info(f"🚀 Запускаем Flask на порту {port}")
-    logger.info(f"🌐 Домен приложения: {KOYEB_APP_DOMAIN}")
-    logger.info(f"🔗 Вебхук URL: {WEBHOOK_URL}")
-    app.run(host='0.0.0.0', port=port)
+    if RUN_MODE == 'webhook':
+        logger.info(f"🌐 Домен приложения: {KOYEB_APP_DOMAIN}")
+        logger.info(f"🔗 Вебхук URL: {WEBHOOK_URL}")
+    ensure_event_loop()
+    app.run(host='0.0.0.0', port=port, threaded=True)
+
+
+def _handle_sigterm(signum, frame):
+    """Koyeb останавливает инстанс через SIGTERM — дописываем хранилище перед выходом"""
+    logger.info("🛑 Получен SIGTERM, сохраняем данные...")
+    shutdown_event_loop()
+    raise SystemExit(0)
 
 
 if __name__ == "__main__":
     logger.info("🚀 Бот запускается на Koyeb...")
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+    if SHARDED:
+        start_workers()
     
-    # Устанавливаем вебхук при старте
-    setup_webhook_sync()
-    
-    logger.info("✅ Вебхук установлен, запускаем Flask сервер...")
+    if RUN_MODE == 'polling':
+        logger.info("📡 Режим long polling: вебхук будет снят, обновления забираются через getUpdates")
+        start_polling()
+    else:
+        # Вебхук устанавливается в фоне: порт открывается сразу, готовность видна в /ready
+        start_webhook_registration()
+        
+        logger.info("🔄 Вебхук устанавливается в фоне, запускаем Flask сервер...")
+        logger.info(f"🔧 Для повторной установки вебхука откройте: https://{KOYEB_APP_DOMAIN}/setup_webhook")
     logger.info("🌐 Проверьте работу: /start в Telegram")
-    logger.info(f"🔧 Для повторной установки вебхука откройте: https://{KOYEB_APP_DOMAIN}/setup_webhook")
     
     # Запускаем Flask сервер
     run_flask()
\ No newline at end of file
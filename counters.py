@@ -0,0 +1,154 @@
+"""Компактная таблица счётчиков осколков
+
+Вместо словаря {shard_type: count} на каждого пользователя все счётчики лежат
+в одном массиве int64: строка на пользователя, столбец на тип осколка плюс
+битовая маска «счётчик задан». Таблица сериализуется одним куском прямо из буфера.
+
+Для вытеснения используется CLOCK (приближение LRU): обращение только ставит
+бит в bytearray, без перестановок в словаре.
+"""
+from array import array
+
+FREE_SLOT = -1  # user_id свободной строки; id пользователей Telegram положительные
+MAX_COUNT = (1 << 63) - 1  # больше в ячейку int64 не поместится — array бросит OverflowError
+
+
+class CounterTable:
+    """Счётчики пользователей в плоском массиве с вытеснением по CLOCK"""
+
+    def __init__(self, shard_types):
+        self.shard_types = tuple(shard_types)
+        self.ordinals = {shard_type: i for i, shard_type in enumerate(self.shard_types)}
+        self._mask_column = len(self.shard_types)
+        self._stride = len(self.shard_types) + 1
+        self._zero_row = array('q', bytes(8 * self._stride))
+        self._slots = {}                # {user_id: номер строки}
+        self._owners = array('q')       # номер строки -> user_id
+        self._referenced = bytearray()  # бит обращения для CLOCK
+        self._data = array('q')
+        self._free = []
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, user_id):
+        return user_id in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def touch(self, user_id):
+        """Отмечает пользователя как недавно использованного"""
+        self._referenced[self._slots[user_id]] = 1
+
+    def insert(self, user_id, counts):
+        """Добавляет пользователя со счётчиками из словаря {shard_type: count}"""
+        if self._free:
+            slot = self._free.pop()
+            self._owners[slot] = user_id
+            self._referenced[slot] = 1
+        else:
+            slot = len(self._owners)
+            self._owners.append(user_id)
+            self._referenced.append(1)
+            self._data.extend(self._zero_row)
+        self._slots[user_id] = slot
+        self._write_row(slot, counts)
+
+    def _write_row(self, slot, counts):
+        base = slot * self._stride
+        data = self._data
+        mask = 0
+        data[base:base + self._stride] = self._zero_row
+        for shard_type, count in counts.items():
+            ordinal = self.ordinals[shard_type]
+            data[base + ordinal] = count
+            mask |= 1 << ordinal
+        data[base + self._mask_column] = mask
+
+    def _read_row(self, slot):
+        base = slot * self._stride
+        data = self._data
+        mask = data[base + self._mask_column]
+        return {
+            shard_type: data[base + i]
+            for i, shard_type in enumerate(self.shard_types)
+            if mask >> i & 1
+        }
+
+    def _release(self, slot):
+        self._owners[slot] = FREE_SLOT
+        self._referenced[slot] = 0
+        self._free.append(slot)
+
+    def remove(self, user_id):
+        """Удаляет пользователя и возвращает его счётчики словарём"""
+        slot = self._slots.pop(user_id)
+        counts = self._read_row(slot)
+        self._release(slot)
+        return counts
+
+    def evict(self):
+        """Вытесняет пользователя по CLOCK: (user_id, счётчики)"""
+        if not self._slots:
+            raise KeyError("Таблица пуста")
+        owners, referenced = self._owners, self._referenced
+        size = len(owners)
+        while True:
+            slot = self._hand
+            self._hand = (slot + 1) % size
+            if owners[slot] == FREE_SLOT:
+                continue
+            if referenced[slot]:
+                referenced[slot] = 0
+                continue
+            user_id = owners[slot]
+            del self._slots[user_id]
+            counts = self._read_row(slot)
+            self._release(slot)
+            return user_id, counts
+
+    def as_dict(self, user_id):
+        """Счётчики пользователя словарём — только заданные, как раньше в user_shards_data"""
+        return self._read_row(self._slots[user_id])
+
+    def get(self, user_id, shard_type):
+        return self._data[self._slots[user_id] * self._stride + self.ordinals[shard_type]]
+
+    def set(self, user_id, shard_type, count):
+        base = self._slots[user_id] * self._stride
+        ordinal = self.ordinals[shard_type]
+        self._data[base + ordinal] = count
+        self._data[base + self._mask_column] |= 1 << ordinal
+
+    def add(self, user_id, shard_type, delta):
+        """Прибавляет delta и возвращает новое значение"""
+        base = self._slots[user_id] * self._stride
+        ordinal = self.ordinals[shard_type]
+        count = self._data[base + ordinal] + delta
+        self._data[base + ordinal] = count
+        self._data[base + self._mask_column] |= 1 << ordinal
+        return count
+
+    # --- Пакетная сериализация ---
+
+    def dump(self):
+        """Снимок буферов как есть: (owners, rows); свободные строки помечены FREE_SLOT"""
+        return self._owners.tobytes(), self._data.tobytes()
+
+    @classmethod
+    def load(cls, shard_types, owners, rows):
+        """Восстанавливает таблицу из результата dump()"""
+        table = cls(shard_types)
+        table._owners.frombytes(owners)
+        table._data.frombytes(rows)
+        if len(table._data) != len(table._owners) * table._stride:
+            raise ValueError("Размер строк не совпадает с числом владельцев")
+        table._referenced = bytearray(len(table._owners))
+        for slot, user_id in enumerate(table._owners):
+            if user_id == FREE_SLOT:
+                table._free.append(slot)
+            else:
+                table._slots[user_id] = slot
+        return table
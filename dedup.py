@@ -0,0 +1,81 @@
+"""Защита от повторной доставки обновлений
+
+Если вебхук отвечает медленно, Telegram присылает то же обновление ещё раз.
+Уже принятые update_id помнятся в скользящем окне: кольцевой буфер задаёт порядок
+вытеснения, множество даёт проверку за O(1). Всё, что не больше нижней границы
+(самого большого вытесненного id), считается уже обработанным.
+
+Верхнюю отметку (high-water mark) можно сохранить и восстановить после перезапуска.
+Telegram выбирает следующий update_id случайно, если обновлений не было неделю,
+поэтому после долгой паузы окно сбрасывается.
+"""
+import time
+from collections import deque
+
+MAX_IDLE = 7 * 24 * 3600  # через неделю тишины нумерация update_id начинается заново
+
+
+class UpdateDeduplicator:
+    """Скользящее окно последних update_id; используется из одного потока (event loop)"""
+
+    def __init__(self, window=10000, max_idle=MAX_IDLE):
+        self.window = window
+        self.max_idle = max_idle
+        self._ring = deque()
+        self._seen = set()
+        self._floor = None       # id не больше этого уже обработаны
+        self.high_water = None   # самый большой принятый id
+        self.last_seen_at = None
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def reset(self):
+        self._ring.clear()
+        self._seen.clear()
+        self._floor = None
+        self.high_water = None
+
+    def restore(self, high_water, seen_at, now=None):
+        """Восстанавливает отметку после перезапуска; устаревшая игнорируется"""
+        now = time.time() if now is None else now
+        if now - seen_at > self.max_idle:
+            return False
+        self.reset()
+        self._floor = self.high_water = high_water
+        self.last_seen_at = seen_at
+        return True
+
+    def is_duplicate(self, update_id, now=None):
+        """True, если update_id уже был; иначе запоминает его и возвращает False"""
+        now = time.time() if now is None else now
+        if self.last_seen_at is not None and now - self.last_seen_at > self.max_idle:
+            self.reset()
+        if update_id in self._seen or (self._floor is not None and update_id <= self._floor):
+            self.duplicates += 1
+            return True
+        self.last_seen_at = now
+        self._seen.add(update_id)
+        self._ring.append(update_id)
+        if len(self._ring) > self.window:
+            oldest = self._ring.popleft()
+            self._seen.discard(oldest)
+            if self._floor is None or oldest > self._floor:
+                self._floor = oldest
+        if self.high_water is None or update_id > self.high_water:
+            self.high_water = update_id
+        return False
+
+    def dump(self):
+        """Отметка для сохранения: 'high_water:unix_time' или None"""
+        if self.high_water is None:
+            return None
+        return f"{self.high_water}:{int(self.last_seen_at)}"
+
+    def load(self, value, now=None):
+        """Обратное к dump(); пустое или устаревшее значение игнорируется"""
+        if not value:
+            return False
+        high_water, _, seen_at = value.partition(':')
+        return self.restore(int(high_water), float(seen_at), now)
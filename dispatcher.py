@@ -0,0 +1,206 @@
+"""Табличная маршрутизация обновлений
+
+Вместо цепочки фильтров telebot (по предикату на каждый обработчик, в порядке
+регистрации) обработчик ищется по таблицам: команды и тексты кнопок — в словаре,
+callback_data — сначала точное совпадение, затем самый длинный префикс в префиксном дереве.
+Обновление передаётся обработчику напрямую, минуя process_new_updates telebot.
+Обновления одного пользователя обрабатываются строго по очереди, разных — параллельно.
+Если задан observer, он получает длительность каждого вызова обработчика (для метрик).
+Если задан preload, он вызывается перед обработчиком уже в очереди пользователя —
+например, чтобы загрузить его данные, не нарушая порядок обновлений.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_VALUE = ''  # ключ значения в узле дерева; не совпадает ни с одним символом
+
+
+class PrefixTrie:
+    """Префиксное дерево с поиском самого длинного совпавшего префикса"""
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_VALUE] = value
+
+    def longest_match(self, key):
+        """Значение самого длинного префикса key или None — O(длины префикса)"""
+        node = self._root
+        best = node.get(_VALUE)
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            if _VALUE in node:
+                best = node[_VALUE]
+        return best
+
+
+class KeyedLock:
+    """Набор asyncio.Lock по ключу; запись удаляется, когда её никто не ждёт
+
+    asyncio.Lock отдаёт блокировку в порядке вызова acquire(), поэтому
+    обновления одного ключа выполняются в порядке поступления.
+    """
+
+    def __init__(self):
+        self._locks = {}  # {key: [lock, число держащих и ждущих]}
+
+    def __len__(self):
+        return len(self._locks)
+
+    async def run(self, key, coro_factory):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await coro_factory()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+def update_user_id(update):
+    """id пользователя, от которого пришло обновление, или None"""
+    item = update.message or update.callback_query
+    if item is None or item.from_user is None:
+        return None
+    return item.from_user.id
+
+
+def extract_command(text):
+    """'/start@bot payload' -> 'start'; None, если это не команда"""
+    if not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0][1:].split('@', 1)[0]
+
+
+class Router:
+    """Таблица обработчиков сообщений и callback-запросов"""
+
+    def __init__(self, serialize_users=True):
+        self.serialize_users = serialize_users
+        self._user_locks = KeyedLock()
+        self._commands = {}
+        self._texts = {}
+        self._fallback = None
+        self._callbacks = {}
+        self._callback_prefixes = PrefixTrie()
+        self.observer = None  # observer(handler, секунд, исключение или None)
+        self.preload = None   # async preload(user_id)
+
+    # --- Регистрация ---
+
+    def command(self, *commands):
+        def decorator(handler):
+            for command in commands:
+                self._commands[command] = handler
+            return handler
+        return decorator
+
+    def text(self, *texts):
+        def decorator(handler):
+            for text in texts:
+                self._texts[text] = handler
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        """Обработчик сообщений, для которых не нашлось команды или кнопки"""
+        self._fallback = handler
+        return handler
+
+    def callback(self, *data):
+        def decorator(handler):
+            for value in data:
+                self._callbacks[value] = handler
+            return handler
+        return decorator
+
+    def callback_prefix(self, prefix):
+        def decorator(handler):
+            self._callback_prefixes.insert(prefix, handler)
+            return handler
+        return decorator
+
+    # --- Поиск ---
+
+    def resolve_message(self, message):
+        text = message.text
+        if text is None:
+            return None
+        command = extract_command(text)
+        if command is not None:
+            return self._commands.get(command, self._fallback)
+        return self._texts.get(text, self._fallback)
+
+    def resolve_callback(self, call):
+        data = call.data
+        if data is None:
+            return None
+        handler = self._callbacks.get(data)
+        if handler is None:
+            handler = self._callback_prefixes.longest_match(data)
+        return handler
+
+    def stats(self):
+        """Сколько пользователей сейчас обрабатывается или ждёт своей очереди"""
+        return {'user_locks': len(self._user_locks)}
+
+    async def _call(self, handler, item):
+        if self.observer is None:
+            await handler(item)
+            return
+        started = time.perf_counter()
+        error = None
+        try:
+            await handler(item)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.observer(handler, time.perf_counter() - started, error)
+
+    async def dispatch_message(self, message):
+        handler = self.resolve_message(message)
+        if handler is not None:
+            await self._call(handler, message)
+
+    async def dispatch_callback(self, call):
+        handler = self.resolve_callback(call)
+        if handler is not None:
+            await self._call(handler, call)
+
+    async def _dispatch(self, update):
+        if update.message is not None:
+            await self.dispatch_message(update.message)
+        elif update.callback_query is not None:
+            await self.dispatch_callback(update.callback_query)
+
+    async def _dispatch_user(self, user_id, update):
+        if self.preload is not None:
+            await self.preload(user_id)
+        await self._dispatch(update)
+
+    async def dispatch_update(self, update):
+        """Обрабатывает types.Update; ошибки обработчика логируются, как это делал telebot"""
+        try:
+            user_id = update_user_id(update)
+            if user_id is None:
+                await self._dispatch(update)
+            elif self.serialize_users:
+                await self._user_locks.run(user_id, lambda: self._dispatch_user(user_id, update))
+            else:
+                await self._dispatch_user(user_id, update)
+        except Exception as e:
+            logger.error("❌ Ошибка в обработчике обновления %s: %s", update.update_id, e)
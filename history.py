@@ -0,0 +1,604 @@
+"""Журнал осколков: добавления и «ВЫПАЛО!» с редкостью героя
+
+Журнал только дописывается: каждое событие — запись фиксированного размера
+(время, user_id, вид, тип осколка, редкость, число) в бинарном файле.
+Записи копятся в буфере и дописываются пачкой раз в flush_interval секунд.
+
+Журнал делится на части по шардам пользователей (sharding.shard_of), у каждой части
+свой файл. Шард в каждый момент обрабатывает один процесс: он забирает части своих
+шардов (acquire) и отдаёт их, когда шард уходит к другому процессу (release). Поэтому
+в файл пишет один процесс, а события пользователя лежат в одном файле по порядку.
+При shards=1 часть одна и файл — сам path.
+
+Сброс хранит, за сколько осколков выпал герой, поэтому агрегаты (сколько раз
+выпадала редкость и сумма осколков до неё) обновляются инкрементально при записи
+и отвечают на /history без чтения журнала. Агрегаты пользователей лежат в отдельном
+ShardStore: в памяти только недавно активные, остальные — в бэкенде, поэтому память
+не растёт с числом пользователей и агрегаты не нужно восстанавливать при старте.
+
+У каждой части свои итоги и своя доля общей статистики (stats_factory(), например
+leaderboard.GlobalStats) — они обновляются на каждом событии и вместе с агрегатами
+сохраняются в метаданные хранилища (ключ partial:<шард>). Процесс, забравший часть,
+читает их оттуда; если их нет или они не сходятся с файлом (например, после падения),
+пересчитывает из агрегатов и сбросов в файле. totals() и global_stats() сливают части
+процесса, а с share — и чужие части, которые фоновый поток читает из хранилища.
+
+Сжатие (compact) сливает подряд идущие добавления одного осколка между сбросами
+в одно — суммы при этом не меняются. Файл читается блоками по BLOCK_RECORDS записей,
+сливаются добавления внутри блока.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+
+import storage
+from sharding import shard_of
+
+logger = logging.getLogger(__name__)
+
+ADD = 0
+RESET = 1
+RARITIES = ('epic', 'legendary', 'mythic')
+
+# time u32, user_id i64, вид u8, тип осколка u8, редкость u8, amount i64
+RECORD = struct.Struct('<IqBBBq')
+BLOCK_RECORDS = 65536  # столько записей читается за раз при загрузке и сжатии (1,5 МиБ)
+
+
+def aggregate_columns(shard_types):
+    """Имена счётчиков агрегатов: на тип осколка «открыто», затем «сколько раз» и «сумма» по редкостям"""
+    columns = []
+    for shard_type in shard_types:
+        columns.append(f"{shard_type}:opened")
+        for rarity in RARITIES:
+            columns += [f"{shard_type}:{rarity}:drops", f"{shard_type}:{rarity}:pulls"]
+    return tuple(columns)
+
+
+def _blocks(log, size, block_records=BLOCK_RECORDS):
+    """Первые size байт открытого файла блоками по block_records целых записей"""
+    remaining = size - size % RECORD.size
+    step = block_records * RECORD.size
+    while remaining > 0:
+        data = log.read(min(step, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+class _Part:
+    """Часть журнала одного шарда: файл, буфер записи, итоги и доля общей статистики"""
+
+    def __init__(self, path, width, stats):
+        self.path = path
+        self.buffer = bytearray()
+        self.records = 0
+        self.compacted_records = 0  # записей в файле после последнего сжатия
+        self.totals = array('q', bytes(8 * width))
+        self.stats = stats
+        self.version = 0  # растёт с каждым событием; сохранённая в хранилище копия — saved_version
+        self.saved_version = 0
+
+
+class HistoryLog:
+    """Журнал событий с агрегатами по пользователям и по всем сразу
+
+    Агрегаты пользователя — счётчики aggregate_columns() в ShardStore поверх backend
+    (по умолчанию в памяти; у бота — то же хранилище, что и у счётчиков, в пространстве
+    имён history), в кэше не больше capacity пользователей. Итоги части — строка
+    array('q') в том же порядке столбцов.
+
+    share=True — процесс ведёт не все шарды и должен видеть в totals() и global_stats()
+    остальные: их доли раз в flush_interval читаются из хранилища (отставание — до двух
+    flush_interval, пока их владелец не сбросит свои).
+    """
+
+    def __init__(self, path, shard_types, backend=None, shards=1, flush_interval=1.0, compact_after=100000,
+                 capacity=50000, stats_factory=None, share=False):
+        self.path = path
+        self.shard_types = tuple(shard_types)
+        self.ordinals = {shard_type: i for i, shard_type in enumerate(self.shard_types)}
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after  # столько записей с прошлого сжатия части запускают новое
+        self.stats_factory = stats_factory  # новая доля статистики: on_add(user_id, shard, всего открыто),
+        #                                     on_reset(user_id, shard, rarity, pulls), merge(other), dump(), load(data)
+        self.share = share
+        self._stride = 1 + 2 * len(RARITIES)
+        self._columns = aggregate_columns(self.shard_types)
+        self._column_index = {column: i for i, column in enumerate(self._columns)}
+        # Сбрасывается потоком журнала, своего потока у хранилища агрегатов нет
+        self.aggregates = storage.ShardStore(
+            backend or storage.MemoryBackend(), self._columns, flush_interval=flush_interval, capacity=capacity
+        )
+        self._parts = {}  # {шард: _Part} — части, которые ведёт этот процесс
+        self._foreign = {}  # {шард: (сохранённая строка, итоги, статистика)} — чужие части при share
+        self._version = 0  # растёт с каждым событием — для кэша global_snapshot()
+        self._snapshot = None
+        self._snapshot_version = -1
+        self._snapshot_at = 0.0
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def records(self):
+        """Записей в частях этого процесса, включая ещё не дописанные"""
+        return sum(part.records for part in list(self._parts.values()))
+
+    def shard_path(self, shard):
+        """Файл части шарда"""
+        if self.shards == 1:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{shard}{ext}"
+
+    def _shard_of(self, user_id):
+        return shard_of(user_id, self.shards) if self.shards > 1 else 0
+
+    @staticmethod
+    def _partial_key(shard):
+        return f"partial:{shard}"
+
+    # --- Агрегаты ---
+
+    def _apply(self, part, user_id, kind, shard, rarity, amount):
+        base = shard * self._stride
+        if kind == ADD:
+            opened = self.aggregates.add(user_id, self._columns[base], amount)
+            part.totals[base] += amount
+            if part.stats is not None:
+                part.stats.on_add(user_id, shard, opened)
+        else:
+            column = base + 1 + 2 * rarity
+            self.aggregates.add(user_id, self._columns[column], 1)
+            self.aggregates.add(user_id, self._columns[column + 1], amount)
+            part.totals[column] += 1
+            part.totals[column + 1] += amount
+            if part.stats is not None:
+                part.stats.on_reset(user_id, shard, rarity, amount)
+        part.records += 1
+        part.version += 1
+        self._version += 1
+
+    def _summary(self, row):
+        summary = {}
+        for shard, shard_type in enumerate(self.shard_types):
+            base = shard * self._stride
+            drops = {}
+            for rarity_no, rarity in enumerate(RARITIES):
+                column = base + 1 + 2 * rarity_no
+                if row[column]:
+                    drops[rarity] = (row[column], row[column + 1] / row[column])
+            summary[shard_type] = {'opened': row[base], 'drops': drops}
+        return summary
+
+    def user_summary(self, user_id):
+        """{shard_type: {'opened': n, 'drops': {rarity: (сколько раз, в среднем осколков)}}} или None"""
+        counts = self.aggregates.get_counts(user_id)
+        if not counts:
+            return None
+        row = [0] * len(self._columns)
+        for column, value in counts.items():
+            row[self._column_index[column]] = value
+        return self._summary(row)
+
+    def preload(self, user_id):
+        """Загружает агрегаты пользователя в кэш (см. ShardStore.preload)"""
+        if not self.aggregates.is_cached(user_id):
+            self.aggregates.preload(user_id)
+
+    def totals(self):
+        """То же по всем пользователям частей этого процесса"""
+        with self._lock:
+            return self._totals()
+
+    def _totals(self):
+        # Вызывать под _lock
+        row = array('q', bytes(8 * len(self._columns)))
+        for totals in self._all_totals():
+            for i, value in enumerate(totals):
+                row[i] += value
+        return self._summary(row)
+
+    def _all_totals(self):
+        for part in self._parts.values():
+            yield part.totals
+        for shard, (_, totals, _) in self._foreign.items():
+            if shard not in self._parts:
+                yield totals
+
+    def global_stats(self):
+        """Слитая статистика частей этого процесса (с share — всех) или None без stats_factory"""
+        return self.global_snapshot()[1]
+
+    def global_snapshot(self):
+        """(totals(), global_stats()), снятые в один момент
+
+        Это копия: её можно читать из любого потока. Пересобирается, только если были
+        события, и не чаще раза в flush_interval — итоги и статистика отстают одинаково,
+        поэтому выпадение не окажется в одних и не окажется в другой.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or (
+                self._snapshot_version != self._version and now - self._snapshot_at >= self.flush_interval
+            ):
+                stats = None
+                if self.stats_factory is not None:
+                    stats = self.stats_factory()
+                    for part in self._parts.values():
+                        stats.merge(part.stats)
+                    for shard, (_, _, foreign_stats) in self._foreign.items():
+                        if shard not in self._parts and foreign_stats is not None:
+                            stats.merge(foreign_stats)
+                self._snapshot = (self._totals(), stats)
+                self._snapshot_version, self._snapshot_at = self._version, now
+            return self._snapshot
+
+    # --- Части ---
+
+    def _read_blocks(self, path):
+        """Файл журнала блоками целых записей (вызывать под _file_lock)"""
+        try:
+            log = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with log:
+            size = os.fstat(log.fileno()).st_size
+            # Хвост от незавершённой записи при падении отбрасываем
+            if size % RECORD.size:
+                logger.warning(f"⚠️ Журнал {path}: отброшен неполный хвост {size % RECORD.size} байт")
+            yield from _blocks(log, size)
+
+    def _rebuild(self, parts):
+        """Итоги и статистика частей parts {шард: _Part}: из агрегатов в бэкенде и сбросов в файлах"""
+        for rows in self.aggregates.iter_counts():
+            for user_id, counts in rows:
+                part = parts.get(self._shard_of(user_id))
+                if part is None:
+                    continue
+                for column, value in counts.items():
+                    part.totals[self._column_index[column]] += value
+                if part.stats is None:
+                    continue
+                for shard in range(len(self.shard_types)):
+                    opened = counts.get(self._columns[shard * self._stride])
+                    if opened:
+                        part.stats.on_add(user_id, shard, opened)
+        for part in parts.values():
+            for data in self._read_blocks(part.path):
+                part.records += len(data) // RECORD.size
+                if part.stats is None:
+                    continue
+                for _, user_id, kind, shard, rarity, amount in RECORD.iter_unpack(data):
+                    if kind == RESET:
+                        part.stats.on_reset(user_id, shard, rarity, amount)
+            part.compacted_records = part.records
+
+    def _partial(self, part):
+        """Итоги и статистика части для хранилища (вызывать под _lock с пустым буфером части)"""
+        return {
+            'columns': self._columns,
+            'records': part.records,
+            'compacted_records': part.compacted_records,
+            'totals': part.totals.tolist(),
+            'stats': part.stats.dump() if part.stats is not None else None,
+        }
+
+    def _parse_partial(self, raw):
+        """(итоги, статистика, данные) из сохранённой строки; ValueError, если она от других столбцов"""
+        try:
+            partial = json.loads(raw)
+            if partial['columns'] != list(self._columns) or len(partial['totals']) != len(self._columns):
+                raise ValueError("другие типы осколков")
+            stats = None
+            if self.stats_factory is not None:
+                if partial['stats'] is None:
+                    raise ValueError("нет статистики")
+                stats = self.stats_factory()
+                stats.load(partial['stats'])
+            return array('q', partial['totals']), stats, partial
+        except (KeyError, TypeError, OverflowError) as e:
+            raise ValueError(repr(e)) from None
+
+    def _restore(self, shard, part):
+        """Берёт итоги и статистику части из хранилища; False, если их нужно пересчитать"""
+        raw = self.aggregates.backend.load_meta(self._partial_key(shard))
+        if raw is None:
+            return False
+        try:
+            totals, stats, partial = self._parse_partial(raw)
+        except ValueError as e:
+            logger.warning(f"⚠️ Журнал {part.path}: сохранённые итоги не читаются ({e}), пересчитываем")
+            return False
+        try:
+            records = os.path.getsize(part.path) // RECORD.size
+        except FileNotFoundError:
+            records = 0
+        if records != partial['records']:
+            # Файл дописан или сжат после сохранения итогов — процесс упал между записями
+            logger.warning(f"⚠️ Журнал {part.path}: итоги на {partial['records']} записей, в файле {records}")
+            return False
+        part.totals, part.stats = totals, stats
+        part.records = records
+        part.compacted_records = partial['compacted_records']
+        return True
+
+    def acquire(self, shards):
+        """Забирает части шардов shards: их итоги и статистику из хранилища или пересчётом
+
+        Пересчёт читает агрегаты в бэкенде одним проходом на вызов — шарды лучше передавать пачкой.
+        """
+        with self._file_lock:
+            with self._lock:
+                parts = {
+                    shard: _Part(
+                        self.shard_path(shard), len(self._columns),
+                        self.stats_factory() if self.stats_factory is not None else None
+                    )
+                    for shard in shards if shard not in self._parts
+                }
+            if not parts:
+                return
+            stale = {shard: part for shard, part in parts.items() if not self._restore(shard, part)}
+            if stale:
+                self._rebuild(stale)
+                for part in stale.values():
+                    # Пересчитанное сохраняется со следующим сбросом
+                    part.version += 1
+            with self._lock:
+                self._parts.update(parts)
+                self._snapshot = None
+
+    def release(self, shard):
+        """Отдаёт часть шарда: дописывает её буфер, сохраняет итоги и сбрасывает агрегаты её пользователей"""
+        key = self._partial_key(shard)
+        with self._file_lock:
+            with self._lock:
+                part = self._parts.pop(shard, None)
+                self._snapshot = None
+                if part is None:
+                    return
+                buffer, part.buffer = part.buffer, bytearray()
+                partial = self._partial(part) if part.version != part.saved_version else None
+            if buffer:
+                with open(part.path, 'ab') as log:
+                    log.write(buffer)
+            if partial is not None:
+                self.aggregates.set_meta(key, json.dumps(partial))
+        # Итоги уходят в хранилище одной пачкой с агрегатами, из кэша убираются вместе с ними
+        self.aggregates.forget(lambda user_id: self._shard_of(user_id) == shard, meta_keys=(key,))
+
+    def _load_foreign(self):
+        """Перечитывает из хранилища итоги и статистику частей, которые ведут другие процессы"""
+        changed = False
+        for shard in range(self.shards):
+            if shard in self._parts:
+                continue
+            raw = self.aggregates.backend.load_meta(self._partial_key(shard))
+            cached = self._foreign.get(shard)
+            if raw is None or (cached is not None and cached[0] == raw):
+                continue
+            try:
+                totals, stats, _ = self._parse_partial(raw)
+            except ValueError as e:
+                logger.warning(f"⚠️ Итоги шарда {shard} не читаются: {e}")
+                continue
+            with self._lock:
+                self._foreign[shard] = (raw, totals, stats)
+            changed = True
+        with self._lock:
+            for shard in [shard for shard in self._foreign if shard in self._parts]:
+                del self._foreign[shard]
+            if changed:
+                self._version += 1
+
+    def _part(self, user_id):
+        shard = self._shard_of(user_id)
+        part = self._parts.get(shard)
+        if part is None:
+            # Без start() (загрузка из командной строки) части забираются по мере надобности
+            self.acquire((shard,))
+            part = self._parts[shard]
+        return part
+
+    # --- Запись ---
+
+    def _append(self, user_id, kind, shard_type, rarity, amount):
+        shard = self.ordinals[shard_type]
+        part = self._part(user_id)
+        with self._lock:
+            part.buffer += RECORD.pack(int(time.time()), user_id, kind, shard, rarity, amount)
+            self._apply(part, user_id, kind, shard, rarity, amount)
+
+    def record_add(self, user_id, shard_type, count):
+        self._append(user_id, ADD, shard_type, 0, count)
+
+    def record_reset(self, user_id, shard_type, rarity, pulls):
+        """Герой редкости rarity выпал после pulls осколков"""
+        self._append(user_id, RESET, shard_type, RARITIES.index(rarity), pulls)
+
+    def flush(self):
+        """Дописывает буферы в файлы и сбрасывает агрегаты в бэкенд; возвращает число записанных событий"""
+        written = 0
+        with self._file_lock:
+            with self._lock:
+                chunks = []
+                partials = {}
+                for shard, part in self._parts.items():
+                    if part.buffer:
+                        chunks.append((part.path, part.buffer))
+                        part.buffer = bytearray()
+                    if part.version != part.saved_version:
+                        partials[shard] = self._partial(part)
+                        part.saved_version = part.version
+            for path, chunk in chunks:
+                with open(path, 'ab') as log:
+                    log.write(chunk)
+                written += len(chunk) // RECORD.size
+            # Итоги — после файлов: сохранённые итоги не опережают файл
+            for shard, partial in partials.items():
+                self.aggregates.set_meta(self._partial_key(shard), json.dumps(partial))
+        self.aggregates.flush()
+        return written
+
+    # --- Сжатие ---
+
+    @staticmethod
+    def _compact_block(data):
+        """Записи блока со слитыми добавлениями; порядок добавлений и сбросов одного осколка сохраняется"""
+        compacted = []
+        pending = {}  # {(user_id, shard): [time, amount]} — слитые добавления с последнего сброса
+        for timestamp, user_id, kind, shard, rarity, amount in RECORD.iter_unpack(data):
+            key = (user_id, shard)
+            if kind == ADD:
+                merged = pending.setdefault(key, [timestamp, 0])
+                merged[0] = timestamp
+                merged[1] += amount
+                continue
+            merged = pending.pop(key, None)
+            if merged is not None and merged[1]:
+                compacted.append(RECORD.pack(merged[0], user_id, ADD, shard, 0, merged[1]))
+            compacted.append(RECORD.pack(timestamp, user_id, kind, shard, rarity, amount))
+        for (user_id, shard), (timestamp, amount) in pending.items():
+            if amount:
+                compacted.append(RECORD.pack(timestamp, user_id, ADD, shard, 0, amount))
+        return compacted
+
+    def _compact(self, part):
+        before = after = 0
+        with self._file_lock:
+            if not os.path.exists(part.path):
+                return 0, 0
+            temp_path = f"{part.path}.compact"
+            with open(temp_path, 'wb') as log:
+                for data in self._read_blocks(part.path):
+                    compacted = self._compact_block(data)
+                    log.write(b''.join(compacted))
+                    before += len(data) // RECORD.size
+                    after += len(compacted)
+            os.replace(temp_path, part.path)
+            with self._lock:
+                part.records = after + len(part.buffer) // RECORD.size
+                part.compacted_records = after
+                part.version += 1
+        logger.info(f"🗜 Журнал {part.path} сжат: {before} → {after} записей")
+        return before, after
+
+    def compact(self):
+        """Сливает добавления одного осколка между сбросами во всех частях; возвращает (было, стало) записей
+
+        Память ограничена одним блоком: добавления сливаются в пределах блока,
+        повторные сжатия сливают то, что разошлось по блокам.
+        """
+        self.flush()
+        before = after = 0
+        for part in list(self._parts.values()):
+            part_before, part_after = self._compact(part)
+            before += part_before
+            after += part_after
+        # Сохранённые итоги должны знать новый размер файлов
+        self.flush()
+        return before, after
+
+    # --- Выгрузка и загрузка ---
+
+    def iter_records(self, chunk_size=65536):
+        """Записи журнала всех шардов на момент вызова пачками байт по chunk_size записей
+
+        Файл только дописывается, а сжатие подменяет его целиком (os.replace), поэтому
+        открытый дескриптор до конца чтения видит ту же версию и запись журнала не ждёт.
+        Читаются и файлы шардов, которые ведут другие процессы, если они лежат здесь же.
+        """
+        self.flush()
+        for shard in range(self.shards):
+            with self._file_lock:
+                try:
+                    log = open(self.shard_path(shard), 'rb')
+                except FileNotFoundError:
+                    continue
+                size = os.fstat(log.fileno()).st_size
+            with log:
+                yield from _blocks(log, size, chunk_size)
+
+    def is_empty(self):
+        """True, если в журнале нет ни одной записи — ни в буферах, ни в файлах всех шардов"""
+        with self._lock:
+            if any(part.records for part in self._parts.values()):
+                return False
+        for shard in range(self.shards):
+            try:
+                if os.path.getsize(self.shard_path(shard)):
+                    return False
+            except FileNotFoundError:
+                pass
+        return True
+
+    def import_records(self, data):
+        """Дописывает записи RECORD (байты подряд) и учитывает их в агрегатах; возвращает их число"""
+        if len(data) % RECORD.size:
+            raise ValueError(f"Длина {len(data)} не кратна размеру записи {RECORD.size}")
+        by_shard = {}
+        for record in RECORD.iter_unpack(data):
+            _, user_id, kind, shard, rarity, _ = record
+            if kind not in (ADD, RESET) or shard >= len(self.shard_types) or rarity >= len(RARITIES):
+                raise ValueError(f"Неверная запись журнала пользователя {user_id}")
+            by_shard.setdefault(self._shard_of(user_id), []).append(record)
+        self.acquire(by_shard)
+        with self._lock:
+            for shard, records in by_shard.items():
+                part = self._parts[shard]
+                for record in records:
+                    part.buffer += RECORD.pack(*record)
+                    self._apply(part, *record[1:])
+        return len(data) // RECORD.size
+
+    # --- Фоновая запись ---
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                for part in list(self._parts.values()):
+                    if part.records - part.compacted_records >= self.compact_after:
+                        self._compact(part)
+                if self.share:
+                    self._load_foreign()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи журнала: {e}")
+
+    def start(self, shards=None):
+        """Забирает части шардов shards (по умолчанию все) и запускает фоновую запись
+
+        В режиме шардов процесс начинает с пустого набора и забирает шарды через acquire().
+        """
+        if self._thread is None:
+            self.acquire(range(self.shards) if shards is None else shards)
+            if self.share:
+                self._load_foreign()
+            if self.records:
+                logger.info(f"📜 Журнал {self.path}: {self.records} событий")
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name='history-flush', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Останавливает фоновую запись и дописывает остаток"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.aggregates.close()
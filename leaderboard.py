@@ -0,0 +1,195 @@
+"""Общая статистика по всем пользователям: таблица лидеров и распределение «осколков до героя»
+
+Структуры обновляются на каждом событии журнала (history.HistoryLog ведёт свою
+GlobalStats на каждую часть журнала — при записи и когда забирает часть), поэтому /top и /global
+никогда не перебирают всех пользователей:
+- TopK — первые k по числу открытых осколков. Счёт пользователя только растёт,
+  значит вне первых k он может попасть туда, лишь обогнав минимум, — хватает
+  кучи по минимуму с ленивым удалением устаревших записей;
+- QuantileSketch — потоковая оценка перцентилей с относительной точностью
+  (логарифмические корзины, как в DDSketch); малые целые попадают каждое в свою
+  корзину и считаются точно.
+
+Структуры сливаются (merge): статистика, посчитанная по частям пользователей
+(например, по шардам), после слияния та же, что и посчитанная сразу по всем.
+dump() и load() переводят их в данные для JSON и обратно — так части статистики
+передаются между процессами через хранилище.
+"""
+import heapq
+import math
+
+
+class TopK:
+    """Первые k ключей по неубывающему счёту; обновление — O(log k) амортизированно"""
+
+    def __init__(self, k=100):
+        self.k = k
+        self._scores = {}  # {key: счёт} — ровно текущие первые k
+        self._heap = []    # (счёт, key), в том числе устаревшие записи
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _prune(self):
+        heap, scores = self._heap, self._scores
+        while heap and scores.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def update(self, key, score):
+        """Новый счёт ключа; он не может быть меньше прежнего"""
+        scores, heap = self._scores, self._heap
+        if key not in scores:
+            if len(scores) >= self.k:
+                self._prune()
+                if score <= heap[0][0]:
+                    return
+                _, evicted = heapq.heappop(heap)
+                del scores[evicted]
+        scores[key] = score
+        heapq.heappush(heap, (score, key))
+        if len(heap) > 4 * self.k:
+            # Слишком много устаревших записей — пересобираем кучу из актуальных
+            self._heap = [(value, member) for member, value in scores.items()]
+            heapq.heapify(self._heap)
+
+    def merge(self, other):
+        """Добавляет первые k другой таблицы; для непересекающихся ключей результат точный"""
+        for key, score in other._scores.items():
+            if score > self._scores.get(key, -1):
+                self.update(key, score)
+
+    def dump(self):
+        return [[key, score] for key, score in self._scores.items()]
+
+    def load(self, data):
+        """Обратное к dump(): заменяет содержимое таблицы"""
+        self._scores = {}
+        self._heap = []
+        for key, score in data:
+            self.update(key, score)
+
+    def top(self, n=10):
+        """[(key, счёт)] по убыванию счёта, равные — по ключу (порядок не зависит от слияний)"""
+        return sorted(self._scores.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+class QuantileSketch:
+    """Перцентили неотрицательных значений с относительной погрешностью relative_accuracy"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._bins = {}  # {индекс корзины: сколько значений}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self._bins[index] = self._bins.get(index, 0) + 1
+
+    def merge(self, other):
+        """Добавляет значения другого скетча с той же точностью"""
+        for index, count in other._bins.items():
+            self._bins[index] = self._bins.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+
+    def dump(self):
+        return {'bins': [[index, count] for index, count in self._bins.items()],
+                'zeros': self.zeros, 'count': self.count, 'total': self.total}
+
+    def load(self, data):
+        """Обратное к dump() скетча с той же точностью: заменяет содержимое"""
+        self._bins = {index: count for index, count in data['bins']}
+        self.zeros = data['zeros']
+        self.count = data['count']
+        self.total = data['total']
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantiles(self, qs):
+        """{q: значение} для перцентилей q (0..100) за один проход по корзинам"""
+        if not self.count:
+            return {q: None for q in qs}
+        result = {}
+        pending = sorted(qs)
+        seen = self.zeros
+        ranks = [(q, q / 100 * (self.count - 1)) for q in pending]
+        position = 0
+        while position < len(ranks) and ranks[position][1] < seen:
+            result[ranks[position][0]] = 0
+            position += 1
+        for index in sorted(self._bins):
+            if position == len(ranks):
+                break
+            seen += self._bins[index]
+            value = 2 * self.gamma ** index / (self.gamma + 1)
+            while position < len(ranks) and ranks[position][1] < seen:
+                result[ranks[position][0]] = value
+                position += 1
+        return result
+
+
+class GlobalStats:
+    """Наблюдатель журнала: таблицы лидеров по типам осколков и скетчи «осколков до героя»"""
+
+    def __init__(self, shard_types, rarities, top_k=100, relative_accuracy=0.01):
+        self.shard_types = tuple(shard_types)
+        self.ordinals = {shard_type: i for i, shard_type in enumerate(self.shard_types)}
+        self.rarities = tuple(rarities)
+        self._top = [TopK(top_k) for _ in self.shard_types]
+        self._pulls = [
+            [QuantileSketch(relative_accuracy) for _ in self.rarities] for _ in self.shard_types
+        ]
+
+    # --- Вызывается журналом ---
+
+    def on_add(self, user_id, shard, opened):
+        """opened — сколько всего осколков этого типа открыл пользователь"""
+        self._top[shard].update(user_id, opened)
+
+    def on_reset(self, user_id, shard, rarity, pulls):
+        self._pulls[shard][rarity].add(pulls)
+
+    def merge(self, other):
+        """Добавляет статистику другой части пользователей"""
+        for top, other_top in zip(self._top, other._top):
+            top.merge(other_top)
+        for sketches, other_sketches in zip(self._pulls, other._pulls):
+            for sketch, other_sketch in zip(sketches, other_sketches):
+                sketch.merge(other_sketch)
+
+    def dump(self):
+        return {
+            'top': [top.dump() for top in self._top],
+            'pulls': [[sketch.dump() for sketch in sketches] for sketches in self._pulls],
+        }
+
+    def load(self, data):
+        """Обратное к dump() для тех же типов осколков, редкостей и точности"""
+        if len(data['top']) != len(self._top) or any(len(row) != len(self.rarities) for row in data['pulls']):
+            raise ValueError("Статистика для других типов осколков или редкостей")
+        for top, top_data in zip(self._top, data['top']):
+            top.load(top_data)
+        for sketches, sketches_data in zip(self._pulls, data['pulls']):
+            for sketch, sketch_data in zip(sketches, sketches_data):
+                sketch.load(sketch_data)
+
+    # --- Запросы ---
+
+    def top_users(self, shard_type, n=10):
+        """[(user_id, открыто)] по убыванию"""
+        return self._top[self.ordinals[shard_type]].top(n)
+
+    def pulls_summary(self, shard_type, rarity, qs=(50, 90, 99)):
+        """(сколько выпадений, среднее число осколков, {перцентиль: осколков})"""
+        sketch = self._pulls[self.ordinals[shard_type]][self.rarities.index(rarity)]
+        return sketch.count, sketch.mean(), sketch.quantiles(qs)
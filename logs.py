@@ -0,0 +1,146 @@
+"""Логирование вне горячего пути
+
+Обработчик на корневом логгере только кладёт запись в очередь; форматирование
+и вывод делает фоновый поток (logging.handlers.QueueListener). Запись уходит
+в очередь как есть: аргументы сообщения («%s») подставляются уже в фоновом потоке,
+поэтому в обработчиках обновлений логируют в ленивом виде logger.info("...%s", x).
+
+- JSON: одна строка на запись, с update_id обновления, в рамках которого она сделана;
+- выборка: из обновлений пишутся логи только доли sample_rate (решение по update_id,
+  так что обновление логируется целиком или никак), предупреждения и ошибки — всегда;
+- очередь ограничена: если фоновый поток не успевает, записи ниже WARNING отбрасываются.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+_MASK64 = (1 << 64) - 1
+_FIBONACCI = 0x9E3779B97F4A7C15
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# update_id обновления, которое сейчас обрабатывается (наследуется задачами asyncio)
+_update_id = contextvars.ContextVar('update_id', default=None)
+
+
+def bind_update(update_id):
+    """Привязывает логи текущего контекста к обновлению"""
+    _update_id.set(update_id)
+
+
+class UpdateSampler(logging.Filter):
+    """Добавляет update_id к записи и оставляет логи только доли обновлений"""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._threshold = int(sample_rate * (1 << 32))
+
+    def filter(self, record):
+        update_id = _update_id.get()
+        record.update_id = update_id
+        if update_id is None or record.levelno >= logging.WARNING or self.sample_rate >= 1.0:
+            return True
+        # Перемешиваем id, чтобы выборка не зависела от того, как Telegram их нумерует
+        return (((update_id * _FIBONACCI) & _MASK64) >> 32) < self._threshold
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке; при переполнении очереди отбрасывает записи"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь в том же процессе — запись не нужно сериализовать, форматирует слушатель
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        update_id = getattr(record, 'update_id', None)
+        if update_id is not None:
+            entry['update_id'] = update_id
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogPipeline:
+    """Очередь + фоновый поток вывода, установленные на корневой логгер"""
+
+    def __init__(self, handler, listener):
+        self.handler = handler
+        self.listener = listener
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def stop(self):
+        """Дописывает всё из очереди и останавливает фоновый поток"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+def setup(level=logging.INFO, json_format=False, sample_rate=1.0, max_queue=10000, stream=None):
+    """Заменяет обработчики корневого логгера очередью; возвращает LogPipeline"""
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(max_queue)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(UpdateSampler(sample_rate))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    pipeline = LogPipeline(handler, listener)
+    atexit.register(pipeline.stop)
+    return pipeline
+
+
+def recorder(path, max_queue=10000):
+    """Логгер 'updates', дописывающий сообщения как есть, по строке, в файл path; возвращает (логгер, LogPipeline)
+
+    Нужен для записи входящих обновлений, которые потом проигрывает benchmarks/e2e.py.
+    Выборка и корневые обработчики его не касаются; если диск не успевает, строки отбрасываются.
+    """
+    output = logging.FileHandler(path, encoding='utf-8')
+    output.setFormatter(logging.Formatter('%(message)s'))
+    log_queue = queue.Queue(max_queue)
+    handler = LazyQueueHandler(log_queue)
+    record_logger = logging.getLogger('updates')
+    record_logger.propagate = False
+    record_logger.setLevel(logging.INFO)
+    record_logger.addHandler(handler)
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    pipeline = LogPipeline(handler, listener)
+    atexit.register(pipeline.stop)
+    return record_logger, pipeline
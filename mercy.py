@@ -0,0 +1,88 @@
+"""Калькулятор системы компенсации неудач (mercy)
+
+Шанс редкости на k-м открытии после последнего выпадения:
+p(k) = base, пока k не больше порога, затем base + step * (k - threshold), но не больше 1.
+Поэтому число открытий до выпадения ограничено, и его распределение считается точно:
+S(k) — вероятность не получить героя за первые k открытий, и при текущем счётчике c
+
+    P(J > j) = S(c + j) / S(c),  E[J] = (S(c) + S(c + 1) + ...) / S(c).
+
+Таблицы S, накопленная F = 1 - S и суффиксные суммы S строятся один раз на правило
+(их длина — порог плюс несколько десятков), после этого среднее — O(1), перцентиль —
+двоичный поиск по F. Редкости считаются независимо друг от друга.
+"""
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from typing import NamedTuple
+
+PERCENTILES = (50, 90, 99)
+
+
+class MercyRule(NamedTuple):
+    base: float       # базовый шанс за одно открытие
+    threshold: int    # после стольких открытий без выпадения шанс начинает расти
+    step: float       # прибавка за каждое открытие сверх порога
+
+
+class MercyTable:
+    """Точное распределение числа открытий до выпадения по одному правилу"""
+
+    def __init__(self, rule):
+        self.rule = rule
+        survival = array('d', [1.0])
+        k = 0
+        while survival[-1] > 0.0:
+            k += 1
+            chance = min(1.0, rule.base + rule.step * max(0, k - rule.threshold))
+            survival.append(0.0 if chance >= 1.0 else survival[-1] * (1.0 - chance))
+        self.hard_pity = k  # на этом открытии выпадение гарантировано
+        self.survival = survival
+        self.cdf = array('d', (1.0 - value for value in survival))
+        tail = array('d', bytes(8 * len(survival)))
+        running = 0.0
+        for i in range(len(survival) - 1, -1, -1):
+            running += survival[i]
+            tail[i] = running
+        self.tail = tail
+
+    def _start(self, count):
+        # Счётчик за пределами гарантии: следующее открытие точно даст героя
+        return max(0, min(count, self.hard_pity - 1))
+
+    def chance(self, count):
+        """Шанс на следующем открытии при текущем счётчике"""
+        c = self._start(count)
+        return 1.0 - self.survival[c + 1] / self.survival[c]
+
+    def expected(self, count):
+        """Среднее число открытий до выпадения"""
+        c = self._start(count)
+        return self.tail[c] / self.survival[c]
+
+    def percentile(self, count, q):
+        """Наименьшее j, при котором герой выпадет за j открытий с вероятностью не меньше q%"""
+        c = self._start(count)
+        target = 1.0 - (1.0 - q / 100) * self.survival[c]
+        return bisect_left(self.cdf, target, c + 1) - c
+
+    def probability_within(self, count, pulls):
+        """Вероятность получить героя за pulls открытий"""
+        c = self._start(count)
+        return 1.0 - self.survival[min(c + pulls, self.hard_pity)] / self.survival[c]
+
+
+@lru_cache(maxsize=None)
+def table_for(rule):
+    return MercyTable(rule)
+
+
+@lru_cache(maxsize=4096)
+def forecast(rule, count):
+    """(шанс следующего, среднее, {перцентиль: открытий}) — кэшируется по (правило, счётчик)"""
+    table = table_for(rule)
+    return (
+        table.chance(count),
+        table.expected(count),
+        {q: table.percentile(count, q) for q in PERCENTILES},
+    )
@@ -0,0 +1,216 @@
+"""Метрики в текстовом формате Prometheus без сторонних зависимостей
+
+Счётчики и гистограммы с метками: дочерняя серия по набору меток создаётся
+при первом обращении и дальше находится одним поиском в словаре, наблюдение
+в гистограмме — двоичный поиск корзины и два сложения. Значения, которые дешевле
+прочитать, чем отслеживать (размеры очередей и кэшей), собираются функцией
+в момент запроса /metrics.
+
+Серии обновляются без блокировок: в боте это делает только поток event loop,
+а сбор из потока HTTP-сервера читает готовые значения.
+
+Другой процесс передаёт свои метрики как Registry.collect() — список кортежей,
+который переживает pickle; render(workers=...) выводит их вместе со своими
+сериями, добавляя метку worker.
+"""
+import asyncio
+import threading
+from bisect import bisect_left
+
+# Задержки от 0.5 мс до 10 с
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample_lines(name, samples, labelnames=(), labelvalues=()):
+    for suffix, names, values, value in samples:
+        labels = _format_labels(labelnames + tuple(names), labelvalues + tuple(values))
+        yield f"{name}{suffix}{labels} {_format_value(value)}"
+
+
+class _Metric:
+    kind = 'untyped'
+    suffix = ''  # добавляется к имени в HELP/TYPE и сериях
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Серия с данными значениями меток (создаётся при первом обращении)"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def collect(self):
+        """(имя, тип, описание, [(суффикс, имена меток, значения меток, значение)])"""
+        return self.name + self.suffix, self.kind, self.documentation, list(self._samples())
+
+    def render(self):
+        name = self.name + self.suffix
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.kind}"]
+        lines.extend(_sample_lines(name, self._samples()))
+        return '\n'.join(lines)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    # В формате 0.0.4 имя в HELP/TYPE должно совпадать с именем серии — как в prometheus_client
+    kind = 'counter'
+    suffix = '_total'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '', self.labelnames, values, child.value
+
+
+class Gauge(_Metric):
+    """Значение, вычисляемое при сборе: function() -> число или {кортеж меток: число}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            for values, item in value.items():
+                yield '', self.labelnames, values, item
+        else:
+            yield '', self.labelnames, (), value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя — +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        names = self.labelnames + ('le',)
+        for values, child in list(self._children.items()):
+            counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', names, values + (_format_value(bound),), cumulative
+            yield '_sum', self.labelnames, values, total
+            yield '_count', self.labelnames, values, cumulative
+
+
+class Registry:
+    """Набор метрик одного процесса"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        return self.register(Gauge(name, documentation, function, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self):
+        """Снимок всех метрик для передачи в другой процесс"""
+        return [metric.collect() for metric in self._metrics]
+
+    def render(self, workers=None):
+        """Все метрики в текстовом формате экспозиции Prometheus 0.0.4
+
+        workers — {номер процесса: его collect()}: серии процесса выводятся в тех же
+        семействах с меткой worker, семейства, которых здесь нет, — после своих.
+        """
+        if not workers:
+            return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+        families = {}  # {имя: [заголовок, строки]} — в порядке первого появления
+        for name, kind, documentation, samples in [metric.collect() for metric in self._metrics]:
+            families[name] = [(documentation, kind), list(_sample_lines(name, samples))]
+        for worker, collected in sorted(workers.items()):
+            for name, kind, documentation, samples in collected:
+                family = families.setdefault(name, [(documentation, kind), []])
+                family[1].extend(_sample_lines(name, samples, ('worker',), (str(worker),)))
+        lines = []
+        for name, ((documentation, kind), samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+async def watch_loop_lag(histogram, interval=0.5):
+    """Меряет, на сколько позже запланированного просыпается event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, loop.time() - expected))
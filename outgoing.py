@@ -0,0 +1,230 @@
+"""Исходящие вызовы Bot API
+
+Обработчики не ждут ответа Telegram: вызовы ставятся в Outbox и выполняются
+конкурентно, но сообщения в один чат уходят строго в порядке постановки.
+answerCallbackQuery не привязан к чату и отправляется сразу, а если обновление
+пришло через вебхук — возвращается прямо в теле HTTP-ответа (без отдельного запроса).
+
+Лимиты Telegram соблюдаются заранее (общий и на чат), а на 429 вызов повторяется
+через retry_after с экспоненциальной добавкой.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+
+from telebot.asyncio_helper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Ответ на текущее обновление вебхука, если в него ещё можно вписать вызов
+_webhook_reply = contextvars.ContextVar('webhook_reply', default=None)
+
+
+class WebhookReply:
+    """Место для одного вызова Bot API в теле ответа на вебхук
+
+    offer() вызывается из event loop, take() — из потока HTTP-сервера.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._payload = None
+        self._closed = False
+
+    def offer(self, payload):
+        """Занимает место; False, если оно уже занято или ответ уже отправлен"""
+        with self._lock:
+            if self._closed or self._payload is not None:
+                return False
+            self._payload = payload
+        self._ready.set()
+        return True
+
+    def finish(self):
+        """Обработка закончилась — ждать больше нечего"""
+        self._ready.set()
+
+    def take(self, timeout):
+        """Ждёт не дольше timeout и закрывает место; возвращает payload или None"""
+        self._ready.wait(timeout)
+        with self._lock:
+            self._closed = True
+            return self._payload
+
+
+def bind_webhook_reply(reply):
+    """Привязывает WebhookReply к текущему контексту обработки обновления"""
+    _webhook_reply.set(reply)
+
+
+class RateLimiter:
+    """Ограничитель частоты по GCRA: на каждый ключ хранится одно время
+
+    reserve() сразу занимает слот и возвращает, сколько секунд подождать перед вызовом.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self._tat = {}  # {key: теоретическое время следующего вызова}
+        self._reservations = 0
+
+    def reserve(self, key=None, now=None):
+        now = time.monotonic() if now is None else now
+        tat = max(self._tat.get(key, now), now)
+        self._tat[key] = tat + self.interval
+        self._reservations += 1
+        if self._reservations % 1000 == 0:
+            self.prune(now)
+        return max(0.0, tat - self.tolerance - now)
+
+    def prune(self, now=None):
+        """Забывает ключи, которые уже полностью восстановились"""
+        now = time.monotonic() if now is None else now
+        for key in [key for key, tat in self._tat.items() if tat <= now]:
+            del self._tat[key]
+
+
+def retry_after(error):
+    """Сколько секунд просит подождать Telegram; None, если это не 429"""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 429:
+        return None
+    parameters = error.result_json.get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+class Outbox:
+    """Планировщик исходящих вызовов: конкурентно между чатами, по порядку внутри чата"""
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, global_burst=1, chat_burst=3, max_retries=5,
+                 max_pending=10000):
+        self.bot = bot
+        # Общий лимит без запаса: в любом окне в 1 секунду не больше ~global_rate вызовов
+        self.global_limiter = RateLimiter(global_rate, burst=global_burst)
+        self.chat_limiter = RateLimiter(chat_rate, burst=chat_burst)
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._tails = {}  # {chat_id: последняя задача в очереди чата}
+        self._tasks = set()
+        self.retries = 0
+        self.drops = 0
+        self.observer = None  # observer(description, секунд, исключение или None) — на каждую попытку
+
+    def _track(self, task, description):
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finished(done, description))
+        return task
+
+    def _finished(self, task, description):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("❌ Ошибка вызова Bot API (%s): %s", description, task.exception())
+
+    async def _call(self, chat_id, factory, description):
+        """Вызов с соблюдением лимитов и повтором на 429"""
+        attempt = 0
+        while True:
+            # Ответы на callback не являются сообщениями в чат и под лимиты не попадают
+            if chat_id is not None:
+                delay = max(self.chat_limiter.reserve(chat_id), self.global_limiter.reserve())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                return await self._attempt(factory, description)
+            except ApiTelegramException as e:
+                wait = retry_after(e)
+                if wait is None:
+                    raise
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.drops += 1
+                    logger.error("❌ %s: 429 после %s повторов, вызов отброшен", description, self.max_retries)
+                    return None
+                self.retries += 1
+                # Повторяем на месте — порядок сообщений в чате сохраняется
+                await asyncio.sleep(wait * 2 ** (attempt - 1))
+
+    async def _attempt(self, factory, description):
+        if self.observer is None:
+            return await factory()
+        started = time.perf_counter()
+        error = None
+        try:
+            return await factory()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.observer(description, time.perf_counter() - started, error)
+
+    async def _after(self, previous, chat_id, factory, description):
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        return await self._call(chat_id, factory, description)
+
+    def submit(self, chat_id, factory, description='call'):
+        """Ставит вызов factory() в очередь чата; возвращает задачу или None, если очередь переполнена"""
+        if len(self._tasks) >= self.max_pending:
+            self.drops += 1
+            logger.warning("⚠️ Очередь исходящих переполнена (%s), %s отброшен", self.max_pending, description)
+            return None
+        previous = self._tails.get(chat_id)
+        task = asyncio.ensure_future(self._after(previous, chat_id, factory, description))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda done: self._release_tail(chat_id, done))
+        return self._track(task, description)
+
+    def _release_tail(self, chat_id, task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    # --- Вызовы, используемые обработчиками ---
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), 'sendMessage')
+
+    def reply_to(self, message, text, **kwargs):
+        return self.submit(message.chat.id, lambda: self.bot.reply_to(message, text, **kwargs), 'sendMessage')
+
+    def delete_message(self, chat_id, message_id):
+        async def delete():
+            try:
+                await self.bot.delete_message(chat_id, message_id)
+            except Exception as e:
+                if retry_after(e) is not None:
+                    raise
+                # Сообщение могло быть уже удалено или устареть — это не ошибка
+        return self.submit(chat_id, delete, 'deleteMessage')
+
+    def answer_callback(self, callback_query_id, text=None, show_alert=None):
+        """Отвечает на callback без ожидания: в ответе вебхука или отдельным запросом"""
+        reply = _webhook_reply.get()
+        if reply is not None:
+            payload = {'method': 'answerCallbackQuery', 'callback_query_id': callback_query_id}
+            if text is not None:
+                payload['text'] = text
+            if show_alert is not None:
+                payload['show_alert'] = show_alert
+            if reply.offer(payload):
+                return None
+        task = asyncio.ensure_future(self._call(
+            None, lambda: self.bot.answer_callback_query(callback_query_id, text, show_alert), 'answerCallbackQuery'
+        ))
+        return self._track(task, 'answerCallbackQuery')
+
+    def stats(self):
+        """Глубина очереди, число повторов после 429 и отброшенных вызовов"""
+        return {
+            'pending': len(self._tasks),
+            'chats': len(self._tails),
+            'retries': self.retries,
+            'drops': self.drops,
+        }
+
+    async def drain(self):
+        """Дожидается всех поставленных вызовов"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
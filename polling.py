@@ -0,0 +1,131 @@
+"""Long polling через getUpdates — альтернатива вебхуку
+
+Обновления забираются пачками (до limit за запрос, запрос висит до timeout секунд,
+пока обновлений нет), пачка обрабатывается конкурентно, и только после этого
+offset сдвигается за последнее обновление. Telegram считает обновление доставленным,
+когда следующий getUpdates пришёл с offset больше его update_id, поэтому при падении
+посреди пачки она придёт ещё раз и обработается целиком — в том числе уже обработанные
+её обновления (доставка «хотя бы один раз»). Бот в этом режиме не сохраняет отметку
+update_id между перезапусками, иначе отметка, поставленная при получении, отсекла бы
+повторную доставку как дубликат; dedup.UpdateDeduplicator работает только в памяти.
+"""
+import asyncio
+import logging
+
+from telebot import asyncio_helper
+
+from outgoing import retry_after
+
+logger = logging.getLogger(__name__)
+
+MAX_LIMIT = 100  # больше Telegram за один getUpdates не отдаёт
+
+
+class RawUpdate:
+    """Обновление без разбора в types.Update: update_id и исходный dict"""
+
+    __slots__ = ('update_id', 'json')
+
+    def __init__(self, json):
+        self.update_id = json['update_id']
+        self.json = json
+
+
+class RawUpdateSource:
+    """Подставляется в UpdatePoller вместо бота, когда обновления нужно только переложить дальше"""
+
+    def __init__(self, token):
+        self.token = token
+
+    async def get_updates(self, offset=None, limit=None, timeout=None, allowed_updates=None, request_timeout=None):
+        result = await asyncio_helper.get_updates(self.token, offset, limit, timeout, allowed_updates, request_timeout)
+        return [RawUpdate(item) for item in result]
+
+
+class UpdatePoller:
+    """Цикл getUpdates -> конкурентная обработка пачки -> сдвиг offset"""
+
+    def __init__(self, bot, process, limit=MAX_LIMIT, timeout=50, concurrency=MAX_LIMIT, allowed_updates=None,
+                 retry_delay=1.0, max_retry_delay=30.0):
+        self.bot = bot
+        self.process = process
+        self.limit = max(1, min(limit, MAX_LIMIT))
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.allowed_updates = allowed_updates
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.offset = None
+        self.batches = 0
+        self.updates = 0
+        self._stopped = False
+        self._fetch = None
+
+    async def _process_batch(self, updates):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(update):
+            async with semaphore:
+                await self.process(update)
+
+        # Задачи встают в очередь семафора в порядке пачки — порядок обновлений одного пользователя сохраняется
+        results = await asyncio.gather(*(run(update) for update in updates), return_exceptions=True)
+        for update, result in zip(updates, results):
+            if isinstance(result, Exception):
+                logger.error("❌ Ошибка обработки обновления %s: %s", update.update_id, result)
+
+    async def poll_once(self):
+        """Один getUpdates и обработка полученной пачки; возвращает размер пачки"""
+        self._fetch = asyncio.ensure_future(self.bot.get_updates(
+            offset=self.offset, limit=self.limit, timeout=self.timeout,
+            allowed_updates=self.allowed_updates, request_timeout=self.timeout + 10
+        ))
+        try:
+            updates = await self._fetch
+        finally:
+            self._fetch = None
+        if not updates:
+            return 0
+        await self._process_batch(updates)
+        # Offset сдвигаем только после обработки — следующий getUpdates подтвердит пачку
+        self.offset = updates[-1].update_id + 1
+        self.batches += 1
+        self.updates += len(updates)
+        return len(updates)
+
+    async def run(self):
+        """Опрашивает Telegram до stop(); ошибки сети переживает с нарастающей паузой"""
+        logger.info(f"📡 Long polling: limit={self.limit}, timeout={self.timeout} с, concurrency={self.concurrency}")
+        delay = self.retry_delay
+        while not self._stopped:
+            try:
+                await self.poll_once()
+                delay = self.retry_delay
+            except asyncio.CancelledError:
+                if self._stopped:
+                    break
+                raise
+            except Exception as e:
+                wait = retry_after(e) or delay
+                logger.error(f"❌ Ошибка getUpdates: {e}. Повтор через {wait:.0f} с")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.max_retry_delay)
+        await self._confirm()
+
+    async def _confirm(self):
+        """Подтверждает последнюю обработанную пачку, чтобы после перезапуска она не пришла снова"""
+        if self.offset is None:
+            return
+        try:
+            await self.bot.get_updates(offset=self.offset, limit=1, timeout=0, request_timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подтвердить offset {self.offset}: {e}")
+
+    def stop(self):
+        """Останавливает опрос (вызывать из event loop); текущая пачка дообрабатывается"""
+        self._stopped = True
+        if self._fetch is not None:
+            self._fetch.cancel()
+
+    def stats(self):
+        return {'offset': self.offset, 'batches': self.batches, 'updates': self.updates}
@@ -0,0 +1,367 @@
+"""Горизонтальное масштабирование: обновления делятся на шарды по from_user.id
+
+Пользователь всегда попадает в один и тот же шард, а шард в каждый момент
+обрабатывает ровно один рабочий процесс. Поэтому кэш ShardStore этого процесса
+(счётчики и ожидаемый ввод) не расходится с общим хранилищем, а обновления
+одного пользователя по-прежнему идут по порядку.
+
+Приём обновлений (вебхук или polling) только определяет шард и кладёт обновление
+в его очередь:
+- LocalQueues — очереди multiprocessing внутри одного инстанса, по одной на процесс;
+  процесс i ведёт шарды, у которых номер по модулю числа процессов равен i;
+- RedisQueues — списки Redis updates:<shard>; рабочие процессы всех инстансов
+  делят шарды через аренды (lease) и перераспределяют их, когда процессов становится
+  больше или меньше.
+
+Переданное в очередь обновление уже подтверждено Telegram: если рабочий процесс
+упадёт посреди обработки, оно потеряется (доставка «не более одного раза»).
+"""
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+
+from storage import RedisConnection
+
+logger = logging.getLogger(__name__)
+
+STOP = object()  # get() очереди: процесс должен завершиться
+_MASK64 = (1 << 64) - 1
+_FIBONACCI = 0x9E3779B97F4A7C15
+
+# Аренду продлевает и снимает только её владелец: сравнение и действие — одна команда,
+# иначе между GET и PEXPIRE/DEL аренда может истечь и достаться другому процессу
+_RENEW_LEASE = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end return 0"
+_DROP_LEASE = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+
+def shard_of(user_id, shards):
+    """Номер шарда пользователя; одинаков во всех процессах и после перезапуска"""
+    return (((user_id * _FIBONACCI) & _MASK64) >> 32) % shards
+
+
+def update_shard(update, shards):
+    """Шард обновления в виде dict: по from.id, без отправителя — по update_id"""
+    for kind in ('message', 'callback_query', 'edited_message'):
+        item = update.get(kind)
+        if item is not None and item.get('from'):
+            return shard_of(item['from']['id'], shards)
+    return shard_of(update['update_id'], shards)
+
+
+# === Очереди шардов ===
+
+class LocalQueues:
+    """Очереди multiprocessing: по одной на процесс, шард shard идёт в очередь shard % workers
+
+    Число шардов от числа процессов не зависит: по шардам делятся и данные,
+    которые должны пережить смену WORKERS (например, файлы журнала).
+    """
+
+    def __init__(self, shards, workers, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.workers = workers
+        self._queues = [context.Queue() for _ in range(workers)]
+
+    def publish(self, shard, update):
+        self._queues[shard % self.workers].put((shard, update))
+
+    def close(self):
+        """Дожидается, пока всё поставленное дойдёт до рабочих процессов"""
+        for shard_queue in self._queues:
+            shard_queue.close()
+            shard_queue.join_thread()
+
+    def consumer(self, index, stopping):
+        owned = {shard for shard in range(self.shards) if shard % self.workers == index}
+        return LocalConsumer(self._queues[index], owned, stopping)
+
+
+class LocalConsumer:
+    """Очередь шардов одного процесса; после stopping дочитывается до конца"""
+
+    def __init__(self, worker_queue, owned, stopping):
+        self._queue = worker_queue
+        self.owned = owned
+        self.stopping = stopping
+        self.on_acquire = None
+        self.on_release = None
+
+    def get(self, timeout=1.0):
+        """(шард, обновление), None по таймауту или STOP"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return STOP if self.stopping.is_set() else None
+
+    def close(self):
+        pass
+
+
+class RedisQueues:
+    """Очереди шардов в Redis — списки updates:<shard>, общие для всех инстансов"""
+
+    def __init__(self, url, shards):
+        self.url = url
+        self.shards = shards
+        self._redis = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # В рабочий процесс передаются только параметры, соединение у него своё
+        return {'url': self.url, 'shards': self.shards}
+
+    def __setstate__(self, state):
+        self.__init__(state['url'], state['shards'])
+
+    def publish(self, shard, update):
+        with self._lock:
+            if self._redis is None:
+                self._redis = RedisConnection.from_url(self.url)
+        self._redis.execute([('RPUSH', f"updates:{shard}", json.dumps(update, ensure_ascii=False))])
+
+    def backlog(self):
+        """Сколько обновлений ждёт в очередях всех шардов"""
+        with self._lock:
+            if self._redis is None:
+                self._redis = RedisConnection.from_url(self.url)
+        return sum(self._redis.execute([('LLEN', f"updates:{shard}") for shard in range(self.shards)]))
+
+    def close(self):
+        with self._lock:
+            if self._redis is not None:
+                self._redis.close()
+                self._redis = None
+
+    def consumer(self, index, stopping):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        return RedisConsumer(RedisConnection.from_url(self.url), self.shards, worker_id, stopping)
+
+
+class RedisConsumer:
+    """Разбирает шарды по арендам и читает их очереди через BLPOP
+
+    Каждый процесс регистрируется в хэше shard_workers и держит не больше своей
+    доли шардов (ceil(шардов / живых процессов)); лишние отдаёт, свободные забирает.
+    Перед тем как отдать шард, вызывается on_release(shard) — процесс должен
+    дообработать его обновления и сбросить кэш; полученные за один проход шарды
+    передаются в on_acquire(shards) до того, как из их очередей читается первое обновление.
+    """
+
+    def __init__(self, redis, shards, worker_id, stopping, lease_ttl=10.0):
+        self._redis = redis
+        self.shards = shards
+        self.worker_id = worker_id
+        self.stopping = stopping
+        self.lease_ttl = lease_ttl
+        self.owned = set()
+        self.on_acquire = None
+        self.on_release = None
+        self._next_refresh = 0.0
+
+    @staticmethod
+    def _lease_key(shard):
+        return f"lease:shard:{shard}"
+
+    def _live_workers(self, now):
+        _, raw = self._redis.execute([
+            ('HSET', 'shard_workers', self.worker_id, now),
+            ('HGETALL', 'shard_workers'),
+        ])
+        workers = dict(zip(raw[::2], raw[1::2]))
+        stale = [worker for worker, seen in workers.items() if now - float(seen) > self.lease_ttl]
+        if stale:
+            self._redis.execute([('HDEL', 'shard_workers', *stale)])
+        return len(workers) - len(stale)
+
+    def _release(self, shard):
+        self.owned.discard(shard)
+        if self.on_release is not None:
+            self.on_release(shard)
+        self._redis.execute([('EVAL', _DROP_LEASE, 1, self._lease_key(shard), self.worker_id)])
+        logger.info(f"🔀 Шард {shard} отдан")
+
+    def refresh(self):
+        """Продлевает свои аренды, отдаёт лишние шарды и забирает свободные"""
+        now = time.time()
+        ttl_ms = int(self.lease_ttl * 1000)
+        fair_share = math.ceil(self.shards / max(1, self._live_workers(now)))
+        owned = sorted(self.owned)
+        renewed = self._redis.execute([
+            ('EVAL', _RENEW_LEASE, 1, self._lease_key(shard), self.worker_id, ttl_ms) for shard in owned
+        ]) if owned else []
+        for shard, ok in zip(owned, renewed):
+            if not ok:
+                # Аренда истекла и шард уже у другого процесса — наш кэш устарел
+                logger.warning(f"⚠️ Аренда шарда {shard} потеряна")
+                self._release(shard)
+        while len(self.owned) > fair_share:
+            self._release(max(self.owned))
+        acquired_shards = []
+        for shard in range(self.shards):
+            if len(self.owned) >= fair_share:
+                break
+            if shard in self.owned:
+                continue
+            acquired, = self._redis.execute([('SET', self._lease_key(shard), self.worker_id, 'NX', 'PX', ttl_ms)])
+            if acquired is not None:
+                acquired_shards.append(shard)
+                logger.info(f"🔀 Шард {shard} получен")
+        if acquired_shards and self.on_acquire is not None:
+            self.on_acquire(acquired_shards)
+        self.owned.update(acquired_shards)
+
+    def get(self, timeout=1.0):
+        """(шард, обновление), None по таймауту или STOP"""
+        if self.stopping.is_set():
+            return STOP
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+            self._next_refresh = time.monotonic() + self.lease_ttl / 3
+        if not self.owned:
+            time.sleep(timeout)
+            return None
+        keys = [f"updates:{shard}" for shard in sorted(self.owned)]
+        reply, = self._redis.execute([('BLPOP', *keys, max(1, int(timeout)))])
+        if reply is None:
+            return None
+        key, update = reply
+        return int(key.rsplit(':', 1)[1]), update
+
+    def close(self):
+        for shard in sorted(self.owned):
+            self._release(shard)
+        self._redis.execute([('HDEL', 'shard_workers', self.worker_id)])
+        self._redis.close()
+
+
+# === Рабочий процесс ===
+
+class ShardWorker:
+    """Читает очередь шардов и передаёт обновления в обработку, не больше max_in_flight сразу
+
+    submit(update, shard) должен вернуть concurrent.futures.Future,
+    forget(shard) — сбросить кэш пользователей шарда, acquire(shards) — подготовить
+    данные полученных шардов (вызывается до их первого обновления).
+    """
+
+    def __init__(self, consumer, submit, forget, acquire=None, max_in_flight=1000):
+        self.consumer = consumer
+        self.submit = submit
+        self.forget = forget
+        self.acquire = acquire
+        self.processed = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight = {}  # {shard: число обновлений в обработке}
+        self._idle = threading.Condition()
+        consumer.on_acquire = acquire
+        consumer.on_release = self._release
+
+    def _done(self, shard):
+        with self._idle:
+            self._in_flight[shard] -= 1
+            self.processed += 1
+            self._idle.notify_all()
+        self._slots.release()
+
+    def _wait_idle(self, shard=None):
+        with self._idle:
+            if shard is None:
+                self._idle.wait_for(lambda: not any(self._in_flight.values()))
+            else:
+                self._idle.wait_for(lambda: not self._in_flight.get(shard))
+
+    def _release(self, shard):
+        self._wait_idle(shard)
+        self.forget(shard)
+
+    def run(self):
+        if self.acquire is not None and self.consumer.owned:
+            self.acquire(sorted(self.consumer.owned))
+        while True:
+            item = self.consumer.get()
+            if item is STOP:
+                break
+            if item is None:
+                continue
+            shard, update = item
+            self._slots.acquire()
+            with self._idle:
+                self._in_flight[shard] = self._in_flight.get(shard, 0) + 1
+            future = self.submit(update, shard)
+            future.add_done_callback(lambda _, shard=shard: self._done(shard))
+        self._wait_idle()
+        self.consumer.close()
+
+
+class WorkerPool:
+    """Рабочие процессы одного инстанса; упавший процесс перезапускается
+
+    target(queues, index, stopping, reports) — точка входа процесса; в reports он может
+    класть (index, отчёт), последний отчёт каждого процесса отдаёт reports_by_worker().
+    """
+
+    def __init__(self, target, queues, count, context=None):
+        self.context = context or multiprocessing.get_context('spawn')
+        self.target = target
+        self.queues = queues
+        self.count = count
+        self.stopping = self.context.Event()
+        self.reports = self.context.Queue()
+        self._reports = {}  # {номер процесса: последний отчёт}
+        self._processes = [None] * count
+        self._monitor = None
+        self._receiver = None
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=self.target, args=(self.queues, index, self.stopping, self.reports), name=f"shard-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _watch(self):
+        while not self.stopping.wait(1.0):
+            for index, process in enumerate(self._processes):
+                if process.exitcode is not None and not self.stopping.is_set():
+                    logger.error(f"❌ Рабочий процесс {index} завершился с кодом {process.exitcode}, перезапускаем")
+                    self._spawn(index)
+
+    def _receive(self):
+        while not self.stopping.is_set():
+            try:
+                index, report = self.reports.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self._reports[index] = report
+
+    def reports_by_worker(self):
+        """{номер процесса: последний присланный им отчёт}"""
+        return dict(self._reports)
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._watch, name='worker-monitor', daemon=True)
+        self._monitor.start()
+        self._receiver = threading.Thread(target=self._receive, name='worker-reports', daemon=True)
+        self._receiver.start()
+        logger.info(f"👷 Запущено рабочих процессов: {self.count}")
+        return self
+
+    def stop(self, timeout=30.0):
+        """Дожидается обработки уже поставленных обновлений и останавливает процессы"""
+        self.queues.close()
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
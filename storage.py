@@ -0,0 +1,712 @@
+"""Хранилище счётчиков осколков и ожидаемого ввода
+
+Чтение идёт из кэша в памяти процесса, запись — в кэш с пометкой «грязный».
+Фоновый поток раз в flush_interval секунд сбрасывает накопленные изменения
+в бэкенд одной транзакцией, поэтому обработчики не платят fsync за каждое обновление.
+"""
+import logging
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from counters import CounterTable
+
+logger = logging.getLogger(__name__)
+
+
+def _group_rows(rows, chunk_size):
+    """Строки (user_id, shard_type, count), отсортированные по user_id -> пачки [(user_id, counts)]"""
+    chunk, current, counts = [], None, None
+    for user_id, shard_type, count in rows:
+        if user_id != current:
+            if current is not None:
+                chunk.append((current, counts))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            current, counts = user_id, {}
+        counts[shard_type] = count
+    if current is not None:
+        chunk.append((current, counts))
+    if chunk:
+        yield chunk
+
+
+# === Бэкенды ===
+
+class MemoryBackend:
+    """Бэкенд без персистентности (данные живут до перезапуска)"""
+
+    def __init__(self):
+        self._counts = {}
+        self._pending = {}
+        self._meta = {}
+
+    def load(self, user_id):
+        return dict(self._counts.get(user_id, {})), self._pending.get(user_id)
+
+    def load_meta(self, key):
+        return self._meta.get(key)
+
+    def write_batch(self, counts, pending, meta=None):
+        for user_id, user_counts in counts.items():
+            # Как upsert в SQLite и HSET в Redis: заданные счётчики заменяются, остальные остаются.
+            # Словарь не меняется на месте — на этом держится снимок в iter_counts
+            self._counts[user_id] = {**self._counts.get(user_id, {}), **user_counts}
+        for user_id, entry in pending.items():
+            if entry is None:
+                self._pending.pop(user_id, None)
+            else:
+                self._pending[user_id] = entry
+        self._meta.update(meta or {})
+
+    def iter_counts(self, chunk_size=10000):
+        """Пачки [(user_id, counts)] из снимка на момент первого чтения
+
+        write_batch заменяет словарь пользователя целиком, поэтому снимку хватает копии
+        ссылок (около 64 байт на пользователя), сами счётчики не копируются.
+        """
+        snapshot = list(self._counts.items())
+        for start in range(0, len(snapshot), chunk_size):
+            yield [(user_id, dict(counts)) for user_id, counts in snapshot[start:start + chunk_size]]
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """SQLite в режиме WAL: одна транзакция на пачку изменений
+
+    namespace отделяет таблицы другого набора счётчиков в том же файле
+    (например, history_shard_counts для агрегатов журнала).
+    """
+
+    def __init__(self, path, namespace=''):
+        self.path = path
+        prefix = f"{namespace}_" if namespace else ''
+        self._counts_table = f"{prefix}shard_counts"
+        self._pending_table = f"{prefix}pending_input"
+        self._meta_table = f"{prefix}meta"
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # В WAL-режиме NORMAL не делает fsync на каждый коммит
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._counts_table} ("
+                "user_id INTEGER NOT NULL, shard_type TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (user_id, shard_type)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._pending_table} ("
+                "user_id INTEGER PRIMARY KEY, shard_type TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._meta_table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def load(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT shard_type, count FROM {self._counts_table} WHERE user_id = ?", (user_id,)
+            ).fetchall()
+            pending = self._conn.execute(
+                f"SELECT shard_type, expires_at FROM {self._pending_table} WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return dict(rows), pending
+
+    def load_meta(self, key):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self._meta_table} WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def write_batch(self, counts, pending, meta=None):
+        count_rows = [
+            (user_id, shard_type, count)
+            for user_id, user_counts in counts.items()
+            for shard_type, count in user_counts.items()
+        ]
+        pending_set = [(user_id, *entry) for user_id, entry in pending.items() if entry is not None]
+        pending_del = [(user_id,) for user_id, entry in pending.items() if entry is None]
+        meta_rows = list((meta or {}).items())
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT INTO {self._counts_table} (user_id, shard_type, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, shard_type) DO UPDATE SET count = excluded.count",
+                    count_rows
+                )
+                self._conn.executemany(
+                    f"INSERT INTO {self._pending_table} (user_id, shard_type, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET "
+                    "shard_type = excluded.shard_type, expires_at = excluded.expires_at",
+                    pending_set
+                )
+                self._conn.executemany(f"DELETE FROM {self._pending_table} WHERE user_id = ?", pending_del)
+                self._conn.executemany(
+                    f"INSERT INTO {self._meta_table} (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    meta_rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def iter_counts(self, chunk_size=10000):
+        """Пачки [(user_id, counts)] по возрастанию user_id из снимка базы
+
+        Читает через отдельное соединение: в режиме WAL один SELECT видит базу такой,
+        какой она была в его начале, а запись через основное соединение идёт параллельно.
+        """
+        query = f"SELECT user_id, shard_type, count FROM {self._counts_table} ORDER BY user_id"
+        if self.path == ':memory:':
+            # Другое соединение открыло бы другую, пустую базу
+            with self._lock:
+                rows = self._conn.execute(query).fetchall()
+            yield from _group_rows(rows, chunk_size)
+            return
+        reader = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cursor = reader.execute(query)
+            cursor.arraysize = chunk_size
+            yield from _group_rows(cursor, chunk_size)
+        finally:
+            reader.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(RuntimeError):
+    """Ответ Redis с ошибкой (-ERR ...)"""
+
+
+class RedisConnection:
+    """Одно соединение по протоколу Redis (RESP) без сторонних зависимостей
+
+    execute() отправляет команды пайплайном и возвращает ответы; потокобезопасен.
+    Ответы читаются все, даже если среди них есть ошибки, — иначе следующий вызов
+    получил бы чужие ответы. Соединение открывается при первом вызове, после ошибки
+    сети или разбора закрывается и открывается заново при следующем — создание объекта
+    не ждёт Redis.
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=5.0):
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, timeout=5.0):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, parsed.password, timeout)
+
+    @staticmethod
+    def _encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    @staticmethod
+    def _first_error(replies):
+        """Первая ошибка среди ответов, включая вложенные (ответ EXEC — массив)"""
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                return reply
+            if isinstance(reply, list):
+                error = RedisConnection._first_error(reply)
+                if error is not None:
+                    return error
+        return None
+
+    def _connect(self):
+        self._sock = socket.create_connection(self._address, timeout=self._timeout)
+        self._reader = self._sock.makefile('rb')
+        commands = []
+        if self._password:
+            commands.append(('AUTH', self._password))
+        if self._db:
+            commands.append(('SELECT', self._db))
+        if commands:
+            try:
+                self._roundtrip(commands)
+            except RedisError:
+                self._disconnect()
+                raise
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = self._reader = None
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            # Не бросаем сразу: в потоке могут быть ещё ответы этого пайплайна
+            return RedisError(f"Ошибка Redis: {payload.decode('utf-8')}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) < length + 2:
+                raise ConnectionError("Redis закрыл соединение")
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Неизвестный ответ Redis: {line!r}")
+
+    def _roundtrip(self, commands):
+        try:
+            self._sock.sendall(b''.join(self._encode(command) for command in commands))
+            replies = [self._read_reply() for _ in commands]
+        except Exception:
+            # Таймаут, обрыв или мусор в ответе: где мы в потоке ответов — неизвестно
+            self._disconnect()
+            raise
+        error = self._first_error(replies)
+        if error is not None:
+            raise error
+        return replies
+
+    def execute(self, commands):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            return self._roundtrip(commands)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class RedisBackend:
+    """Бэкенд поверх Redis
+
+    Счётчики пользователя — хэш shards:<user_id>, ожидаемый ввод — хэш pending_input
+    со значениями вида «shard_type@expires_at», служебные значения — хэш meta.
+    С namespace ключи получают префикс «<namespace>:». Пачка изменений уходит одним пайплайном.
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=5.0, namespace=''):
+        self._redis = RedisConnection(host, port, db, password, timeout)
+        self._prefix = f"{namespace}:" if namespace else ''
+        self._pending_key = f"{self._prefix}pending_input"
+        self._meta_key = f"{self._prefix}meta"
+
+    def load(self, user_id):
+        raw_counts, pending = self._redis.execute([
+            ('HGETALL', f"{self._prefix}shards:{user_id}"),
+            ('HGET', self._pending_key, user_id),
+        ])
+        counts = {raw_counts[i]: int(raw_counts[i + 1]) for i in range(0, len(raw_counts), 2)}
+        if pending is not None:
+            shard_type, _, expires_at = pending.rpartition('@')
+            pending = (shard_type, float(expires_at))
+        return counts, pending
+
+    def load_meta(self, key):
+        value, = self._redis.execute([('HGET', self._meta_key, key)])
+        return value
+
+    def write_batch(self, counts, pending, meta=None):
+        commands = [('MULTI',)]
+        for user_id, user_counts in counts.items():
+            if user_counts:
+                fields = [item for pair in user_counts.items() for item in pair]
+                commands.append(('HSET', f"{self._prefix}shards:{user_id}", *fields))
+        for user_id, entry in pending.items():
+            if entry is None:
+                commands.append(('HDEL', self._pending_key, user_id))
+            else:
+                commands.append(('HSET', self._pending_key, user_id, f"{entry[0]}@{entry[1]}"))
+        for key, value in (meta or {}).items():
+            commands.append(('HSET', self._meta_key, key, value))
+        commands.append(('EXEC',))
+        self._redis.execute(commands)
+
+    def iter_counts(self, chunk_size=10000):
+        """Пачки [(user_id, counts)] обходом SCAN
+
+        Снимка у Redis нет: пользователь, изменённый во время обхода, попадёт в выгрузку
+        в одном из своих состояний (каждый хэш читается целиком).
+        """
+        cursor = '0'
+        while True:
+            (cursor, keys), = self._redis.execute([
+                ('SCAN', cursor, 'MATCH', f"{self._prefix}shards:*", 'COUNT', chunk_size)
+            ])
+            if keys:
+                replies = self._redis.execute([('HGETALL', key) for key in keys])
+                chunk = [
+                    (int(key.rpartition(':')[2]), {raw[i]: int(raw[i + 1]) for i in range(0, len(raw), 2)})
+                    for key, raw in zip(keys, replies) if raw
+                ]
+                if chunk:
+                    yield chunk
+            if cursor == '0':
+                return
+
+    def close(self):
+        self._redis.close()
+
+
+def create_backend(url, namespace=''):
+    """Создаёт бэкенд по URL: memory://, sqlite:///shards.db, redis://host:port/db
+
+    Бэкенды с разными namespace в одной базе друг друга не видят.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryBackend()
+    if parsed.scheme == 'sqlite':
+        # Как в SQLAlchemy: sqlite:///relative.db, sqlite:////absolute/path.db
+        path = url[len('sqlite://'):]
+        if path.startswith('/'):
+            path = path[1:]
+        return SQLiteBackend(path or ':memory:', namespace)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisBackend(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, parsed.password, namespace=namespace)
+    raise ValueError(f"Неизвестная схема хранилища: {url}")
+
+
+# === Кэш с отложенной записью ===
+
+class ShardStore:
+    """Кэш счётчиков и ожидаемого ввода с пакетной записью в бэкенд
+
+    В кэше держится не больше capacity пользователей: давно не использованные
+    вытесняются (CLOCK, приближение LRU), несохранённые изменения вытесненных
+    уходят в бэкенд со следующей пачкой.
+    Ожидаемый ввод истекает через pending_ttl секунд.
+    Служебные строковые значения (meta) пишутся той же пачкой.
+
+    Промах кэша читает бэкенд под блокировкой кэша. Чтобы не держать её (и event loop)
+    на время запроса к базе, вызывающий код может заранее загрузить пользователя
+    через preload() в пуле потоков.
+    """
+
+    def __init__(self, backend, shard_types, flush_interval=1.0, max_dirty=1000, capacity=50000, pending_ttl=600.0):
+        self.backend = backend
+        self.shard_types = tuple(shard_types)
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.capacity = capacity
+        self.pending_ttl = pending_ttl
+        self._counts = CounterTable(shard_types)  # загруженные пользователи
+        self._pending = OrderedDict()  # {user_id: (shard_type, expires_at)} — по возрастанию expires_at
+        self._dirty_counts = set()
+        self._dirty_pending = set()
+        self._meta = {}  # {key: value} — прочитанные и изменённые служебные значения
+        self._dirty_meta = set()
+        self._write_back = {}  # {user_id: (counts, pending)} — вытеснены, но ещё не записаны
+        self._in_flight = {}   # то же для пачки, которая пишется прямо сейчас
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._epoch = 0  # растёт, когда данные некэшированных пользователей в бэкенде могли измениться
+        self.evictions = 0
+        self.expired_pending = 0
+
+    def _ensure_loaded(self, user_id, loaded=None):
+        if user_id in self._counts:
+            self._counts.touch(user_id)
+            return
+        unsaved = self._write_back.pop(user_id, None) or self._in_flight.get(user_id)
+        if unsaved is not None:
+            counts, pending = dict(unsaved[0]), unsaved[1]
+        elif loaded is not None:
+            counts, pending = loaded
+        else:
+            counts, pending = self.backend.load(user_id)
+        self._counts.insert(user_id, counts)
+        if pending is not None:
+            if pending[1] <= time.time():
+                self._mark_dirty(self._dirty_pending, user_id)
+                self.expired_pending += 1
+            else:
+                self._pending[user_id] = pending
+        while len(self._counts) > self.capacity:
+            self._evict()
+
+    def _evict(self):
+        user_id, counts = self._counts.evict()
+        entry = self._pending.pop(user_id, None)
+        if user_id in self._dirty_counts or user_id in self._dirty_pending:
+            self._write_back[user_id] = (counts, entry)
+            self._wakeup.set()
+        self.evictions += 1
+        self._epoch += 1
+
+    def _mark_dirty(self, dirty, user_id):
+        dirty.add(user_id)
+        if len(self._dirty_counts) + len(self._dirty_pending) >= self.max_dirty:
+            self._wakeup.set()
+
+    def is_cached(self, user_id):
+        """Есть ли пользователь в кэше (без блокировки: ответ может сразу устареть)"""
+        return user_id in self._counts
+
+    def preload(self, user_id):
+        """Загружает пользователя в кэш, читая бэкенд без блокировки кэша
+
+        Для пула потоков: пока идёт запрос к бэкенду, остальные пользователи
+        обслуживаются из кэша. Если за это время кто-то был вытеснен или записан
+        в бэкенд мимо кэша, прочитанное могло устареть — тогда читаем заново под блокировкой.
+        """
+        with self._lock:
+            if user_id in self._counts or user_id in self._write_back or user_id in self._in_flight:
+                return
+            epoch = self._epoch
+        loaded = self.backend.load(user_id)
+        with self._lock:
+            self._ensure_loaded(user_id, loaded if self._epoch == epoch else None)
+
+    # --- Счётчики ---
+
+    def get_counts(self, user_id):
+        """Счётчики пользователя {shard_type: count} (копия)"""
+        with self._lock:
+            self._ensure_loaded(user_id)
+            return self._counts.as_dict(user_id)
+
+    def get_count(self, user_id, shard_type):
+        with self._lock:
+            self._ensure_loaded(user_id)
+            return self._counts.get(user_id, shard_type)
+
+    def set_count(self, user_id, shard_type, count):
+        with self._lock:
+            self._ensure_loaded(user_id)
+            self._counts.set(user_id, shard_type, count)
+            self._mark_dirty(self._dirty_counts, user_id)
+
+    def add(self, user_id, shard_type, delta):
+        """Прибавляет delta к счётчику и возвращает новое значение"""
+        with self._lock:
+            self._ensure_loaded(user_id)
+            new_count = self._counts.add(user_id, shard_type, delta)
+            self._mark_dirty(self._dirty_counts, user_id)
+            return new_count
+
+    # --- Служебные значения ---
+
+    def get_meta(self, key):
+        """Строковое значение по ключу или None"""
+        with self._lock:
+            if key not in self._meta:
+                self._meta[key] = self.backend.load_meta(key)
+            return self._meta[key]
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._meta[key] = value
+            self._dirty_meta.add(key)
+
+    # --- Ожидаемый ввод ---
+
+    def get_pending(self, user_id):
+        with self._lock:
+            self._ensure_loaded(user_id)
+            entry = self._pending.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._expire(user_id)
+                return None
+            return entry[0]
+
+    def set_pending(self, user_id, shard_type):
+        with self._lock:
+            self._ensure_loaded(user_id)
+            self._pending.pop(user_id, None)
+            self._pending[user_id] = (shard_type, time.time() + self.pending_ttl)
+            self._mark_dirty(self._dirty_pending, user_id)
+
+    def clear_pending(self, user_id):
+        with self._lock:
+            self._ensure_loaded(user_id)
+            if self._pending.pop(user_id, None) is not None:
+                self._mark_dirty(self._dirty_pending, user_id)
+
+    def _expire(self, user_id):
+        del self._pending[user_id]
+        self._mark_dirty(self._dirty_pending, user_id)
+        self.expired_pending += 1
+
+    def expire_pending(self):
+        """Удаляет просроченный ожидаемый ввод; возвращает число удалённых"""
+        expired = 0
+        now = time.time()
+        with self._lock:
+            while self._pending:
+                user_id, (_, deadline) = next(iter(self._pending.items()))
+                if deadline > now:
+                    break
+                self._expire(user_id)
+                expired += 1
+        return expired
+
+    def stats(self):
+        """Текущие размеры и счётчики вытеснений"""
+        with self._lock:
+            return {
+                'cached_users': len(self._counts),
+                'pending_inputs': len(self._pending),
+                'dirty': len(self._dirty_counts | self._dirty_pending),
+                'write_back': len(self._write_back),
+                'evictions': self.evictions,
+                'expired_pending': self.expired_pending,
+            }
+
+    # --- Сброс в бэкенд ---
+
+    def _snapshot(self, user_id):
+        if user_id in self._counts:
+            return self._counts.as_dict(user_id), self._pending.get(user_id)
+        return self._write_back[user_id]
+
+    def flush(self):
+        """Записывает все накопленные изменения одной пачкой"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty_counts and not self._dirty_pending and not self._dirty_meta:
+                    return 0
+                dirty_counts, dirty_pending = self._dirty_counts, self._dirty_pending
+                self._in_flight = {user_id: self._snapshot(user_id) for user_id in dirty_counts | dirty_pending}
+                meta = {key: self._meta[key] for key in self._dirty_meta}
+                self._dirty_counts = set()
+                self._dirty_pending = set()
+                self._dirty_meta = set()
+                self._write_back = {}
+            counts = {user_id: self._in_flight[user_id][0] for user_id in dirty_counts}
+            pending = {user_id: self._in_flight[user_id][1] for user_id in dirty_pending}
+            try:
+                self.backend.write_batch(counts, pending, meta)
+            except Exception:
+                # Возвращаем пачку в «грязные», чтобы повторить при следующем сбросе
+                with self._lock:
+                    for user_id, unsaved in self._in_flight.items():
+                        if user_id not in self._counts:
+                            self._write_back.setdefault(user_id, unsaved)
+                    self._dirty_counts.update(dirty_counts)
+                    self._dirty_pending.update(dirty_pending)
+                    self._dirty_meta.update(meta)
+                    self._in_flight = {}
+                raise
+            with self._lock:
+                self._in_flight = {}
+            return len(counts) + len(pending) + len(meta)
+
+    # --- Выгрузка и загрузка ---
+
+    def iter_counts(self, chunk_size=10000):
+        """Все счётчики пачками [(user_id, counts)], не останавливая работу
+
+        Сначала сбрасывает накопленные изменения, затем читает снимок бэкенда;
+        изменения, сделанные после сброса, в выгрузку не попадают.
+        """
+        self.flush()
+        yield from self.backend.iter_counts(chunk_size)
+
+    def import_counts(self, rows):
+        """Записывает счётчики из rows [(user_id, counts)]; возвращает число пользователей
+
+        Счётчики из rows заменяют одноимённые, остальные счётчики пользователя не меняются.
+        Пользователи в кэше обновляются в кэше и уходят в бэкенд со следующей пачкой,
+        остальные пишутся в бэкенд сразу и под блокировкой — чтобы обработчик не прочитал
+        старое значение между проверкой и записью. Поэтому rows — небольшая пачка.
+        """
+        with self._flush_lock:
+            with self._lock:
+                direct = {}
+                for user_id, counts in rows:
+                    if user_id in self._counts:
+                        for shard_type, count in counts.items():
+                            self._counts.set(user_id, shard_type, count)
+                        self._mark_dirty(self._dirty_counts, user_id)
+                    elif user_id in self._write_back:
+                        unsaved_counts, entry = self._write_back[user_id]
+                        self._write_back[user_id] = ({**unsaved_counts, **counts}, entry)
+                    else:
+                        direct[user_id] = dict(counts)
+                if direct:
+                    self.backend.write_batch(direct, {})
+                    self._epoch += 1
+        return len(rows)
+
+    def forget(self, predicate, meta_keys=()):
+        """Сохраняет изменения и убирает из кэша пользователей, для которых predicate(user_id) истинно
+
+        Нужен, когда пользователи переходят к другому процессу: дальше их данные
+        будут заново прочитаны из бэкенда. meta_keys — ключи метаданных, которые
+        тоже ведёт теперь другой процесс (HistoryLog.release передаёт итоги шарда).
+        """
+        self.flush()
+        with self._lock:
+            for user_id in [user_id for user_id in self._counts if predicate(user_id)]:
+                counts = self._counts.remove(user_id)
+                entry = self._pending.pop(user_id, None)
+                if user_id in self._dirty_counts or user_id in self._dirty_pending:
+                    self._write_back[user_id] = (counts, entry)
+            self._epoch += 1
+            for key in meta_keys:
+                if key not in self._dirty_meta:
+                    self._meta.pop(key, None)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.expire_pending()
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи в хранилище: {e}")
+
+    def start(self):
+        """Запускает фоновый поток периодического сброса"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name='store-flush', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Останавливает фоновый сброс, записывает остаток и закрывает бэкенд"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,313 @@
+"""Выгрузка и загрузка счётчиков осколков (и журнала, если он есть) потоком
+
+Форматы:
+- ndjson — строка JSON на запись: заголовок {"format": "raid-shards", ...}, затем
+  {"user_id": 1, "counts": {"shard_blue": 5}} и {"history": [время, user_id, "add"|"reset",
+  тип осколка, редкость или null, число]};
+- binary — MAGIC, заголовок (длина u32 и JSON), секции: тег, число записей u32, записи.
+  Счётчики пользователя — user_id, маска заданных счётчиков и int64 на каждый тип осколка;
+  журнал — записи history.RECORD как есть. Файл завершает тег END, так что обрезанный
+  файл не загрузится молча.
+
+Выгрузка читает снимок (ShardStore.iter_counts, HistoryLog.iter_records), загрузка идёт через
+ShardStore.import_counts и HistoryLog.import_records. В памяти одновременно одна пачка,
+бот продолжает работать. Типы осколков и редкости сопоставляются по именам из заголовка.
+Любая ошибка в выгрузке — ValueError. Счётчики заменяются, поэтому их можно загружать
+повторно; журнал дописывается, поэтому загружается только в пустой.
+
+На живом боте — GET /admin/export и POST /admin/import (см. bot.py), без бота:
+    python transfer.py export backup.bin --format binary
+    python transfer.py import backup.bin
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+
+import storage
+from counters import MAX_COUNT
+from history import ADD, RARITIES, RECORD, RESET, HistoryLog
+
+FORMATS = ('ndjson', 'binary')
+FORMAT_NAME = 'raid-shards'
+VERSION = 1
+MAGIC = b'RSHD\x01'
+HEADER_SIZE = struct.Struct('<I')
+SECTION = struct.Struct('<cI')  # тег, число записей
+COUNTS = b'C'
+HISTORY = b'H'
+END = b'E'
+KINDS = {ADD: 'add', RESET: 'reset'}
+DEFAULT_SHARD_TYPES = ('shard_blue', 'shard_void', 'shard_mythic', 'shard_sacred')
+
+
+def _header(shard_types):
+    return {'format': FORMAT_NAME, 'version': VERSION, 'shard_types': list(shard_types), 'rarities': list(RARITIES)}
+
+
+def _counts_struct(shard_types):
+    return struct.Struct(f'<qB{len(shard_types)}q')
+
+
+# === Выгрузка ===
+
+def _export_ndjson(store, history, chunk_size):
+    shard_types = store.shard_types
+    yield (json.dumps(_header(shard_types)) + '\n').encode('utf-8')
+    # Строки собираются форматированием, без json.dumps на каждую: ключи — имена типов осколков,
+    # экранировать в них нечего, а так выгрузка в несколько раз быстрее
+    for rows in store.iter_counts(chunk_size):
+        yield ''.join(
+            '{"user_id":%d,"counts":{%s}}\n' % (user_id, ','.join('"%s":%d' % item for item in counts.items()))
+            for user_id, counts in rows
+        ).encode('utf-8')
+    if history is None:
+        return
+    shard_names = [f'"{shard_type}"' for shard_type in shard_types]
+    rarity_names = [f'"{rarity}"' for rarity in RARITIES]
+    for data in history.iter_records(chunk_size):
+        yield ''.join(
+            '{"history":[%d,%d,"%s",%s,%s,%d]}\n' % (
+                timestamp, user_id, KINDS[kind], shard_names[shard],
+                rarity_names[rarity] if kind == RESET else 'null', amount
+            )
+            for timestamp, user_id, kind, shard, rarity, amount in RECORD.iter_unpack(data)
+        ).encode('utf-8')
+
+
+def _export_binary(store, history, chunk_size):
+    shard_types = store.shard_types
+    header = json.dumps(_header(shard_types)).encode('utf-8')
+    yield MAGIC + HEADER_SIZE.pack(len(header)) + header
+    pack = _counts_struct(shard_types).pack
+    ordinals = {shard_type: i for i, shard_type in enumerate(shard_types)}
+    zeros = [0] * len(shard_types)
+    for rows in store.iter_counts(chunk_size):
+        parts = [SECTION.pack(COUNTS, len(rows))]
+        for user_id, counts in rows:
+            values, mask = list(zeros), 0
+            for shard_type, count in counts.items():
+                i = ordinals[shard_type]
+                values[i] = count
+                mask |= 1 << i
+            parts.append(pack(user_id, mask, *values))
+        yield b''.join(parts)
+    if history is not None:
+        for data in history.iter_records(chunk_size):
+            yield SECTION.pack(HISTORY, len(data) // RECORD.size) + data
+    yield SECTION.pack(END, 0)
+
+
+def export_stream(store, history=None, format='ndjson', chunk_size=10000):
+    """Генератор байтовых кусков выгрузки: пишется в файл или отдаётся ответом HTTP как есть"""
+    if history is not None and history.shard_types != store.shard_types:
+        raise ValueError("Типы осколков журнала и хранилища не совпадают")
+    if format == 'ndjson':
+        return _export_ndjson(store, history, chunk_size)
+    if format == 'binary':
+        return _export_binary(store, history, chunk_size)
+    raise ValueError(f"Неизвестный формат: {format} (ожидается {' или '.join(FORMATS)})")
+
+
+# === Загрузка ===
+
+class _Importer:
+    """Копит пачки и отдаёт их хранилищу и журналу; считает загруженное"""
+
+    def __init__(self, store, history, chunk_size):
+        self.store = store
+        self.history = history
+        self.chunk_size = chunk_size
+        self.shard_ordinals = {shard_type: i for i, shard_type in enumerate(store.shard_types)}
+        self.rows = []
+        self.records = bytearray()
+        self.result = {'users': 0, 'history': 0, 'skipped_history': 0}
+
+    def check_header(self, header):
+        if not isinstance(header, dict) or header.get('format') != FORMAT_NAME or header.get('version') != VERSION:
+            raise ValueError(f"Неизвестный заголовок выгрузки: {header!r:.200}")
+        for key in ('shard_types', 'rarities'):
+            names = header.get(key)
+            if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                raise ValueError(f"В заголовке выгрузки {key} — не список строк")
+        unknown = set(header['shard_types']) - set(self.shard_ordinals)
+        if unknown:
+            raise ValueError(f"Неизвестные типы осколков: {', '.join(sorted(unknown))}")
+        unknown = set(header['rarities']) - set(RARITIES)
+        if unknown:
+            raise ValueError(f"Неизвестные редкости: {', '.join(sorted(unknown))}")
+
+    def add_counts(self, user_id, counts):
+        if not 0 < user_id <= MAX_COUNT:
+            raise ValueError(f"Неверный id пользователя {user_id}")
+        for shard_type, count in counts.items():
+            if shard_type not in self.shard_ordinals:
+                raise ValueError(f"Неизвестный тип осколка {shard_type} у пользователя {user_id}")
+            if not -MAX_COUNT - 1 <= count <= MAX_COUNT:
+                raise ValueError(f"Счётчик {shard_type} пользователя {user_id} не помещается в int64")
+        self.rows.append((user_id, counts))
+        if len(self.rows) >= self.chunk_size:
+            self.flush_counts()
+
+    def add_history(self, data):
+        if self.history is None:
+            self.result['skipped_history'] += len(data) // RECORD.size
+            return
+        if not self.result['history'] and not self.records and not self.history.is_empty():
+            # Повторная загрузка удвоила бы агрегаты и статистику — записи журнала не отличить от уже загруженных
+            raise ValueError("Журнал не пуст: загрузите журнал в новый инстанс или выгрузку без журнала")
+        self.records += data
+        if len(self.records) >= self.chunk_size * RECORD.size:
+            self.flush_history()
+
+    def flush_counts(self):
+        if self.rows:
+            self.result['users'] += self.store.import_counts(self.rows)
+            self.rows = []
+
+    def flush_history(self):
+        if self.records:
+            self.result['history'] += self.history.import_records(bytes(self.records))
+            self.records = bytearray()
+            self.history.flush()
+
+    def finish(self):
+        self.flush_counts()
+        self.flush_history()
+        return self.result
+
+
+def _import_ndjson(source, first_line, importer):
+    header = json.loads(first_line)
+    importer.check_header(header)
+    ordinals = importer.shard_ordinals
+    rarities = {rarity: i for i, rarity in enumerate(RARITIES)}
+    kinds = {name: kind for kind, name in KINDS.items()}
+    for line_no, line in enumerate(source, start=2):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry, dict):
+                raise TypeError(f"ожидается объект, получено {type(entry).__name__}")
+            if 'history' in entry:
+                timestamp, user_id, kind, shard_type, rarity, amount = entry['history']
+                importer.add_history(RECORD.pack(
+                    timestamp, user_id, kinds[kind], ordinals[shard_type],
+                    rarities[rarity] if rarity is not None else 0, amount
+                ))
+            else:
+                counts = entry['counts']
+                if not isinstance(counts, dict):
+                    raise TypeError(f"counts — {type(counts).__name__}, ожидается объект")
+                importer.add_counts(int(entry['user_id']), {key: int(value) for key, value in counts.items()})
+        except (KeyError, TypeError, ValueError, struct.error) as e:
+            raise ValueError(f"Строка {line_no}: {e!r}") from None
+
+
+def _read_exact(source, size):
+    data = source.read(size)
+    while data is not None and len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    if data is None or len(data) < size:
+        raise ValueError("Выгрузка обрезана")
+    return data
+
+
+def _import_binary(source, importer):
+    try:
+        header = json.loads(_read_exact(source, HEADER_SIZE.unpack(_read_exact(source, HEADER_SIZE.size))[0]))
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Заголовок выгрузки не читается: {e}") from None
+    importer.check_header(header)
+    shard_types = header['shard_types']
+    counts_struct = _counts_struct(shard_types)
+    # Порядковые номера осколков и редкостей в файле -> у нас; совпадают — записи журнала берутся как есть
+    shard_map = [importer.shard_ordinals[shard_type] for shard_type in shard_types]
+    rarity_map = [RARITIES.index(rarity) for rarity in header['rarities']]
+    same_layout = shard_map == list(range(len(shard_map))) and rarity_map == list(range(len(rarity_map)))
+    while True:
+        tag, count = SECTION.unpack(_read_exact(source, SECTION.size))
+        if tag == END:
+            return
+        if tag == COUNTS:
+            data = _read_exact(source, count * counts_struct.size)
+            for user_id, mask, *values in counts_struct.iter_unpack(data):
+                importer.add_counts(user_id, {
+                    shard_type: value for i, (shard_type, value) in enumerate(zip(shard_types, values)) if mask >> i & 1
+                })
+        elif tag == HISTORY:
+            data = _read_exact(source, count * RECORD.size)
+            if not same_layout:
+                try:
+                    data = b''.join(
+                        RECORD.pack(timestamp, user_id, kind, shard_map[shard], rarity_map[rarity] if kind == RESET else 0, amount)
+                        for timestamp, user_id, kind, shard, rarity, amount in RECORD.iter_unpack(data)
+                    )
+                except IndexError:
+                    raise ValueError("Запись журнала с типом осколка или редкостью не из заголовка") from None
+            importer.add_history(data)
+        else:
+            raise ValueError(f"Неизвестная секция {tag!r}")
+
+
+def import_stream(source, store, history=None, chunk_size=10000):
+    """Загружает выгрузку из двоичного потока (файл, тело запроса); формат определяется сам
+
+    Возвращает {'users': ..., 'history': ..., 'skipped_history': ...}; записи журнала
+    пропускаются, если history не передан.
+    """
+    importer = _Importer(store, history, chunk_size)
+    head = _read_exact(source, len(MAGIC))
+    if head == MAGIC:
+        _import_binary(source, importer)
+    else:
+        lines = (line.decode('utf-8') for line in source)
+        _import_ndjson(lines, (head + source.readline()).decode('utf-8'), importer)
+    return importer.finish()
+
+
+# === Командная строка ===
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка счётчиков осколков без запущенного бота")
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('path', help="файл выгрузки, '-' — stdout/stdin")
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='формат выгрузки (загрузка определяет сама)')
+    parser.add_argument('--storage', default=os.getenv('STORAGE_URL', 'sqlite:///shards.db'))
+    parser.add_argument('--history', default=os.getenv('HISTORY_PATH', 'shards_history.log'),
+                        help="журнал осколков; '' — без журнала")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARDS', '1')),
+                        help='на сколько шардов разложен журнал (SHARDS бота с WORKERS); 1 — один файл')
+    parser.add_argument('--shard-types', default=','.join(DEFAULT_SHARD_TYPES))
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    shard_types = tuple(args.shard_types.split(','))
+    store = storage.ShardStore(storage.create_backend(args.storage), shard_types=shard_types)
+    history = HistoryLog(
+        args.history, shard_types, backend=storage.create_backend(args.storage, namespace='history'), shards=args.shards
+    ) if args.history else None
+    try:
+        if args.command == 'export':
+            target = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+            with target:
+                for chunk in export_stream(store, history, args.format, args.chunk_size):
+                    target.write(chunk)
+        else:
+            source = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+            with source:
+                result = import_stream(source, store, history, args.chunk_size)
+            print(json.dumps(result), file=sys.stderr)
+    finally:
+        store.close()
+        if history is not None:
+            history.close()
+
+
+if __name__ == '__main__':
+    main()